@@ -1,9 +1,88 @@
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse
 from transformers import pipeline
+from onnx_backend import sentiment_backend
+from ndjson_batch import batch_response
+from warmup import Readiness
+import asyncio
+import os
 
 app = FastAPI()
 
-sentiment_pipeline = pipeline("sentiment-analysis")
+# SENTIMENT_BACKEND=onnx runs the same model on ONNX Runtime (see onnx_backend.py)
+sentiment_pipeline = sentiment_backend(pipeline("sentiment-analysis"))
+
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "64"))
+
+class MicroBatcher:
+    """Collects concurrent sentences for a short window and runs them as one pipeline batch"""
+
+    def __init__(self, window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE):
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._timer = None
+        # The loop only keeps weak references to tasks, so running batches are held here until done
+        self._tasks = set()
+
+    async def submit(self, sentence):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((sentence, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        sentences = [sentence for sentence, _ in batch]
+        try:
+            # Run the forward pass in a worker thread so the event loop keeps accepting requests
+            results = await asyncio.to_thread(sentiment_pipeline, sentences, batch_size=len(sentences))
+            if len(results) != len(batch):
+                raise RuntimeError("Pipeline returned wrong number of results")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+batcher = MicroBatcher()
+
+# --- Warm-up and probes ---
+readiness = Readiness()
+
+def warm_sentiment(text):
+    sentiment_pipeline(text)
+    sentiment_pipeline([text] * MAX_BATCH_SIZE, batch_size=MAX_BATCH_SIZE)
+
+@app.on_event("startup")
+def start_warmup():
+    readiness.start({"sentiment": warm_sentiment})
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.describe())
 
 @app.post("/analyze")
 async def analyze_api(request: Request):
@@ -17,7 +96,14 @@ async def analyze_api(request: Request):
     if not isinstance(sentence, str):
         raise HTTPException(status_code=400, detail="'sentence' must be a string")
     try:
-        result = sentiment_pipeline(sentence)
+        result = await batcher.submit(sentence)
     except Exception:
         raise HTTPException(status_code=500, detail="Error processing sentence")
-    return result[0]
+    return result
+
+async def run_batch(batch):
+    return await asyncio.to_thread(sentiment_pipeline, batch, batch_size=len(batch))
+
+@app.post("/analyze/batch")
+async def analyze_batch_api(request: Request):
+    return await batch_response(request, run_batch, BATCH_SIZE)
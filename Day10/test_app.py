@@ -1,6 +1,11 @@
 import pytest
+import json
+import asyncio
+import threading
+from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
-from app import app
+from app import app, MicroBatcher
+from warmup import WARMUP_LENGTHS, Readiness
 
 client = TestClient(app)
 
@@ -33,3 +38,185 @@ def test_analyze_non_string_sentence():
     # The transformers pipeline expects a string, so this might raise an error or handle it gracefully
     # We check for 400 due to validation in app.py
     assert response.status_code == 400
+
+
+def test_batcher_groups_concurrent_sentences():
+    def fake_pipeline(sentences, batch_size):
+        return [{"label": "POSITIVE", "score": float(len(s))} for s in sentences]
+
+    async def run():
+        batcher = MicroBatcher(window_ms=50, max_batch_size=8)
+        return await asyncio.gather(*(batcher.submit("x" * i) for i in range(3)))
+
+    with patch("app.sentiment_pipeline", side_effect=fake_pipeline) as mock_pipeline:
+        results = asyncio.run(run())
+    assert mock_pipeline.call_count == 1
+    assert [r["score"] for r in results] == [0.0, 1.0, 2.0]
+
+def test_batcher_flushes_at_max_batch_size():
+    def fake_pipeline(sentences, batch_size):
+        return [{"label": "NEGATIVE", "score": 0.5} for _ in sentences]
+
+    async def run():
+        batcher = MicroBatcher(window_ms=1000, max_batch_size=2)
+        return await asyncio.gather(*(batcher.submit("s") for _ in range(4)))
+
+    with patch("app.sentiment_pipeline", side_effect=fake_pipeline) as mock_pipeline:
+        results = asyncio.run(run())
+    assert mock_pipeline.call_count == 2
+    assert len(results) == 4
+
+def test_batcher_holds_running_batches_until_done():
+    async def run():
+        batcher = MicroBatcher(window_ms=1000, max_batch_size=1)
+        submitted = asyncio.ensure_future(batcher.submit("s"))
+        await asyncio.sleep(0)
+        running = len(batcher._tasks)
+        await submitted
+        await asyncio.sleep(0)
+        return running, len(batcher._tasks)
+
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline):
+        assert asyncio.run(run()) == (1, 0)
+
+def fake_batch_pipeline(sentences, batch_size):
+    return [{"label": "POSITIVE", "score": 0.9} for _ in sentences]
+
+def test_analyze_batch_json_list():
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline) as mock_pipeline, \
+         patch("app.BATCH_SIZE", 2):
+        response = client.post("/analyze/batch", json={"sentences": ["a", "b", "c"]})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert lines[0]["label"] == "POSITIVE"
+    assert mock_pipeline.call_count == 2
+
+def test_analyze_batch_ndjson_upload():
+    body = '{"sentence": "good"}\n"bad"\n\n{"sentence": "ok"}'
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline):
+        response = client.post("/analyze/batch", content=body, headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert len(response.text.splitlines()) == 3
+
+def test_analyze_batch_ndjson_invalid_line():
+    body = '"good"\n123\n'
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline):
+        response = client.post("/analyze/batch", content=body, headers={"content-type": "application/x-ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["index"] == 0
+    assert lines[-1] == {"index": 1, "error": "'sentence' must be a string"}
+
+def test_analyze_batch_ndjson_streams_before_upload_ends():
+    first_rows_sent = asyncio.Event()
+    messages = []
+
+    async def run():
+        chunks = [b'"good"\n"bad"\n', b'"ok"\n']
+
+        async def receive():
+            if len(chunks) == 1:
+                # The rest of the upload only arrives once the first batch's rows went out
+                await asyncio.wait_for(first_rows_sent.wait(), timeout=5)
+            chunk = chunks.pop(0)
+            return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+        async def send(message):
+            messages.append(message)
+            if message.get("body"):
+                first_rows_sent.set()
+
+        scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+                 "method": "POST", "path": "/analyze/batch", "raw_path": b"/analyze/batch", "query_string": b"",
+                 "root_path": "", "scheme": "http", "server": ("test", 80), "client": ("test", 1),
+                 "headers": [(b"content-type", b"application/x-ndjson")]}
+        await app(scope, receive, send)
+
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline), patch("app.BATCH_SIZE", 2):
+        asyncio.run(run())
+    bodies = [message["body"] for message in messages if message.get("body")]
+    assert [len(body.splitlines()) for body in bodies] == [2, 1]
+    assert [json.loads(line)["index"] for body in bodies for line in body.splitlines()] == [0, 1, 2]
+
+def test_ndjson_batches_rejects_overlong_line():
+    from ndjson_batch import ndjson_batches
+
+    class Upload:
+        async def stream(self):
+            for chunk in [b'"good"\n"', b"a" * 64, b'"\n']:
+                yield chunk
+
+    async def collect():
+        return [batch async for batch in ndjson_batches(Upload(), batch_size=8, max_line_bytes=16)]
+    # The unfinished line is rejected once it outgrows the limit, not after it was buffered whole
+    assert asyncio.run(collect()) == [(["good"], {"index": 1, "error": "Line longer than 16 bytes"})]
+
+def test_analyze_batch_missing_sentences():
+    response = client.post("/analyze/batch", json={"sentence": "a"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Missing 'sentences' key"}
+
+def test_analyze_batch_sentences_not_strings():
+    response = client.post("/analyze/batch", json={"sentences": ["a", 1]})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "'sentences' must be a list of strings"}
+
+# Warm-up and probes
+
+class RecordingPipeline:
+    """Records every call, so a test can tell whether a request's call was the pipeline's first (cold) one"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, inputs, batch_size=1):
+        self.calls.append(inputs)
+        count = 1 if isinstance(inputs, str) else len(inputs)
+        return [{"label": "POSITIVE", "score": 0.9}] * count
+
+def test_first_request_is_cold_without_warmup_and_warm_with_it():
+    # Without warm-up (no startup events) the first request is the pipeline's first call and pays its initialization
+    with patch("app.sentiment_pipeline", RecordingPipeline()) as pipeline:
+        assert TestClient(app).post("/analyze", json={"sentence": "I love this product!"}).status_code == 200
+    assert pipeline.calls == [["I love this product!"]]
+
+    readiness = Readiness()
+    with patch("app.sentiment_pipeline", RecordingPipeline()) as pipeline, patch("app.readiness", readiness):
+        with TestClient(app) as warm_client:
+            assert readiness.wait(timeout=10)
+            assert warm_client.get("/readyz").status_code == 200
+            warmup_calls = len(pipeline.calls)
+            assert warm_client.post("/analyze", json={"sentence": "I love this product!"}).status_code == 200
+    # Every warm-up length ran, single and batched, before the request reached the pipeline
+    assert [len(text.split()) for text in pipeline.calls if isinstance(text, str)] == WARMUP_LENGTHS
+    assert warmup_calls == 2 * len(WARMUP_LENGTHS)
+    assert pipeline.calls[warmup_calls:] == [["I love this product!"]]
+
+def test_healthz():
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+def test_readyz_waits_for_warmup():
+    readiness = Readiness()
+    release = threading.Event()
+    with patch("app.readiness", readiness):
+        readiness.start({"sentiment": lambda text: release.wait()}, enabled=True)
+        response = client.get("/readyz")
+        assert response.status_code == 503
+        assert response.json()["status"] == "warming_up"
+        release.set()
+        assert readiness.wait(timeout=5)
+        response = client.get("/readyz")
+    assert response.status_code == 200
+    assert set(response.json()["warmup_ms"]) == {f"sentiment/{length}" for length in WARMUP_LENGTHS}
+
+def test_readyz_reports_failed_warmup():
+    readiness = Readiness()
+    with patch("app.readiness", readiness):
+        readiness.run({"sentiment": MagicMock(side_effect=RuntimeError("model missing"))})
+        response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["status"] == "failed"
+    assert response.json()["error"] == "model missing"
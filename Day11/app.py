@@ -1,57 +1,256 @@
-import time
+import argparse
 import json
-from transformers import AutoTokenizer, AutoModel
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
 import torch
+import transformers
+from transformers import (
+    AutoModel,
+    AutoModelForCausalLM,
+    AutoModelForQuestionAnswering,
+    AutoModelForSeq2SeqLM,
+    AutoModelForSequenceClassification,
+    AutoTokenizer,
+)
 
-NUM_SENTENCES = 50
 OUTPUT_FILE = "model_performance.json"
+BASELINE_FILE = "baseline.json"
+
+BATCH_SIZES = [1, 8, 32]
+SEQUENCE_LENGTHS = [16, 128, 512]
+THREAD_COUNTS = sorted({1, torch.get_num_threads()})
+WARMUP_ITERATIONS = 3
+ITERATIONS = 20
+GENERATE_TOKENS = 16
+REGRESSION_TOLERANCE = 0.10
+SEED = 0
+
+# Every model the other days serve, with how they are called there
+MODELS = {
+    "sst2": {"path": "distilbert-base-uncased-finetuned-sst-2-english", "auto": AutoModelForSequenceClassification, "mode": "forward"},
+    "bart-large-cnn": {"path": "facebook/bart-large-cnn", "auto": AutoModelForSeq2SeqLM, "mode": "generate"},
+    "flan-t5-base": {"path": "google/flan-t5-base", "auto": AutoModelForSeq2SeqLM, "mode": "generate"},
+    "bloom-560m": {"path": "bigscience/bloom-560m", "auto": AutoModelForCausalLM, "mode": "generate"},
+    "roberta-squad2": {"path": "deepset/roberta-base-squad2", "auto": AutoModelForQuestionAnswering, "mode": "qa"},
+    "minilm": {"path": "sentence-transformers/all-MiniLM-L6-v2", "auto": AutoModel, "mode": "forward"},
+    "bert": {"path": "bert-base-uncased", "auto": AutoModel, "mode": "forward"},
+    "distilbert": {"path": "distilbert-base-uncased", "auto": AutoModel, "mode": "forward"},
+}
+
+WORDS = (
+    "model data service request latency batch token sentence summary answer question context memory thread "
+    "the a of and to in is was for on with as by at from that this it be are not good bad fast slow new old "
+    "users report results quickly because every deployment depends on stable predictable performance"
+).split()
+
+def synthetic_texts(count, words, seed=SEED):
+    """`count` different texts of `words` words, the same on every run"""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(count)]
+
+def make_inputs(tokenizer, mode, batch_size, seq_len, seed=SEED):
+    """Tokenized batch padded/truncated to exactly seq_len tokens (prompt tokens for generation)"""
+    texts = synthetic_texts(batch_size, seq_len, seed)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    if mode == "qa":
+        questions = synthetic_texts(batch_size, 8, seed + 1)
+        return tokenizer(questions, texts, padding="max_length", truncation="only_second", max_length=seq_len, return_tensors="pt")
+    return tokenizer(texts, padding="max_length", truncation=True, max_length=seq_len, return_tensors="pt")
 
-def main():
-    sentences = [f"This is sentence number {i}" for i in range(NUM_SENTENCES)]
+def load_model(name, spec=None):
+    spec = spec or MODELS[name]
+    tokenizer = AutoTokenizer.from_pretrained(spec["path"])
+    model = spec["auto"].from_pretrained(spec["path"])
+    model.eval()
+    return tokenizer, model
 
-    models = {
-        "BERT": "bert-base-uncased",
-        "DistilBERT": "distilbert-base-uncased"
+def run_once(model, mode, inputs, generate_tokens=GENERATE_TOKENS):
+    if mode == "generate":
+        # min_new_tokens pins the output length, so early EOS doesn't make runs incomparable
+        pad_token_id = model.config.pad_token_id if model.config.pad_token_id is not None else model.config.eos_token_id
+        model.generate(**inputs, max_new_tokens=generate_tokens, min_new_tokens=generate_tokens, do_sample=False, pad_token_id=pad_token_id)
+    else:
+        model(**inputs)
+
+def reset_peak_rss():
+    """Restarts this process's peak RSS from its current RSS, so the next reading covers one configuration (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    # VmHWM is the peak since reset_peak_rss(); ru_maxrss, the fallback, is the peak over the process lifetime
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def summarize_timings(timings, batch_size):
+    timings = np.asarray(timings)
+    p50, p90, p99 = np.percentile(timings, [50, 90, 99])
+    return {
+        "p50_ms": round(p50 * 1000, 3),
+        "p90_ms": round(p90 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+        "mean_ms": round(timings.mean() * 1000, 3),
+        "throughput_items_per_sec": round(batch_size / timings.mean(), 2),
     }
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+def benchmark_model(name, tokenizer, model, mode, batch_sizes=BATCH_SIZES, seq_lens=SEQUENCE_LENGTHS,
+                    thread_counts=THREAD_COUNTS, warmup=WARMUP_ITERATIONS, iterations=ITERATIONS):
+    """Times every (threads, batch size, sequence length) configuration of one loaded model.
+
+    peak_rss_mb is the peak of that configuration alone (loaded weights included) where the
+    peak can be reset; elsewhere it is the process's lifetime peak, and peak_rss_scope says which.
+    """
+    max_len = getattr(tokenizer, "model_max_length", None) or max(seq_lens)
+    rows = []
+    with torch.inference_mode():
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for batch_size in batch_sizes:
+                for seq_len in seq_lens:
+                    if seq_len > max_len:
+                        continue
+                    inputs = make_inputs(tokenizer, mode, batch_size, seq_len)
+                    per_configuration = reset_peak_rss()
+                    for _ in range(warmup):
+                        run_once(model, mode, inputs)
+                    timings = []
+                    for _ in range(iterations):
+                        start = time.perf_counter()
+                        run_once(model, mode, inputs)
+                        timings.append(time.perf_counter() - start)
+                    rows.append({
+                        "model": name,
+                        "threads": threads,
+                        "batch_size": batch_size,
+                        "seq_len": seq_len,
+                        **summarize_timings(timings, batch_size),
+                        "peak_rss_mb": peak_rss_mb(),
+                        "peak_rss_scope": "configuration" if per_configuration else "process",
+                    })
+    return rows
 
-    results = {}
+def benchmark_named_model(name, config):
+    torch.manual_seed(SEED)
+    tokenizer, model = load_model(name)
+    return benchmark_model(name, tokenizer, model, MODELS[name]["mode"], **config)
 
-    for model_name, model_path in models.items():
-        print(f"Loading {model_name}...")
+def run_suite(names, config, isolate=True):
+    """Benchmarks each model; with isolate, in its own fresh process so memory and thread state are per model"""
+    results = []
+    for name in names:
+        print(f"Benchmarking {name}...")
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                results.extend(pool.submit(benchmark_named_model, name, config).result())
+        else:
+            results.extend(benchmark_named_model(name, config))
+    return results
 
-        tokenizer = AutoTokenizer.from_pretrained(model_path)
-        model = AutoModel.from_pretrained(model_path).to(device)
-        model.eval()
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "device": "cpu",
+        "seed": SEED,
+    }
+
+def row_key(row):
+    return (row["model"], row["threads"], row["batch_size"], row["seq_len"])
 
-        print(f"Running inference for {model_name}...")
+def compare_to_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Configurations whose p50 latency rose or throughput fell by more than `tolerance` against the baseline"""
+    previous = {row_key(row): row for row in baseline}
+    regressions = []
+    for row in results:
+        before = previous.get(row_key(row))
+        if before is None:
+            continue
+        latency_change = row["p50_ms"] / before["p50_ms"] - 1
+        throughput_change = row["throughput_items_per_sec"] / before["throughput_items_per_sec"] - 1
+        if latency_change > tolerance or throughput_change < -tolerance:
+            regressions.append({
+                "model": row["model"],
+                "threads": row["threads"],
+                "batch_size": row["batch_size"],
+                "seq_len": row["seq_len"],
+                "baseline_p50_ms": before["p50_ms"],
+                "p50_ms": row["p50_ms"],
+                "latency_change": round(latency_change, 4),
+                "throughput_change": round(throughput_change, 4),
+            })
+    return regressions
 
-        total_time = 0.0
-        with torch.no_grad():
-            for sentence in sentences:
-                inputs = tokenizer(sentence, return_tensors="pt").to(device)
-                
-                start_time = time.perf_counter()
-                _ = model(**inputs)
-                end_time = time.perf_counter()
-                
-                total_time += (end_time - start_time)
-        
-        avg_time = total_time / NUM_SENTENCES
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency, throughput and memory benchmark of every model in this repo")
+    parser.add_argument("--models", nargs="+", choices=sorted(MODELS), default=sorted(MODELS))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=SEQUENCE_LENGTHS)
+    parser.add_argument("--threads", type=int, nargs="+", default=THREAD_COUNTS)
+    parser.add_argument("--warmup", type=int, default=WARMUP_ITERATIONS)
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="results to compare against, if the file exists")
+    parser.add_argument("--save-baseline", action="store_true", help="also store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--no-isolate", action="store_true", help="run every model in this process")
+    args = parser.parse_args(argv)
+
+    config = {
+        "batch_sizes": args.batch_sizes,
+        "seq_lens": args.seq_lens,
+        "thread_counts": args.threads,
+        "warmup": args.warmup,
+        "iterations": args.iterations,
+    }
+    results = run_suite(args.models, config, isolate=not args.no_isolate)
+    report = {"environment": environment(), "config": config, "results": results}
 
-        results[model_name] = {
-            "total_sentences": NUM_SENTENCES,
-            "total_time_sec": round(total_time, 4),
-            "avg_inference_time_sec": round(avg_time, 4),
-            "device": str(device)
-        }
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            regressions = compare_to_baseline(results, json.load(f)["results"], args.tolerance)
+        report["regressions"] = regressions
 
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(results, f, indent=4)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=4)
 
-    print(f"\n✅ Benchmark completed! Results saved to '{OUTPUT_FILE}'")
-    print(json.dumps(results, indent=4))
+    for row in results:
+        print(f"{row['model']:<15} threads={row['threads']:<3} batch={row['batch_size']:<3} seq={row['seq_len']:<4} "
+              f"p50={row['p50_ms']:.2f}ms p99={row['p99_ms']:.2f}ms {row['throughput_items_per_sec']:.1f}/s "
+              f"peak rss={row['peak_rss_mb']}MB ({row['peak_rss_scope']})")
+    print(f"\n✅ Benchmark completed! Results saved to '{args.output}'")
+    for regression in regressions:
+        print(f"⚠️  Regression: {regression['model']} threads={regression['threads']} batch={regression['batch_size']} "
+              f"seq={regression['seq_len']}: p50 {regression['baseline_p50_ms']}ms -> {regression['p50_ms']}ms")
+    return 1 if regressions else 0
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
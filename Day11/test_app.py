@@ -2,7 +2,9 @@ import os
 import json
 import pytest
 from unittest import mock
-from unittest.mock import MagicMock
+
+import torch
+from transformers import BloomConfig, BloomForCausalLM, DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizerFast
 
 import app
 
@@ -15,103 +17,113 @@ def cleanup_output_file():
     if os.path.exists(app.OUTPUT_FILE):
         os.remove(app.OUTPUT_FILE)
 
-def test_main_runs_and_creates_output_file():
-    # Mock tokenizer and model to speed up test and avoid downloading models
-    dummy_inputs = MagicMock()
-    dummy_inputs.to.return_value = dummy_inputs
-
-    dummy_tokenizer = MagicMock()
-    dummy_tokenizer.return_value = dummy_inputs
-
-    dummy_model = MagicMock()
-    dummy_model.to.return_value = dummy_model
-    dummy_model.eval.return_value = None
-    dummy_model.return_value = "dummy_output"
-
-    # Mock torch.no_grad as a context manager
-    no_grad_mock = MagicMock()
-    no_grad_mock.__enter__ = MagicMock(return_value=None)
-    no_grad_mock.__exit__ = MagicMock(return_value=None)
-
-    with mock.patch('app.AutoTokenizer.from_pretrained', return_value=dummy_tokenizer), \
-         mock.patch('app.AutoModel.from_pretrained', return_value=dummy_model), \
-         mock.patch('app.torch.no_grad', return_value=no_grad_mock), \
-         mock.patch('app.torch.cuda.is_available', return_value=False), \
-         mock.patch('app.torch.device', return_value='cpu'):
-
-        app.main()
-
-    # Check output file created
-    assert os.path.exists(app.OUTPUT_FILE)
-
-    # Check contents of output file
+@pytest.fixture
+def tiny_tokenizer(tmp_path):
+    # Word-level vocabulary over the benchmark's synthetic words, so no download is needed
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(set(app.WORDS))))
+    return DistilBertTokenizerFast(str(vocab))
+
+def tiny_classifier(tokenizer):
+    torch.manual_seed(0)
+    config = DistilBertConfig(vocab_size=tokenizer.vocab_size, dim=32, hidden_dim=64, n_layers=2, n_heads=2)
+    return DistilBertForSequenceClassification(config).eval()
+
+def tiny_causal_lm(tokenizer):
+    torch.manual_seed(0)
+    config = BloomConfig(vocab_size=tokenizer.vocab_size, hidden_size=32, n_layer=2, n_head=2,
+                         pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.sep_token_id)
+    return BloomForCausalLM(config).eval()
+
+def row(model="sst2", p50=10.0, throughput=100.0, batch_size=1, seq_len=16, threads=1):
+    return {"model": model, "threads": threads, "batch_size": batch_size, "seq_len": seq_len,
+            "p50_ms": p50, "p90_ms": p50, "p99_ms": p50, "mean_ms": p50,
+            "throughput_items_per_sec": throughput, "peak_rss_mb": 100.0, "peak_rss_scope": "configuration"}
+
+def test_make_inputs_have_exact_sequence_length(tiny_tokenizer):
+    inputs = app.make_inputs(tiny_tokenizer, "forward", batch_size=3, seq_len=16)
+    assert tuple(inputs["input_ids"].shape) == (3, 16)
+    # Inputs are varied across the batch but identical between runs
+    assert not torch.equal(inputs["input_ids"][0], inputs["input_ids"][1])
+    assert torch.equal(inputs["input_ids"], app.make_inputs(tiny_tokenizer, "forward", 3, 16)["input_ids"])
+    qa_inputs = app.make_inputs(tiny_tokenizer, "qa", batch_size=2, seq_len=32)
+    assert tuple(qa_inputs["input_ids"].shape) == (2, 32)
+
+def test_benchmark_model_sweeps_every_configuration(tiny_tokenizer):
+    rows = app.benchmark_model("tiny", tiny_tokenizer, tiny_classifier(tiny_tokenizer), "forward",
+                               batch_sizes=[1, 4], seq_lens=[8, 32], thread_counts=[1], warmup=1, iterations=5)
+    assert [(r["batch_size"], r["seq_len"]) for r in rows] == [(1, 8), (1, 32), (4, 8), (4, 32)]
+    for r in rows:
+        assert 0 < r["p50_ms"] <= r["p90_ms"] <= r["p99_ms"]
+        assert r["throughput_items_per_sec"] > 0
+        assert r["peak_rss_mb"] > 0
+        assert r["peak_rss_scope"] == ("configuration" if os.path.exists("/proc/self/clear_refs") else "process")
+
+def test_benchmark_generate_mode(tiny_tokenizer):
+    model = tiny_causal_lm(tiny_tokenizer)
+    with mock.patch.object(model, "generate", wraps=model.generate) as generate:
+        rows = app.benchmark_model("tiny-lm", tiny_tokenizer, model, "generate",
+                                   batch_sizes=[2], seq_lens=[8], thread_counts=[1], warmup=1, iterations=2)
+    assert len(rows) == 1
+    assert generate.call_count == 3
+    assert generate.call_args.kwargs["min_new_tokens"] == app.GENERATE_TOKENS
+
+def test_peak_rss_resets_between_configurations():
+    if not app.reset_peak_rss():
+        pytest.skip("peak RSS can only be reset on Linux")
+    buffer = torch.ones(64 * 1024 * 1024, dtype=torch.uint8)
+    large = app.peak_rss_mb()
+    del buffer
+    assert app.reset_peak_rss()
+    # A later, smaller configuration no longer reports the earlier peak
+    assert app.peak_rss_mb() < large - 32
+
+def test_summarize_timings_percentiles():
+    summary = app.summarize_timings([0.01] * 98 + [0.1, 0.2], batch_size=8)
+    assert summary["p50_ms"] == 10.0
+    assert summary["p90_ms"] == 10.0
+    assert 100.0 <= summary["p99_ms"] <= 200.0
+    assert summary["throughput_items_per_sec"] == pytest.approx(8 / 0.0128, rel=1e-3)
+
+def test_compare_to_baseline_flags_regressions():
+    baseline = [row(p50=10.0, throughput=100.0), row(batch_size=8, p50=20.0, throughput=400.0)]
+    results = [
+        row(p50=10.5, throughput=95.0),                     # within tolerance
+        row(batch_size=8, p50=25.0, throughput=320.0),      # slower
+        row(batch_size=32, p50=50.0, throughput=640.0),     # not in the baseline
+    ]
+    regressions = app.compare_to_baseline(results, baseline, tolerance=0.10)
+    assert len(regressions) == 1
+    assert regressions[0]["batch_size"] == 8
+    assert regressions[0]["latency_change"] == 0.25
+    assert regressions[0]["throughput_change"] == -0.2
+
+def test_main_writes_report_and_flags_regression(tmp_path, capsys):
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({"results": [row(p50=5.0, throughput=200.0)]}))
+    with mock.patch("app.run_suite", return_value=[row()]) as run_suite:
+        exit_code = app.main(["--models", "sst2", "--batch-sizes", "1", "--seq-lens", "16", "--threads", "1",
+                              "--baseline", str(baseline), "--no-isolate"])
+
+    assert exit_code == 1
+    run_suite.assert_called_once_with(["sst2"], {"batch_sizes": [1], "seq_lens": [16], "thread_counts": [1],
+                                                 "warmup": app.WARMUP_ITERATIONS, "iterations": app.ITERATIONS},
+                                      isolate=False)
     with open(app.OUTPUT_FILE, "r") as f:
-        data = json.load(f)
-
-    assert "BERT" in data
-    assert "DistilBERT" in data
-
-    for model_name in ["BERT", "DistilBERT"]:
-        model_data = data[model_name]
-        assert model_data["total_sentences"] == app.NUM_SENTENCES
-        assert model_data["total_time_sec"] >= 0
-        assert model_data["avg_inference_time_sec"] >= 0
-        assert "device" in model_data
-
-def test_main_prints_benchmark_message(capsys):
-    dummy_inputs = MagicMock()
-    dummy_inputs.to.return_value = dummy_inputs
-
-    dummy_tokenizer = MagicMock()
-    dummy_tokenizer.return_value = dummy_inputs
-
-    dummy_model = MagicMock()
-    dummy_model.to.return_value = dummy_model
-    dummy_model.eval.return_value = None
-    dummy_model.return_value = "dummy_output"
-
-    # Mock torch.no_grad as a context manager
-    no_grad_mock = MagicMock()
-    no_grad_mock.__enter__ = MagicMock(return_value=None)
-    no_grad_mock.__exit__ = MagicMock(return_value=None)
-
-    with mock.patch('app.AutoTokenizer.from_pretrained', return_value=dummy_tokenizer), \
-         mock.patch('app.AutoModel.from_pretrained', return_value=dummy_model), \
-         mock.patch('app.torch.no_grad', return_value=no_grad_mock), \
-         mock.patch('app.torch.cuda.is_available', return_value=False), \
-         mock.patch('app.torch.device', return_value='cpu'):
-
-        app.main()
-
+        report = json.load(f)
+    assert report["results"] == [row()]
+    assert report["environment"]["torch"] == torch.__version__
+    assert len(report["regressions"]) == 1
     captured = capsys.readouterr()
     assert "✅ Benchmark completed! Results saved to" in captured.out
-
-def test_main_with_cuda_device():
-    dummy_inputs = MagicMock()
-    dummy_inputs.to.return_value = dummy_inputs
-
-    dummy_tokenizer = MagicMock()
-    dummy_tokenizer.return_value = dummy_inputs
-
-    dummy_model = MagicMock()
-    dummy_model.to.return_value = dummy_model
-    dummy_model.eval.return_value = None
-    dummy_model.return_value = "dummy_output"
-
-    no_grad_mock = MagicMock()
-    no_grad_mock.__enter__ = MagicMock(return_value=None)
-    no_grad_mock.__exit__ = MagicMock(return_value=None)
-
-    with mock.patch('app.AutoTokenizer.from_pretrained', return_value=dummy_tokenizer), \
-         mock.patch('app.AutoModel.from_pretrained', return_value=dummy_model), \
-         mock.patch('app.torch.no_grad', return_value=no_grad_mock), \
-         mock.patch('app.torch.cuda.is_available', return_value=True), \
-         mock.patch('app.torch.device', return_value='cuda'):
-
-        app.main()
-
-    with open(app.OUTPUT_FILE, "r") as f:
-        data = json.load(f)
-
-    for model_name in ["BERT", "DistilBERT"]:
-        assert data[model_name]["device"] == "cuda"
+    assert "Regression: sst2" in captured.out
+
+def test_main_saves_baseline(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    with mock.patch("app.run_suite", return_value=[row()]):
+        assert app.main(["--models", "sst2", "--baseline", str(baseline), "--save-baseline"]) == 0
+    with open(baseline, "r") as f:
+        assert json.load(f)["results"] == [row()]
+    # An identical rerun is not a regression
+    with mock.patch("app.run_suite", return_value=[row()]):
+        assert app.main(["--models", "sst2", "--baseline", str(baseline)]) == 0
@@ -1,10 +1,35 @@
 from fastapi import FastAPI, Request, HTTPException
 from transformers import pipeline
+import asyncio
+import os
+from inference import InferenceExecutor
+from registry import ModelRegistry
 
 app = FastAPI()
 
-sentiment_pipeline = pipeline("sentiment-analysis")
-summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
+# Models load on first use and are evicted LRU-first beyond MODEL_MEMORY_BUDGET_MB (see registry.py)
+registry = ModelRegistry()
+registry.register("sentiment", lambda: pipeline("sentiment-analysis"))
+registry.register("summarizer", lambda: pipeline("summarization", model="facebook/bart-large-cnn"))
+sentiment_pipeline = registry.lazy("sentiment")
+summarizer = registry.lazy("summarizer")
+
+# --- Inference executor (see inference.py) ---
+executor = InferenceExecutor()
+
+@app.on_event("startup")
+def start_executor():
+    executor.start()
+
+@app.get("/models")
+def list_models():
+    return registry.describe()
+
+def analyze_sentence(sentence):
+    return sentiment_pipeline(sentence)
+
+def summarize(sentence):
+    return summarizer(sentence, max_length=130, min_length=30, do_sample=False)
 
 @app.post("/sentiment")
 async def analyze_api(request: Request):
@@ -18,7 +43,9 @@ async def analyze_api(request: Request):
     if not isinstance(sentence, str):
         raise HTTPException(status_code=400, detail="'sentence' must be a string")
     try:
-        result = sentiment_pipeline(sentence)
+        result = await executor.run(analyze_sentence, sentence)
+    except HTTPException:
+        raise
     except Exception:
         raise HTTPException(status_code=500, detail="Error processing sentence")
     return result[0]
@@ -35,7 +62,9 @@ async def analyze_api(request: Request):
     if not isinstance(sentence, str):
         raise HTTPException(status_code=400, detail="'sentence' must be a string")
     try:
-        result = summarizer(sentence, max_length=130, min_length=30, do_sample=False)
+        result = await executor.run(summarize, sentence)
+    except HTTPException:
+        raise
     except Exception:
         raise HTTPException(status_code=500, detail="Error processing sentence")
     return result[0]
\ No newline at end of file
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from multiprocessing import get_context
+from threading import BrokenBarrierError
+
+import torch
+from fastapi import HTTPException
+
+# Each model call already uses torch's intra-op threads, so only run as many calls at once as fit on the cores
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(1, (os.cpu_count() or 1) // torch.get_num_threads()))))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))
+INFERENCE_PROCESS_POOL = os.getenv("INFERENCE_PROCESS_POOL", "0") == "1"
+INFERENCE_START_METHOD = os.getenv("INFERENCE_START_METHOD", "spawn")
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+# Covers the spawn, import and model load of every worker the first broadcast waits for
+INFERENCE_BROADCAST_TIMEOUT = float(os.getenv("INFERENCE_BROADCAST_TIMEOUT", "300"))
+
+
+# Set in each pool worker by _init_worker
+_worker_barrier = None
+
+
+def _init_worker(barrier):
+    global _worker_barrier
+    _worker_barrier = barrier
+
+
+def _run_on_each_worker(timeout, fn, *args):
+    # A call only passes once every worker holds one, so `workers` calls land on `workers` different processes.
+    # If one never arrives the wait breaks the barrier, failing the calls already waiting at it too.
+    _worker_barrier.wait(timeout)
+    return fn(*args)
+
+
+def server_busy():
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, try again later",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+
+class InferenceExecutor:
+    """Runs blocking model calls off the event loop and sheds load once the queue is full.
+
+    With use_processes the calls run in a process pool started with `spawn` or
+    `forkserver`, never `fork`: by the time it starts, the server already runs
+    uvicorn's and torch's (OpenMP) threads, and forking a multithreaded torch
+    process can deadlock the child. Each worker therefore imports the app and
+    loads its own copy of the weights, so the pool costs one model per worker.
+    start() launches the workers at startup instead of on the first request, and
+    broadcast() runs a function (e.g. a warm-up) once in every one of them.
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS, queue_size=INFERENCE_QUEUE_SIZE, use_processes=INFERENCE_PROCESS_POOL,
+                 start_method=INFERENCE_START_METHOD, broadcast_timeout=INFERENCE_BROADCAST_TIMEOUT):
+        if use_processes:
+            if start_method not in ("spawn", "forkserver"):
+                raise ValueError(f"Unsupported start method for inference workers: {start_method}")
+            context = get_context(start_method)
+            self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                            initargs=(context.Barrier(workers),))
+            # Calls that have to stay in this process still get a bounded pool, not the loop's default executor
+            self.local_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        else:
+            self.pool = self.local_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self.workers = workers
+        self.use_processes = use_processes
+        self.broadcast_timeout = broadcast_timeout
+        self.capacity = workers + queue_size
+        self.pending = 0
+
+    def start(self):
+        """Starts every worker process now, so the first requests don't wait for them"""
+        self.broadcast(os.getpid)
+
+    def broadcast(self, fn, *args):
+        """Runs fn(*args) once in each worker process (once in this process with threads) and returns the results.
+
+        Broadcasts must not overlap: the workers of two concurrent ones could
+        meet at the same barrier and run one function twice and the other not.
+        Raises RuntimeError if not every worker reaches the barrier within
+        broadcast_timeout (e.g. one is stuck in a long call). The barrier stays
+        broken after that, so later broadcasts on this executor fail the same way.
+        """
+        if not self.use_processes:
+            return [fn(*args)]
+        deadline = time.monotonic() + self.broadcast_timeout
+        # Each submit to a pool without idle workers launches another process, up to max_workers
+        futures = [self.pool.submit(_run_on_each_worker, self.broadcast_timeout, fn, *args) for _ in range(self.workers)]
+        try:
+            return [future.result(timeout=max(0, deadline - time.monotonic())) for future in futures]
+        except (BrokenBarrierError, FutureTimeoutError) as e:
+            for future in futures:
+                future.cancel()
+            raise RuntimeError(
+                f"Broadcast of {fn.__name__} did not reach all {self.workers} inference workers "
+                f"within {self.broadcast_timeout}s"
+            ) from e
+
+    def check_capacity(self):
+        if self.pending >= self.capacity:
+            raise server_busy()
+
+    async def run(self, fn, *args, in_process=False):
+        # Calls that share objects with the caller (e.g. a streamer) can't be pickled into a worker process
+        self.check_capacity()
+        pool = self.local_pool if in_process else self.pool
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        finally:
+            self.pending -= 1
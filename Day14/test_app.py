@@ -63,3 +63,15 @@ def test_summary_pipeline_error(mock_summarizer):
     response = client.post("/summary", json={"sentence": "test"})
     assert response.status_code == 500
     assert response.json() == {"detail": "Error processing sentence"}
+
+def test_summary_busy():
+    with patch("app.executor.capacity", 0):
+        response = client.post("/summary", json={"sentence": "Some long text."})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert response.json() == {"detail": "Server is busy, try again later"}
+
+def test_models_are_loaded_lazily():
+    response = client.get("/models")
+    assert response.status_code == 200
+    assert response.json()["registered"] == ["sentiment", "summarizer"]
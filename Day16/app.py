@@ -4,6 +4,9 @@ model_name = "google/flan-t5-base"
 tokenizer = AutoTokenizer.from_pretrained(model_name)
 model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
 
+SUMMARY_PROMPT = "Summarize the following text in 3 concise sentences:\n\n{text}"
+KEYWORDS_PROMPT = "Extract 5 important keywords from this summary:\n\n{summary}\n\nKeywords:"
+
 def run_model(prompt):
     inputs = tokenizer(prompt, return_tensors="pt", truncation=True)
     outputs = model.generate(
@@ -15,11 +18,11 @@ def run_model(prompt):
     return tokenizer.decode(outputs[0], skip_special_tokens=True)
 
 def summarize_text(text):
-    prompt = f"Summarize the following text in 3 concise sentences:\n\n{text}"
+    prompt = SUMMARY_PROMPT.format(text=text)
     return run_model(prompt)
 
 def extract_keywords(summary):
-    prompt = f"Extract 5 important keywords from this summary:\n\n{summary}\n\nKeywords:"
+    prompt = KEYWORDS_PROMPT.format(summary=summary)
     return run_model(prompt)
 
 def summarize_and_extract_keywords(text):
@@ -27,6 +30,37 @@ def summarize_and_extract_keywords(text):
     keywords = extract_keywords(summary)
     return summary, keywords
 
+def run_model_batch(prompts, batch_size=8):
+    """Generates for each prompt in padded batches, running every distinct prompt only once.
+
+    Within a generate call the encoder runs once per batch and its output is reused for
+    every decoding step. The keyword pass can't reuse the summary pass's encoder output:
+    its input is the generated summary, a different sequence, so it has to be encoded anew.
+    """
+    # The same document twice in a batch is encoded and generated once
+    unique = list(dict.fromkeys(prompts))
+    # Longest prompts first so each padded batch wastes as little compute as possible
+    order = sorted(range(len(unique)), key=lambda i: len(unique[i]), reverse=True)
+    generated = {}
+    for start in range(0, len(order), batch_size):
+        batch = [unique[i] for i in order[start:start + batch_size]]
+        inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True)
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=150,
+            temperature=0.7,
+            do_sample=True
+        )
+        for prompt, text in zip(batch, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+            generated[prompt] = text
+    return [generated[prompt] for prompt in prompts]
+
+def summarize_and_extract_keywords_batch(texts, batch_size=8):
+    """Summarizes many documents with one generate call per batch, then extracts all keywords the same way"""
+    summaries = run_model_batch([SUMMARY_PROMPT.format(text=text) for text in texts], batch_size)
+    keywords = run_model_batch([KEYWORDS_PROMPT.format(summary=summary) for summary in summaries], batch_size)
+    return list(zip(summaries, keywords))
+
 def main():
     text = """
     Artificial Intelligence (AI) is transforming industries by enabling machines to learn from data, 
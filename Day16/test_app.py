@@ -147,3 +147,48 @@ def test_summarize_and_extract_keywords_empty(mock_extract, mock_summarize):
     summary, keywords = app.summarize_and_extract_keywords("")
     assert summary == ""
     assert keywords == ""
+
+# Batched generation
+def test_run_model_batch_restores_order():
+    mock_tokenizer = MagicMock()
+    mock_tokenizer.return_value = {"input_ids": MagicMock()}
+    mock_tokenizer.batch_decode.side_effect = lambda outputs, skip_special_tokens: outputs
+    mock_model = MagicMock()
+    # "generate" echoes the prompts back so results can be matched to inputs
+    mock_model.generate.side_effect = lambda **kwargs: [p.upper() for p in mock_tokenizer.call_args[0][0]]
+
+    with patch.object(app, 'tokenizer', mock_tokenizer), \
+         patch.object(app, 'model', mock_model):
+        results = app.run_model_batch(["a", "ccc", "bb"], batch_size=2)
+
+    assert results == ["A", "CCC", "BB"]
+    assert mock_model.generate.call_count == 2
+    mock_tokenizer.assert_any_call(["ccc", "bb"], return_tensors="pt", padding=True, truncation=True)
+    mock_tokenizer.assert_any_call(["a"], return_tensors="pt", padding=True, truncation=True)
+
+def test_run_model_batch_runs_repeated_prompts_once():
+    mock_tokenizer = MagicMock()
+    mock_tokenizer.return_value = {"input_ids": MagicMock()}
+    mock_tokenizer.batch_decode.side_effect = lambda outputs, skip_special_tokens: outputs
+    mock_model = MagicMock()
+    mock_model.generate.side_effect = lambda **kwargs: [p.upper() for p in mock_tokenizer.call_args[0][0]]
+
+    with patch.object(app, 'tokenizer', mock_tokenizer), \
+         patch.object(app, 'model', mock_model):
+        results = app.run_model_batch(["a", "bb", "a"], batch_size=8)
+
+    assert results == ["A", "BB", "A"]
+    mock_tokenizer.assert_called_once_with(["bb", "a"], return_tensors="pt", padding=True, truncation=True)
+
+@patch('app.run_model_batch')
+def test_summarize_and_extract_keywords_batch(mock_run_model_batch):
+    mock_run_model_batch.side_effect = [["Summary 1", "Summary 2"], ["Keywords 1", "Keywords 2"]]
+    results = app.summarize_and_extract_keywords_batch(["Text 1", "Text 2"])
+    assert results == [("Summary 1", "Keywords 1"), ("Summary 2", "Keywords 2")]
+    assert mock_run_model_batch.call_count == 2
+    mock_run_model_batch.assert_any_call(
+        ["Summarize the following text in 3 concise sentences:\n\nText 1",
+         "Summarize the following text in 3 concise sentences:\n\nText 2"], 8)
+    mock_run_model_batch.assert_called_with(
+        ["Extract 5 important keywords from this summary:\n\nSummary 1\n\nKeywords:",
+         "Extract 5 important keywords from this summary:\n\nSummary 2\n\nKeywords:"], 8)
@@ -1,37 +1,93 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pypdf import PdfReader
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from chunking import token_chunks
 
 model_name = "google/flan-t5-base"
 tokenizer = AutoTokenizer.from_pretrained(model_name)
 model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
 
-def extract_text_from_pdf(pdf_path):
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "1"))
+PAGES_PER_TASK = 16
+
+def extract_page_range(pdf_path, start, stop):
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def iter_pdf_pages(pdf_path, workers=PDF_WORKERS):
+    """Yields the text of each page in order; with workers > 1 page ranges are extracted in a process pool"""
     reader = PdfReader(pdf_path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
-
-def summarize_text(text, max_chunk_size=1000):
-    # Break long text into chunks
-    chunks = [text[i:i+max_chunk_size] for i in range(0, len(text), max_chunk_size)]
-    summaries = []
-
-    for chunk in chunks:
-        prompt = f"Summarize the following text:\n\n{chunk}"
-        inputs = tokenizer(prompt, return_tensors="pt", truncation=True)
-        outputs = model.generate(**inputs, max_new_tokens=150)
-        summary = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        summaries.append(summary)
-
-    # Optionally combine summaries into a final short summary
-    combined = " ".join(summaries)
-    final_prompt = f"Summarize this text concisely:\n\n{combined}"
-    final_inputs = tokenizer(final_prompt, return_tensors="pt", truncation=True)
-    final_outputs = model.generate(**final_inputs, max_new_tokens=150)
-    final_summary = tokenizer.decode(final_outputs[0], skip_special_tokens=True)
-
-    return final_summary
+    if workers <= 1:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+    total = len(reader.pages)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(extract_page_range, pdf_path, start, min(start + PAGES_PER_TASK, total))
+            for start in range(0, total, PAGES_PER_TASK)
+        ]
+        for future in futures:
+            yield from future.result()
+
+def extract_text_from_pdf(pdf_path, workers=PDF_WORKERS):
+    # Join once instead of growing a string page by page
+    return "".join(page + "\n" for page in iter_pdf_pages(pdf_path, workers))
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "400"))  # leaves room for the prompt in flan-t5's 512-token window
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "32"))
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "8"))
+CHUNK_PROMPT = "Summarize the following text:\n\n"
+FINAL_PROMPT = "Summarize this text concisely:\n\n"
+
+def tokenize(texts):
+    return tokenizer(texts, add_special_tokens=False)["input_ids"]
+
+def count_tokens(text):
+    return len(tokenize(text))
+
+def chunk_by_tokens(text, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    return token_chunks(text, tokenizer, chunk_tokens, overlap)
+
+def generate_summaries(token_ids, prompt, batch_size=SUMMARY_BATCH_SIZE):
+    """Summarizes already tokenized texts in padded batches; the prompt is tokenized once and prepended to each"""
+    prefix = tokenize(prompt)
+    inputs = [prefix + ids + [tokenizer.eos_token_id] for ids in token_ids]
+    # Longest inputs first so each padded batch wastes as little compute as possible
+    order = sorted(range(len(inputs)), key=lambda i: len(inputs[i]), reverse=True)
+    summaries = [None] * len(inputs)
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        batch = tokenizer.pad({"input_ids": [inputs[i] for i in indices]}, return_tensors="pt")
+        outputs = model.generate(**batch, max_new_tokens=150)
+        for i, summary in zip(indices, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+            summaries[i] = summary
+    return summaries
+
+def group_by_tokens(summaries, budget):
+    """Packs consecutive summaries into groups of at most `budget` tokens, at least two per group so every level shrinks"""
+    groups, current, size = [], [], 0
+    for summary in summaries:
+        tokens = count_tokens(summary)
+        if len(current) >= 2 and size + tokens > budget:
+            groups.append(" ".join(current))
+            current, size = [], 0
+        current.append(summary)
+        size += tokens
+    if current:
+        groups.append(" ".join(current))
+    return groups
+
+def summarize_text(text, chunk_tokens=CHUNK_TOKENS, batch_size=SUMMARY_BATCH_SIZE, overlap=CHUNK_OVERLAP):
+    """Map-reduce summary: chunks are summarized in batches, then the summaries are
+    merged and re-summarized level by level until they fit one prompt"""
+    chunks = chunk_by_tokens(text, chunk_tokens, overlap)
+    summaries = generate_summaries([ids for _, ids in chunks], CHUNK_PROMPT, batch_size)
+    while len(summaries) > 1 and count_tokens(" ".join(summaries)) > chunk_tokens:
+        groups = group_by_tokens(summaries, chunk_tokens)
+        summaries = generate_summaries(tokenize(groups), CHUNK_PROMPT, batch_size)
+    return generate_summaries(tokenize([" ".join(summaries)]), FINAL_PROMPT)[0]
 
 def main():
     pdf_path = "example.pdf"
@@ -0,0 +1,19 @@
+def token_chunks(text, tokenizer, chunk_tokens, overlap=0):
+    """Tokenizes `text` once and cuts it into windows of at most `chunk_tokens` tokens.
+
+    Consecutive windows share `overlap` tokens. Returns (chunk_text, input_ids)
+    pairs: the text is the slice of the original document the window covers (via
+    the tokenizer's offset mapping, so nothing is decoded), and the ids can be
+    fed to the model without tokenizing the chunk again. Needs a fast tokenizer.
+    """
+    if not 0 <= overlap < chunk_tokens:
+        raise ValueError(f"overlap must be in [0, {chunk_tokens}), got {overlap}")
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    ids, offsets = encoding["input_ids"], encoding["offset_mapping"]
+    chunks = []
+    for start in range(0, len(ids), chunk_tokens - overlap):
+        stop = min(start + chunk_tokens, len(ids))
+        chunks.append((text[offsets[start][0]:offsets[stop - 1][1]], ids[start:stop]))
+        if stop == len(ids):
+            break
+    return chunks
@@ -1,10 +1,12 @@
 import pytest
+import re
 from unittest.mock import patch, MagicMock
 import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app import extract_text_from_pdf, summarize_text, main, tokenizer, model
+from chunking import token_chunks
+from app import extract_text_from_pdf, iter_pdf_pages, chunk_by_tokens, group_by_tokens, summarize_text, main, tokenizer, model
 
 class TestExtractTextFromPdf:
     def test_valid_pdf(self):
@@ -17,71 +19,124 @@ class TestExtractTextFromPdf:
         with pytest.raises(FileNotFoundError):
             extract_text_from_pdf("nonexistent.pdf")
 
+    def test_parallel_matches_serial(self):
+        assert extract_text_from_pdf("example.pdf", workers=2) == extract_text_from_pdf("example.pdf", workers=1)
+
+    @patch('app.PdfReader')
+    def test_pages_are_yielded_lazily(self, mock_pdf_reader):
+        first, second = MagicMock(), MagicMock()
+        first.extract_text.return_value = "Page 1"
+        second.extract_text.return_value = None
+        mock_pdf_reader.return_value.pages = [first, second]
+
+        pages = iter_pdf_pages("doc.pdf")
+        assert next(pages) == "Page 1"
+        second.extract_text.assert_not_called()
+        assert list(pages) == [""]
+
+    @patch('app.PdfReader')
+    def test_extract_joins_pages(self, mock_pdf_reader):
+        pages = [MagicMock(), MagicMock()]
+        pages[0].extract_text.return_value = "One"
+        pages[1].extract_text.return_value = "Two"
+        mock_pdf_reader.return_value.pages = pages
+        assert extract_text_from_pdf("doc.pdf") == "One\nTwo\n"
+
+class FakeTokenizer:
+    """Whitespace tokenizer: a token is a word"""
+    eos_token_id = "</s>"
+
+    def __init__(self):
+        self.documents = []
+
+    def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False, **kwargs):
+        if return_offsets_mapping:
+            self.documents.append(text)
+        if isinstance(text, list):
+            return {'input_ids': [t.split() for t in text]}
+        words = list(re.finditer(r"\S+", text))
+        encoding = {'input_ids': [w.group() for w in words]}
+        if return_offsets_mapping:
+            encoding['offset_mapping'] = [w.span() for w in words]
+        return encoding
+
+    def pad(self, encoded, return_tensors=None):
+        return encoded
+
+    def batch_decode(self, batch, skip_special_tokens=False):
+        return [" ".join(ids) for ids in batch]
+
+class FakeModel:
+    """Summarizes a prompt to its last two words and records each batch size"""
+
+    def __init__(self):
+        self.batches = []
+
+    def generate(self, input_ids, max_new_tokens):
+        self.batches.append(len(input_ids))
+        return [[t for t in ids if t != "</s>"][-2:] for ids in input_ids]
+
+@pytest.fixture
+def fake_model():
+    fake = FakeModel()
+    fake.tokenizer = FakeTokenizer()
+    with patch('app.tokenizer', fake.tokenizer), patch('app.model', fake):
+        yield fake
+
 class TestSummarizeText:
-    @patch('app.tokenizer')
-    @patch('app.model')
-    def test_short_text_one_chunk(self, mock_model, mock_tokenizer):
-        # Mock tokenizer.encode and decode
-        mock_tokenizer.return_value = MagicMock()
-        mock_tokenizer.return_value.__call__ = MagicMock(return_value={'input_ids': [1,2,3]})
-        mock_tokenizer.decode = MagicMock(return_value="Mocked summary")
-
-        # Mock model.generate
-        mock_model.generate = MagicMock(return_value=[[4,5,6]])
-
-        text = "Short text."
-        summary = summarize_text(text, max_chunk_size=1000)
-        assert summary == "Mocked summary"
-        # Check calls: one for chunk, one for final
-        assert mock_tokenizer.call_count == 2
-        assert mock_model.generate.call_count == 2
-
-    @patch('app.tokenizer')
-    @patch('app.model')
-    def test_long_text_multiple_chunks(self, mock_model, mock_tokenizer):
-        mock_tokenizer.return_value = MagicMock()
-        mock_tokenizer.return_value.__call__ = MagicMock(return_value={'input_ids': [1,2,3]})
-        mock_tokenizer.decode = MagicMock(side_effect=["Chunk summary 1", "Chunk summary 2", "Final summary"])
-
-        mock_model.generate = MagicMock(return_value=[[4,5,6]])
-
-        text = "Long text " * 300  # Longer than 1000 chars
-        summary = summarize_text(text, max_chunk_size=1000)
-        assert summary == "Final summary"
-        # Two chunks + final
-        assert mock_tokenizer.call_count == 3
-        assert mock_model.generate.call_count == 3
-
-    @patch('app.tokenizer')
-    @patch('app.model')
-    def test_empty_text(self, mock_model, mock_tokenizer):
-        mock_tokenizer.return_value = MagicMock()
-        mock_tokenizer.return_value.__call__ = MagicMock(return_value={'input_ids': [1,2,3]})
-        mock_tokenizer.decode = MagicMock(return_value="Empty summary")
-
-        mock_model.generate = MagicMock(return_value=[[4,5,6]])
-
-        text = ""
-        summary = summarize_text(text)
-        assert summary == "Empty summary"
+    def test_short_text_one_chunk(self, fake_model):
+        summary = summarize_text("Short text here.", chunk_tokens=10, overlap=0)
+        assert summary == "text here."
+        # One chunk, then the final pass
+        assert fake_model.batches == [1, 1]
+
+    def test_empty_text(self, fake_model):
+        summary = summarize_text("")
+        assert summary == "text concisely:"
         # Still calls for final summary
-        assert mock_tokenizer.call_count == 1
-        assert mock_model.generate.call_count == 1
-
-    @patch('app.tokenizer')
-    @patch('app.model')
-    def test_different_max_chunk_size(self, mock_model, mock_tokenizer):
-        mock_tokenizer.return_value = MagicMock()
-        mock_tokenizer.return_value.__call__ = MagicMock(return_value={'input_ids': [1,2,3]})
-        mock_tokenizer.decode = MagicMock(side_effect=["Summary 1", "Summary 2", "Final"])
-
-        mock_model.generate = MagicMock(return_value=[[4,5,6]])
-
-        text = "Text " * 200  # About 1000 chars
-        summary = summarize_text(text, max_chunk_size=500)
-        assert summary == "Final"
-        # With 500, more chunks
-        assert mock_tokenizer.call_count == 3  # Assuming 2 chunks + final
+        assert fake_model.batches == [1]
+
+    def test_chunks_are_token_sized(self):
+        with patch('app.tokenizer', FakeTokenizer()):
+            chunks = chunk_by_tokens(" ".join(f"w{i}" for i in range(25)), chunk_tokens=10, overlap=0)
+        assert [len(ids) for _, ids in chunks] == [10, 10, 5]
+        assert chunks[2] == ("w20 w21 w22 w23 w24", ["w20", "w21", "w22", "w23", "w24"])
+
+    def test_chunks_overlap_and_keep_original_text(self):
+        text = "one  two\nthree four five"
+        chunks = token_chunks(text, FakeTokenizer(), chunk_tokens=3, overlap=1)
+        assert [chunk for chunk, _ in chunks] == ["one  two\nthree", "three four five"]
+        assert chunks[1][1] == ["three", "four", "five"]
+
+    def test_overlap_must_be_smaller_than_chunk(self):
+        with pytest.raises(ValueError):
+            token_chunks("a b c", FakeTokenizer(), chunk_tokens=2, overlap=2)
+
+    def test_chunk_ids_are_not_retokenized(self, fake_model):
+        text = " ".join(f"w{i}" for i in range(30))
+        summarize_text(text, chunk_tokens=10, overlap=0)
+        # The document is tokenized once; the chunk ids go straight to generate
+        assert fake_model.tokenizer.documents == [text]
+        assert fake_model.batches[0] == 3
+
+    def test_map_reduce_levels_are_batched(self, fake_model):
+        text = " ".join(f"w{i}" for i in range(100))
+        summary = summarize_text(text, chunk_tokens=10, batch_size=4, overlap=0)
+        assert summary == "w98 w99"
+        # 10 chunks in batches of 4, one reduce level of 2 groups, then the final pass
+        assert fake_model.batches == [4, 4, 2, 2, 1]
+
+    def test_reduce_terminates_with_small_budget(self, fake_model):
+        text = " ".join(f"w{i}" for i in range(40))
+        summary = summarize_text(text, chunk_tokens=1, batch_size=64, overlap=0)
+        assert summary == "text: w39"
+        # Every level merges at least two summaries
+        assert fake_model.batches[0] == 40
+        assert fake_model.batches[1:] == [20, 10, 5, 3, 2, 1, 1]
+
+    def test_group_by_tokens(self):
+        with patch('app.tokenizer', FakeTokenizer()):
+            assert group_by_tokens(["a b", "c d", "e f", "g"], budget=4) == ["a b c d", "e f g"]
 
 class TestMain:
     @patch('app.extract_text_from_pdf')
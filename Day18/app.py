@@ -1,9 +1,25 @@
 import os
+import json
+import hashlib
 from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
+from indexes import (
+    INDEX_TYPE, IVF_NPROBE, HNSW_EF_SEARCH, TRAIN_SAMPLE_SIZE, RETRAIN_GROWTH_FACTOR, HNSW_MAX_DELETED_RATIO,
+    create_index, mmap_flags, needs_training, set_search_params,
+)
+from sparse import BM25Index, reciprocal_rank_fusion
+from embedding_store import EmbeddingStore
+from quantization import INFERENCE_PRECISION, quantize_model
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+model = quantize_model(SentenceTransformer(EMBEDDING_MODEL))
+# Vectors from another model or precision can't be compared with these, so the manifest records both
+EMBEDDING = {"model": EMBEDDING_MODEL, "precision": INFERENCE_PRECISION}
+
+INDEX_DIR = "index"
+ENCODE_BATCH_SIZE = 256
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
 
 def load_text_files(folder_path):
     texts = []
@@ -15,28 +31,276 @@ def load_text_files(folder_path):
                 filenames.append(filename)
     return filenames, texts
 
-def main():    
-    folder_path = "Data"
-    filenames, texts = load_text_files(folder_path)
+def atomic_write(path, write):
+    """Writes through a temp file and renames it, so readers never see a half-written file"""
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def file_stamp(path):
+    """Size and mtime of a file: replacing it through atomic_write changes them, reading it costs one stat"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+class IndexManager:
+    """Keeps the FAISS index of a folder on disk and only re-embeds files that changed.
+
+    The manifest maps each filename to its FAISS id, mtime and content hash. On
+    update, files with a new mtime are re-hashed, and only new or changed content
+    is encoded under a new id; the old ids are removed from the IndexIDMap. The index
+    type comes from INDEX_TYPE (see indexes.py); IVF and sq8 types are trained on the
+    first TRAIN_SAMPLE_SIZE embeddings of a fresh build, and retrained once the corpus
+    has grown RETRAIN_GROWTH_FACTOR times past the size they were trained on. HNSW
+    graphs can't delete nodes, so removed ids are filtered out of searches until they
+    pass HNSW_MAX_DELETED_RATIO of the graph, which is then rebuilt. A BM25 inverted index over the
+    same documents is kept alongside it (sparse.npz) for keyword and hybrid search.
+    Every embedding is also written to a memory-mapped EmbeddingStore, which IVF
+    training and HNSW rebuilds read from instead of holding vectors in RAM. A saved
+    flat, SQ or IVF index is memory-mapped on load (its codes or inverted lists stay
+    on disk, see mmap_flags) and only read into RAM once an update changes it.
+
+    The files are saved one by one, so the manifest is written last and records
+    the save generation and the size and mtime of the index files it was saved with;
+    the embedding store records the same generation. Anything that doesn't match
+    on load (a crash mid-save, a file from another save, another embedding model
+    or INFERENCE_PRECISION) triggers a rebuild.
+    """
+
+    def __init__(self, folder_path, index_dir=INDEX_DIR, index_type=INDEX_TYPE):
+        self.folder_path = folder_path
+        self.index_type = index_type
+        self.index_path = os.path.join(index_dir, "docs.faiss")
+        self.manifest_path = os.path.join(index_dir, "manifest.json")
+        self.sparse_path = os.path.join(index_dir, "sparse.npz")
+        os.makedirs(index_dir, exist_ok=True)
+        self.embeddings = EmbeddingStore(index_dir, model.get_sentence_embedding_dimension())
+        self.load()
 
-    embeddings = model.encode(texts, convert_to_tensor=False, show_progress_bar=True)
-    dimension = len(embeddings[0])
-    index = faiss.IndexFlatL2(dimension)
+    def load(self):
+        self.index = None
+        self.mapped = False
+        if os.path.exists(self.index_path) and os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+            if self._saved_together():
+                flags = mmap_flags(self.index_type)
+                self.mapped = flags != 0
+                self.index = faiss.read_index(self.index_path, flags)
+                self.sparse = BM25Index.load(self.sparse_path)
+                count = len(self.manifest["files"])
+                nodes = count + len(self.manifest.get("deleted", []))
+                consistent = self.index.ntotal == nodes and len(self.sparse) == count and len(self.embeddings) == count
+            else:
+                consistent = False
+            if (not consistent or self.manifest.get("index_type", "flat") != self.index_type
+                    or self.manifest.get("embedding") != EMBEDDING):
+                self.mapped = False
+                # Indexes and manifest come from different saves, a different INDEX_TYPE or embeddings; start over
+                self.index = None
+        if self.index is None:
+            self.manifest = {"next_id": 0, "index_type": self.index_type, "embedding": dict(EMBEDDING), "files": {}}
+            self.sparse = BM25Index()
+            self.embeddings.reset()
+            if not needs_training(self.index_type):
+                self.index = faiss.IndexIDMap(create_index(self.index_type, model.get_sentence_embedding_dimension()))
+        if self.index is not None:
+            set_search_params(self.index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH)
+        self._refresh_filter()
+        self.names = {entry["id"]: name for name, entry in self.manifest["files"].items()}
+
+    def _saved_together(self):
+        # Stamps rather than checksums, so loading never reads the whole index just to check it
+        stamps = self.manifest.get("stamps", {})
+        return (
+            self.embeddings.generation is not None
+            and self.embeddings.generation == self.manifest.get("generation")
+            and os.path.exists(self.sparse_path)
+            and stamps.get("index") == file_stamp(self.index_path)
+            and stamps.get("sparse") == file_stamp(self.sparse_path)
+        )
+
+    def update(self):
+        files = self.manifest["files"]
+        current = {}
+        with os.scandir(self.folder_path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".txt"):
+                    current[entry.name] = entry.stat().st_mtime
+
+        removed = [name for name in files if name not in current]
+        stale_ids = [files.pop(name)["id"] for name in removed]
+
+        stats = {"added": 0, "updated": 0, "removed": len(removed), "unchanged": 0}
+        changed = []
+        for name, mtime in current.items():
+            entry = files.get(name)
+            if entry is not None and entry["mtime"] == mtime:
+                stats["unchanged"] += 1
+                continue
+            with open(os.path.join(self.folder_path, name), "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            if entry is not None and entry["sha256"] == digest:
+                # Touched but not modified
+                entry["mtime"] = mtime
+                stats["unchanged"] += 1
+                continue
+            # Changed files get a new id too, so an old id that is only filtered out (HNSW) stays dead
+            doc_id = self.manifest["next_id"]
+            self.manifest["next_id"] += 1
+            if entry is None:
+                stats["added"] += 1
+            else:
+                stale_ids.append(entry["id"])
+                stats["updated"] += 1
+            files[name] = {"id": doc_id, "mtime": mtime, "sha256": digest}
+            changed.append((doc_id, name))
+
+        if stale_ids:
+            stale_ids = np.array(stale_ids, dtype="int64")
+            self.embeddings.remove(stale_ids)
+            self._remove(stale_ids)
+            self.sparse.remove(stale_ids)
+        for start in range(0, len(changed), ENCODE_BATCH_SIZE):
+            self._add(changed[start:start + ENCODE_BATCH_SIZE])
+        if self.index is None and len(self.embeddings):
+            self._build_from_store()
+        elif self._outgrew_training():
+            # Lists sized for the first, smaller corpus would each hold too many vectors now
+            self._build_from_store()
+        self.names = {entry["id"]: name for name, entry in files.items()}
+        return stats
+
+    def _add(self, batch):
+        texts = []
+        for _, name in batch:
+            with open(os.path.join(self.folder_path, name), "r", encoding="utf-8") as f:
+                texts.append(f.read())
+        embeddings = np.asarray(model.encode(texts, convert_to_numpy=True), dtype="float32")
+        ids = np.array([doc_id for doc_id, _ in batch], dtype="int64")
+        for (doc_id, _), text in zip(batch, texts):
+            self.sparse.add(doc_id, text)
+        self.embeddings.append(ids, embeddings)
+        if self.index is None:
+            # Trained index types wait for a full training sample before the index is created
+            if len(self.embeddings) >= TRAIN_SAMPLE_SIZE:
+                self._build_from_store()
+            return
+        self._make_writable()
+        self.index.add_with_ids(embeddings, ids)
 
-    embeddings_np = np.array(embeddings).astype("float32")
+    def _make_writable(self):
+        # Mapped codes and IVF lists can't be written to, so the index is read into RAM once before it is first changed
+        if self.mapped:
+            self.index = faiss.read_index(self.index_path)
+            set_search_params(self.index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH)
+            self.mapped = False
 
-    index.add(embeddings_np)
-    print(f"Stored {index.ntotal} documents in FAISS index.")
+    def _build_from_store(self):
+        # Train on a sample and add the rest batch by batch, streaming from the memory-mapped store
+        sample = self.embeddings.sample(TRAIN_SAMPLE_SIZE)
+        self.index = faiss.IndexIDMap(create_index(self.index_type, self.embeddings.dimension, sample))
+        self.mapped = False
+        set_search_params(self.index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH)
+        for ids, vectors in self.embeddings.iter_batches():
+            self.index.add_with_ids(vectors, ids)
+        if needs_training(self.index_type):
+            self.manifest["trained_on"] = len(sample)
+        self.manifest["deleted"] = []
+        self._refresh_filter()
+
+    def _outgrew_training(self):
+        trained_on = self.manifest.get("trained_on")
+        return (
+            needs_training(self.index_type)
+            and trained_on is not None
+            and trained_on < TRAIN_SAMPLE_SIZE
+            and len(self.embeddings) >= RETRAIN_GROWTH_FACTOR * trained_on
+        )
+
+    def _remove(self, ids):
+        if self.index is None:
+            return
+        if self.index_type != "hnsw":
+            self._make_writable()
+            self.index.remove_ids(ids)
+            return
+        # HNSW graphs can't delete nodes: hide them from searches until there are enough
+        # to rebuild from the stored vectors (no re-embedding needed)
+        deleted = self.manifest.setdefault("deleted", [])
+        deleted.extend(int(doc_id) for doc_id in ids)
+        if len(deleted) > HNSW_MAX_DELETED_RATIO * self.index.ntotal:
+            self._build_from_store()
+        else:
+            self._refresh_filter()
+
+    def _refresh_filter(self):
+        self.search_params = None
+        deleted = self.manifest.get("deleted")
+        if self.index is None or not deleted:
+            return
+        # The search params only hold pointers, so the selectors are kept alive on self
+        self._deleted_ids = faiss.IDSelectorBatch(np.array(deleted, dtype="int64"))
+        self._live_ids = faiss.IDSelectorNot(self._deleted_ids)
+        ef_search = faiss.downcast_index(self.index.index).hnsw.efSearch
+        self.search_params = faiss.SearchParametersHNSW(sel=self._live_ids, efSearch=ef_search)
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal - len(self.manifest.get("deleted", [])) if self.index is not None else 0
+
+    def save(self):
+        if self.index is None:
+            return
+        generation = self.manifest.get("generation", 0) + 1
+        atomic_write(self.index_path, lambda path: faiss.write_index(self.index, path))
+        atomic_write(self.sparse_path, self.sparse.save)
+        self.embeddings.compact()
+        self.embeddings.flush(generation)
+        self.manifest["generation"] = generation
+        self.manifest["stamps"] = {"index": file_stamp(self.index_path), "sparse": file_stamp(self.sparse_path)}
+
+        def write_manifest(path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f)
+        atomic_write(self.manifest_path, write_manifest)
+
+    def search(self, query, k=3):
+        return [(self.names[doc_id], distance) for doc_id, distance in self._dense_search(query, k)]
+
+    def _dense_search(self, query, k):
+        if self.index is None:
+            return []
+        query_vector = model.encode([query])
+        distances, ids = self.index.search(np.array(query_vector).astype("float32"), k, params=self.search_params)
+        return [(int(doc_id), distance) for doc_id, distance in zip(ids[0], distances[0]) if doc_id != -1]
+
+    def sparse_search(self, query, k=3):
+        return [(self.names[doc_id], score) for doc_id, score in self.sparse.search(query, k)]
+
+    def hybrid_search(self, query, k=3, candidates=HYBRID_CANDIDATES):
+        """Fuses the dense and BM25 rankings of the top `candidates` with reciprocal rank fusion"""
+        candidates = max(k, candidates)
+        dense = [doc_id for doc_id, _ in self._dense_search(query, candidates)]
+        sparse = [doc_id for doc_id, _ in self.sparse.search(query, candidates)]
+        fused = reciprocal_rank_fusion([dense, sparse])[:k]
+        return [(self.names[doc_id], score) for doc_id, score in fused]
+
+def main():
+    folder_path = "Data"
+    manager = IndexManager(folder_path)
+    stats = manager.update()
+    manager.save()
+    print(f"Stored {manager.ntotal} documents in FAISS index.")
+    print(f"Added {stats['added']}, updated {stats['updated']}, removed {stats['removed']} documents.")
 
     query = "Which files talk about AI?"
-    query_vector = model.encode([query])
 
     k = 3  # top 3 results
-    distances, indices = index.search(np.array(query_vector).astype("float32"), k)
+    results = manager.hybrid_search(query, k)
 
     print("\nTop matching files:\n")
-    for i, idx in enumerate(indices[0]):
-        print(f"{i+1}. {filenames[idx]}  (distance={distances[0][i]:.4f})")
-        
+    for i, (filename, score) in enumerate(results):
+        print(f"{i+1}. {filename}  (score={score:.4f})")
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,139 @@
+import json
+import os
+
+import numpy as np
+
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")
+INITIAL_CAPACITY = 1024
+READ_BATCH_SIZE = 65536
+
+
+class EmbeddingStore:
+    """Document embeddings in a memory-mapped .npy matrix, with a row-to-document-id table.
+
+    Rows are appended to embeddings.npy (float32 or float16) and row_ids.npy
+    records the document id of each row, -1 once the document is removed. Both
+    files grow by doubling; only the pages that are touched are read, so IVF
+    training and HNSW rebuilds stream vectors from disk instead of keeping every
+    embedding in RAM. Vectors always come back as float32 for FAISS.
+
+    flush(generation) records which save of the index the files belong to. The
+    first change after that clears it on disk, since rows are written in place,
+    so a crash before the next save can't pass for the saved state.
+    """
+
+    def __init__(self, directory, dimension, dtype=EMBEDDING_DTYPE):
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.vectors_path = os.path.join(directory, "embeddings.npy")
+        self.ids_path = os.path.join(directory, "row_ids.npy")
+        self.meta_path = os.path.join(directory, "embeddings.json")
+        os.makedirs(directory, exist_ok=True)
+        if not self._open():
+            self.reset()
+
+    def _open(self):
+        if not all(os.path.exists(path) for path in (self.vectors_path, self.ids_path, self.meta_path)):
+            return False
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["dimension"] != self.dimension or meta["dtype"] != self.dtype.name:
+            return False
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self.row_ids = np.load(self.ids_path, mmap_mode="r+")
+        self.count = meta["count"]
+        self.generation = meta.get("generation")
+        return True
+
+    def reset(self, capacity=INITIAL_CAPACITY):
+        self.vectors = np.lib.format.open_memmap(self.vectors_path, mode="w+", dtype=self.dtype, shape=(capacity, self.dimension))
+        self.row_ids = np.lib.format.open_memmap(self.ids_path, mode="w+", dtype="int64", shape=(capacity,))
+        self.count = 0
+        self.generation = None
+        self.flush()
+
+    def __len__(self):
+        return int(np.count_nonzero(self.row_ids[:self.count] != -1))
+
+    def append(self, ids, vectors):
+        self._mark_changed()
+        if self.count + len(ids) > len(self.row_ids):
+            self._resize(max(2 * len(self.row_ids), self.count + len(ids)))
+        self.vectors[self.count:self.count + len(ids)] = vectors
+        self.row_ids[self.count:self.count + len(ids)] = ids
+        self.count += len(ids)
+
+    def remove(self, ids):
+        self._mark_changed()
+        for start in range(0, self.count, READ_BATCH_SIZE):
+            rows = self.row_ids[start:min(start + READ_BATCH_SIZE, self.count)]
+            rows[np.isin(rows, ids)] = -1
+
+    def iter_batches(self, batch_size=READ_BATCH_SIZE):
+        """Yields (ids, float32 vectors) of the live rows, batch_size rows at a time"""
+        for start in range(0, self.count, batch_size):
+            stop = min(start + batch_size, self.count)
+            ids = np.array(self.row_ids[start:stop])
+            live = ids != -1
+            if live.any():
+                yield ids[live], np.asarray(self.vectors[start:stop][live], dtype="float32")
+
+    def sample(self, size, seed=0):
+        """Returns up to `size` live vectors as float32, reading only the sampled rows"""
+        rows = np.flatnonzero(self.row_ids[:self.count] != -1)
+        if len(rows) > size:
+            rows = np.sort(np.random.default_rng(seed).choice(rows, size, replace=False))
+        return np.asarray(self.vectors[rows], dtype="float32")
+
+    def compact(self):
+        """Rewrites the files without removed rows once they make up more than half of the store"""
+        live = len(self)
+        if self.count - live > live:
+            self._rewrite(max(INITIAL_CAPACITY, live), drop_removed=True)
+            self.flush()
+
+    def _resize(self, capacity):
+        # A .npy file's shape lives in its header, so growing means a new file; doubling keeps this amortized O(1)
+        self._rewrite(capacity)
+
+    def _rewrite(self, capacity, drop_removed=False):
+        tmp_vectors, tmp_ids = self.vectors_path + ".tmp.npy", self.ids_path + ".tmp.npy"
+        vectors = np.lib.format.open_memmap(tmp_vectors, mode="w+", dtype=self.dtype, shape=(capacity, self.dimension))
+        row_ids = np.lib.format.open_memmap(tmp_ids, mode="w+", dtype="int64", shape=(capacity,))
+        count = 0
+        for start in range(0, self.count, READ_BATCH_SIZE):
+            stop = min(start + READ_BATCH_SIZE, self.count)
+            ids = np.array(self.row_ids[start:stop])
+            batch = self.vectors[start:stop]
+            if drop_removed:
+                keep = ids != -1
+                ids, batch = ids[keep], batch[keep]
+            vectors[count:count + len(ids)] = batch
+            row_ids[count:count + len(ids)] = ids
+            count += len(ids)
+        vectors.flush()
+        row_ids.flush()
+        # Drop every reference to the old mappings before the files are replaced
+        del vectors, row_ids
+        self.vectors = self.row_ids = None
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_ids, self.ids_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self.row_ids = np.load(self.ids_path, mmap_mode="r+")
+        self.count = count
+
+    def _mark_changed(self):
+        if self.generation is not None:
+            self.generation = None
+            self.flush()
+
+    def flush(self, generation=None):
+        self.vectors.flush()
+        self.row_ids.flush()
+        if generation is not None:
+            self.generation = generation
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            meta = {"count": self.count, "dimension": self.dimension, "dtype": self.dtype.name, "generation": self.generation}
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
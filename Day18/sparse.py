@@ -0,0 +1,119 @@
+import json
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring, updated document by document.
+
+    In memory, postings map each term to {doc_id: term frequency}. On disk they
+    are stored compactly in one .npz file: the vocabulary, and per term a run of
+    delta-encoded doc ids with their frequencies, in flat arrays addressed by
+    offsets.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id, text):
+        doc_id = int(doc_id)
+        if doc_id in self.doc_lengths:
+            self.remove([doc_id])
+        terms = tokenize(text)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.doc_lengths[doc_id] = len(terms)
+        self.total_length += len(terms)
+
+    def remove(self, doc_ids):
+        doc_ids = {int(doc_id) for doc_id in doc_ids if int(doc_id) in self.doc_lengths}
+        if not doc_ids:
+            return
+        for doc_id in doc_ids:
+            self.total_length -= self.doc_lengths.pop(doc_id)
+        # One pass over the vocabulary per batch, rather than keeping a forward index of every document's terms
+        for term in list(self.postings):
+            docs = self.postings[term]
+            for doc_id in doc_ids & docs.keys():
+                del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query, k=3):
+        """Returns up to k (doc_id, BM25 score) pairs, best first"""
+        if not self.doc_lengths:
+            return []
+        count = len(self.doc_lengths)
+        average_length = self.total_length / count or 1
+        scores = Counter()
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores.most_common(k)
+
+    def save(self, path):
+        terms = sorted(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype="int64")
+        doc_deltas, tfs = [], []
+        for i, term in enumerate(terms):
+            ids = sorted(self.postings[term])
+            doc_deltas.append(np.diff(np.array(ids, dtype="int64"), prepend=0))
+            tfs.append(np.array([self.postings[term][doc_id] for doc_id in ids], dtype="int32"))
+            offsets[i + 1] = offsets[i] + len(ids)
+        empty = np.zeros(0, dtype="int64")
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                terms=np.frombuffer(json.dumps(terms).encode("utf-8"), dtype="uint8"),
+                offsets=offsets,
+                doc_deltas=np.concatenate(doc_deltas) if doc_deltas else empty,
+                tfs=np.concatenate(tfs) if tfs else empty.astype("int32"),
+                doc_ids=np.array(list(self.doc_lengths), dtype="int64"),
+                doc_lengths=np.array(list(self.doc_lengths.values()), dtype="int64"),
+            )
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            terms = json.loads(data["terms"].tobytes().decode("utf-8"))
+            offsets, doc_deltas, tfs = data["offsets"], data["doc_deltas"], data["tfs"]
+            for i, term in enumerate(terms):
+                start, stop = offsets[i], offsets[i + 1]
+                ids = np.cumsum(doc_deltas[start:stop])
+                index.postings[term] = dict(zip(ids.tolist(), tfs[start:stop].tolist()))
+            index.doc_lengths = dict(zip(data["doc_ids"].tolist(), data["doc_lengths"].tolist()))
+        index.total_length = sum(index.doc_lengths.values())
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuses ranked id lists by summing 1 / (k + rank); returns (id, score) pairs, best first"""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1 / (k + rank)
+    return scores.most_common()
@@ -1,7 +1,12 @@
 import pytest
 from unittest.mock import patch, MagicMock
 import numpy as np
-from app import load_text_files, main
+import os
+from app import load_text_files, main, IndexManager
+from indexes import create_index, set_search_params, benchmark_indexes, synthetic_vectors
+from sparse import BM25Index, reciprocal_rank_fusion, tokenize
+from embedding_store import EmbeddingStore
+import faiss
 
 class TestLoadTextFiles:
     def test_load_text_files_with_txt_files(self, tmp_path):
@@ -34,41 +39,417 @@ class TestLoadTextFiles:
         with pytest.raises(FileNotFoundError):
             load_text_files("non_existent_folder")
 
+def fake_encode(texts, **kwargs):
+    return np.array([[len(text), text.count("a")] for text in texts], dtype="float32")
+
+@pytest.fixture
+def fake_model():
+    with patch('app.model') as mock_model:
+        mock_model.get_sentence_embedding_dimension.return_value = 2
+        mock_model.encode.side_effect = fake_encode
+        yield mock_model
+
+class TestIndexManager:
+    def make_folder(self, tmp_path):
+        folder = tmp_path / "data"
+        folder.mkdir()
+        (folder / "a.txt").write_text("aaaa")
+        (folder / "b.txt").write_text("bb")
+        (folder / "c.md").write_text("ignored")
+        return folder
+
+    def test_initial_build_and_reload(self, tmp_path, fake_model):
+        folder = self.make_folder(tmp_path)
+        index_dir = str(tmp_path / "index")
+        manager = IndexManager(str(folder), index_dir)
+        assert manager.update() == {"added": 2, "updated": 0, "removed": 0, "unchanged": 0}
+        manager.save()
+
+        fake_model.encode.reset_mock()
+        reloaded = IndexManager(str(folder), index_dir)
+        assert reloaded.update() == {"added": 0, "updated": 0, "removed": 0, "unchanged": 2}
+        fake_model.encode.assert_not_called()
+        assert reloaded.index.ntotal == 2
+        assert not os.path.exists(os.path.join(index_dir, "docs.faiss.tmp"))
+
+    def test_incremental_changes(self, tmp_path, fake_model):
+        folder = self.make_folder(tmp_path)
+        manager = IndexManager(str(folder), str(tmp_path / "index"))
+        manager.update()
+
+        (folder / "a.txt").write_text("a")
+        os.utime(folder / "a.txt", (1, 1))
+        (folder / "b.txt").unlink()
+        (folder / "d.txt").write_text("dddddddd")
+        fake_model.encode.reset_mock()
+
+        assert manager.update() == {"added": 1, "updated": 1, "removed": 1, "unchanged": 0}
+        assert fake_model.encode.call_count == 1
+        assert manager.index.ntotal == 2
+        assert [name for name, _ in manager.search("q", k=2)] == ["a.txt", "d.txt"]
+
+    def test_touched_file_is_not_reencoded(self, tmp_path, fake_model):
+        folder = self.make_folder(tmp_path)
+        manager = IndexManager(str(folder), str(tmp_path / "index"))
+        manager.update()
+        os.utime(folder / "a.txt", (1, 1))
+        fake_model.encode.reset_mock()
+
+        assert manager.update()["unchanged"] == 2
+        fake_model.encode.assert_not_called()
+
+    def test_index_from_another_save_triggers_rebuild(self, tmp_path, fake_model):
+        folder = self.make_folder(tmp_path)
+        index_dir = str(tmp_path / "index")
+        manager = IndexManager(str(folder), index_dir)
+        manager.update()
+        manager.save()
+        # Same document count, different vectors: counts alone can't tell it apart
+        stale = faiss.IndexIDMap(faiss.IndexFlatL2(2))
+        stale.add_with_ids(np.zeros((2, 2), dtype="float32"), np.array([0, 1], dtype="int64"))
+        faiss.write_index(stale, os.path.join(index_dir, "docs.faiss"))
+
+        assert IndexManager(str(folder), index_dir).update()["added"] == 2
+
+    def test_unsaved_store_changes_trigger_rebuild(self, tmp_path, fake_model):
+        folder = self.make_folder(tmp_path)
+        index_dir = str(tmp_path / "index")
+        manager = IndexManager(str(folder), index_dir)
+        manager.update()
+        manager.save()
+        assert IndexManager(str(folder), index_dir).embeddings.generation == 1
+        # A crash after rows were rewritten in place, before the next save
+        manager.embeddings.remove(np.array([0]))
+        manager.embeddings.append(np.array([0]), np.zeros((1, 2), dtype="float32"))
+
+        assert IndexManager(str(folder), index_dir).update()["added"] == 2
+
+    def test_search_skips_missing_results(self, tmp_path, fake_model):
+        folder = self.make_folder(tmp_path)
+        manager = IndexManager(str(folder), str(tmp_path / "index"))
+        manager.update()
+        assert len(manager.search("aaa", k=5)) == 2
+
+class TestBM25Index:
+    def make_index(self):
+        index = BM25Index()
+        index.add(0, "Artificial intelligence and machine learning")
+        index.add(1, "Cooking pasta with tomato sauce")
+        index.add(2, "AI systems: machine learning, AI safety")
+        return index
+
+    def test_tokenize(self):
+        assert tokenize("AI-driven, Machine learning!") == ["ai", "driven", "machine", "learning"]
+
+    def test_search_ranks_by_bm25(self):
+        index = self.make_index()
+        results = index.search("AI learning", k=3)
+        assert [doc_id for doc_id, _ in results] == [2, 0]
+        assert results[0][1] > results[1][1] > 0
+        assert index.search("unknown words") == []
+
+    def test_incremental_add_and_remove(self):
+        index = self.make_index()
+        index.remove([2])
+        assert [doc_id for doc_id, _ in index.search("AI")] == []
+        assert "safety" not in index.postings
+        index.add(0, "pasta again")
+        assert [doc_id for doc_id, _ in index.search("pasta")] == [0, 1]
+        assert index.total_length == sum(index.doc_lengths.values())
+
+    def test_save_and_load_round_trip(self, tmp_path):
+        index = self.make_index()
+        index.add(1000000, "ai")
+        path = str(tmp_path / "sparse.npz")
+        index.save(path)
+        loaded = BM25Index.load(path)
+        assert loaded.postings == index.postings
+        assert loaded.doc_lengths == index.doc_lengths
+        assert loaded.search("machine ai") == index.search("machine ai")
+
+    def test_empty_index_round_trip(self, tmp_path):
+        path = str(tmp_path / "sparse.npz")
+        BM25Index().save(path)
+        assert len(BM25Index.load(path)) == 0
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60)
+        assert [doc_id for doc_id, _ in fused] == [1, 3, 2]
+        assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+
+class TestHybridSearch:
+    def make_folder(self, tmp_path):
+        folder = tmp_path / "data"
+        folder.mkdir()
+        (folder / "ai.txt").write_text("Notes on AI and neural networks")
+        (folder / "food.txt").write_text("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaa pasta recipes")
+        (folder / "travel.txt").write_text("Trip to Italy")
+        return folder
+
+    def test_sparse_and_hybrid_search(self, tmp_path, fake_model):
+        manager = IndexManager(str(self.make_folder(tmp_path)), str(tmp_path / "index"))
+        manager.update()
+
+        assert manager.sparse_search("AI networks", k=3)[0][0] == "ai.txt"
+        names = [name for name, _ in manager.hybrid_search("AI networks", k=3)]
+        assert names[0] == "ai.txt"
+        assert sorted(names) == ["ai.txt", "food.txt", "travel.txt"]
+
+    def test_sparse_index_follows_updates_and_reloads(self, tmp_path, fake_model):
+        folder = self.make_folder(tmp_path)
+        index_dir = str(tmp_path / "index")
+        manager = IndexManager(str(folder), index_dir)
+        manager.update()
+        (folder / "ai.txt").unlink()
+        (folder / "travel.txt").write_text("AI trip planner")
+        manager.update()
+        manager.save()
+
+        reloaded = IndexManager(str(folder), index_dir)
+        assert reloaded.update()["unchanged"] == 2
+        assert [name for name, _ in reloaded.sparse_search("AI")] == ["travel.txt"]
+
+    def test_missing_sparse_index_triggers_rebuild(self, tmp_path, fake_model):
+        folder = self.make_folder(tmp_path)
+        index_dir = str(tmp_path / "index")
+        manager = IndexManager(str(folder), index_dir)
+        manager.update()
+        manager.save()
+        os.remove(os.path.join(index_dir, "sparse.npz"))
+
+        assert IndexManager(str(folder), index_dir).update()["added"] == 3
+
+class TestEmbeddingStore:
+    def test_append_grows_and_reopens(self, tmp_path):
+        store = EmbeddingStore(str(tmp_path), dimension=3)
+        vectors = np.arange(3000 * 3, dtype="float32").reshape(3000, 3)
+        store.append(np.arange(1000), vectors[:1000])
+        store.append(np.arange(1000, 3000), vectors[1000:])
+        store.flush()
+
+        reopened = EmbeddingStore(str(tmp_path), dimension=3)
+        assert len(reopened) == 3000
+        ids, batch = next(reopened.iter_batches(batch_size=5000))
+        assert ids.tolist() == list(range(3000))
+        assert np.array_equal(batch, vectors)
+        assert isinstance(reopened.vectors, np.memmap)
+
+    def test_remove_and_compact(self, tmp_path):
+        store = EmbeddingStore(str(tmp_path), dimension=2)
+        store.append(np.arange(10), np.ones((10, 2), dtype="float32") * np.arange(10)[:, None])
+        store.remove(np.array([1, 2, 3]))
+        assert len(store) == 7
+        store.compact()
+        assert store.count == 10  # fewer than half removed
+
+        store.remove(np.arange(4, 9))
+        store.compact()
+        assert store.count == 2
+        ids = np.concatenate([ids for ids, _ in store.iter_batches()])
+        assert ids.tolist() == [0, 9]
+        assert store.sample(10).tolist() == [[0, 0], [9, 9]]
+
+    def test_float16_returns_float32(self, tmp_path):
+        store = EmbeddingStore(str(tmp_path), dimension=2, dtype="float16")
+        store.append(np.array([7]), np.array([[0.5, 1.5]], dtype="float32"))
+        assert store.vectors.dtype == np.float16
+        _, vectors = next(store.iter_batches())
+        assert vectors.dtype == np.float32
+        assert vectors.tolist() == [[0.5, 1.5]]
+
+    def test_dimension_change_resets(self, tmp_path):
+        store = EmbeddingStore(str(tmp_path), dimension=2)
+        store.append(np.array([1]), np.zeros((1, 2), dtype="float32"))
+        store.flush()
+        assert len(EmbeddingStore(str(tmp_path), dimension=4)) == 0
+
+    def test_manager_rebuilds_hnsw_from_store(self, tmp_path, fake_model):
+        folder = tmp_path / "data"
+        folder.mkdir()
+        for i in range(3):
+            (folder / f"{i}.txt").write_text("a" * i)
+        manager = IndexManager(str(folder), str(tmp_path / "index"), index_type="hnsw")
+        manager.update()
+        (folder / "0.txt").unlink()
+        fake_model.encode.reset_mock()
+
+        manager.update()
+
+        # Removal rebuilt the graph from stored vectors, without re-embedding
+        fake_model.encode.assert_not_called()
+        assert manager.ntotal == 2
+        assert len(manager.embeddings) == 2
+
+class TestIndexTypes:
+    @pytest.mark.parametrize("index_type", ["ivf_flat", "hnsw"])
+    def test_manager_incremental_changes(self, tmp_path, fake_model, index_type):
+        folder = tmp_path / "data"
+        folder.mkdir()
+        for i in range(5):
+            (folder / f"{i}.txt").write_text("a" * i + "b")
+        manager = IndexManager(str(folder), str(tmp_path / "index"), index_type=index_type)
+        manager.update()
+        assert manager.ntotal == 5
+
+        (folder / "0.txt").unlink()
+        (folder / "1.txt").write_text("aaaaaaaaaa")
+        assert manager.update() == {"added": 0, "updated": 1, "removed": 1, "unchanged": 3}
+        assert manager.ntotal == 4
+        assert manager.search("aaaaaaaaab", k=1)[0][0] == "1.txt"
+
+    def test_ivf_retrains_when_corpus_outgrows_training(self, tmp_path, fake_model):
+        folder = tmp_path / "data"
+        folder.mkdir()
+        for i in range(40):
+            (folder / f"{i}.txt").write_text("a" * (i % 13) + "b" * i)
+        manager = IndexManager(str(folder), str(tmp_path / "index"), index_type="ivf_flat")
+        manager.update()
+        assert manager.manifest["trained_on"] == 40
+        assert faiss.extract_index_ivf(manager.index).nlist == 1
+
+        for i in range(40, 160):
+            (folder / f"{i}.txt").write_text("a" * (i % 13) + "b" * i)
+        manager.update()
+        assert manager.manifest["trained_on"] == 160
+        assert faiss.extract_index_ivf(manager.index).nlist == 4
+        assert manager.ntotal == 160
+
+    def test_hnsw_filters_deleted_ids_until_rebuild(self, tmp_path, fake_model):
+        folder = tmp_path / "data"
+        folder.mkdir()
+        for i in range(5):
+            (folder / f"{i}.txt").write_text("a" * i + "b")
+        index_dir = str(tmp_path / "index")
+        manager = IndexManager(str(folder), index_dir, index_type="hnsw")
+        manager.update()
+
+        with patch("app.HNSW_MAX_DELETED_RATIO", 0.5):
+            (folder / "0.txt").unlink()
+            (folder / "1.txt").write_text("aaaaaaaaaa")
+            manager.update()
+            # Two dead nodes in a graph of six: filtered out of searches, not rebuilt
+            assert manager.index.ntotal == 6
+            assert manager.ntotal == 4
+            live = ["1.txt", "2.txt", "3.txt", "4.txt"]
+            assert sorted(name for name, _ in manager.search("b", k=6)) == live
+            manager.save()
+            reloaded = IndexManager(str(folder), index_dir, index_type="hnsw")
+            assert reloaded.update()["unchanged"] == 4
+            assert sorted(name for name, _ in reloaded.search("b", k=6)) == live
+
+            (folder / "2.txt").unlink()
+            (folder / "3.txt").unlink()
+            reloaded.update()
+            assert reloaded.index.ntotal == 2
+            assert reloaded.manifest["deleted"] == []
+
+    @pytest.mark.parametrize("index_type", ["flat", "sq_fp16", "ivf_flat"])
+    def test_saved_index_is_memory_mapped_until_changed(self, tmp_path, fake_model, index_type):
+        def on_disk(index):
+            inner = faiss.downcast_index(index.index)
+            if isinstance(inner, faiss.IndexIVF):
+                return isinstance(faiss.downcast_InvertedLists(inner.invlists), faiss.OnDiskInvertedLists)
+            # Mapped flat and SQ codes are a view of the file, not a buffer the index owns
+            return not inner.codes.is_owned
+
+        folder = tmp_path / "data"
+        folder.mkdir()
+        for i in range(5):
+            (folder / f"{i}.txt").write_text("a" * i + "b")
+        index_dir = str(tmp_path / "index")
+        manager = IndexManager(str(folder), index_dir, index_type=index_type)
+        manager.update()
+        assert not on_disk(manager.index)
+        manager.save()
+
+        reloaded = IndexManager(str(folder), index_dir, index_type=index_type)
+        reloaded.update()
+        assert on_disk(reloaded.index)
+        assert reloaded.search("aab", k=1)[0][0] == "2.txt"
+
+        (folder / "0.txt").unlink()
+        (folder / "5.txt").write_text("aaaaab")
+        assert reloaded.update() == {"added": 1, "updated": 0, "removed": 1, "unchanged": 4}
+        assert not on_disk(reloaded.index)
+        assert reloaded.ntotal == 5
+        assert reloaded.search("aaaaab", k=1)[0][0] == "5.txt"
+
+    def test_manager_rebuilds_when_index_type_changes(self, tmp_path, fake_model):
+        folder = tmp_path / "data"
+        folder.mkdir()
+        (folder / "a.txt").write_text("aaaa")
+        index_dir = str(tmp_path / "index")
+        manager = IndexManager(str(folder), index_dir, index_type="flat")
+        manager.update()
+        manager.save()
+
+        switched = IndexManager(str(folder), index_dir, index_type="hnsw")
+        assert switched.update()["added"] == 1
+
+    def test_manager_rebuilds_when_embedding_precision_changes(self, tmp_path, fake_model):
+        folder = tmp_path / "data"
+        folder.mkdir()
+        (folder / "a.txt").write_text("aaaa")
+        index_dir = str(tmp_path / "index")
+        manager = IndexManager(str(folder), index_dir)
+        manager.update()
+        manager.save()
+        assert IndexManager(str(folder), index_dir).update()["unchanged"] == 1
+
+        # fp32 vectors must not be searched with (or mixed with) int8 ones
+        with patch.dict("app.EMBEDDING", precision="int8"):
+            switched = IndexManager(str(folder), index_dir)
+            assert switched.update()["added"] == 1
+            assert switched.manifest["embedding"] == {"model": "all-MiniLM-L6-v2", "precision": "int8"}
+
+    def test_create_index_types(self):
+        vectors = synthetic_vectors(500, 16)
+        for index_type in ["flat", "sq_fp16", "sq8", "ivf_flat", "ivf_pq", "hnsw"]:
+            index = create_index(index_type, 16, vectors)
+            index.add(vectors)
+            _, ids = index.search(vectors[:5], 1)
+            assert ids.shape == (5, 1)
+
+    def test_create_index_errors(self):
+        with pytest.raises(ValueError):
+            create_index("unknown", 16)
+        with pytest.raises(ValueError):
+            create_index("ivf_flat", 16)
+
+    def test_set_search_params_through_id_map(self):
+        vectors = synthetic_vectors(500, 16)
+        index = faiss.IndexIDMap(create_index("ivf_flat", 16, vectors))
+        set_search_params(index, nprobe=3)
+        assert faiss.extract_index_ivf(index).nprobe == 3
+        index = faiss.IndexIDMap(create_index("hnsw", 16))
+        set_search_params(index, ef_search=7)
+        assert faiss.downcast_index(index.index).hnsw.efSearch == 7
+
+    def test_benchmark_indexes_reports_recall(self):
+        vectors = synthetic_vectors(1000, 16)
+        results = benchmark_indexes(vectors[50:], vectors[:50], k=5, sweeps={"flat": [{}], "hnsw": [{"ef_search": 64}]})
+        assert [row["index_type"] for row in results] == ["flat", "hnsw"]
+        assert results[0]["recall_at_k"] == 1.0
+        assert 0 <= results[1]["recall_at_k"] <= 1
+        assert results[1]["latency_ms_per_query"] >= 0
+
 class TestMain:
-    @patch('app.load_text_files')
+    @patch('app.IndexManager')
     @patch('builtins.print')
-    @patch('faiss.IndexFlatL2')
-    @patch('app.model.encode')
-    def test_main_success(self, mock_encode, mock_index_class, mock_print, mock_load):
-        # Mock load_text_files
-        mock_load.return_value = (["file1.txt", "file2.txt"], ["text1", "text2"])
-
-        # Mock encode for texts
-        texts_embeddings = np.array([[0.1, 0.2], [0.3, 0.4]])
-        query_embedding = np.array([[0.5, 0.6]])
-        mock_encode.side_effect = [texts_embeddings, query_embedding]
-
-        # Mock FAISS index
-        mock_index = MagicMock()
-        mock_index_class.return_value = mock_index
-        mock_index.ntotal = 2
-        distances = np.array([[0.1, 0.2, 0.3]])
-        indices = np.array([[0, 1, 0]])
-        mock_index.search.return_value = (distances, indices)
-
-        # Call main
+    def test_main_success(self, mock_print, mock_manager_class):
+        mock_manager = MagicMock()
+        mock_manager_class.return_value = mock_manager
+        mock_manager.update.return_value = {"added": 1, "updated": 0, "removed": 0, "unchanged": 1}
+        mock_manager.ntotal = 2
+        mock_manager.hybrid_search.return_value = [("file1.txt", 0.1), ("file2.txt", 0.2)]
+
         main()
 
-        # Assertions
-        mock_load.assert_called_once_with("Data")
-        assert mock_encode.call_count == 2
-        mock_encode.assert_any_call(["text1", "text2"], convert_to_tensor=False, show_progress_bar=True)
-        mock_encode.assert_any_call(["Which files talk about AI?"])
-        mock_index_class.assert_called_once_with(2)
-        mock_index.add.assert_called_once()
-        mock_index.search.assert_called_once()
+        mock_manager_class.assert_called_once_with("Data")
+        mock_manager.save.assert_called_once()
+        mock_manager.hybrid_search.assert_called_once_with("Which files talk about AI?", 3)
         mock_print.assert_any_call("Stored 2 documents in FAISS index.")
+        mock_print.assert_any_call("Added 1, updated 0, removed 0 documents.")
         mock_print.assert_any_call("\nTop matching files:\n")
-        mock_print.assert_any_call("1. file1.txt  (distance=0.1000)")
-        mock_print.assert_any_call("2. file2.txt  (distance=0.2000)")
-        mock_print.assert_any_call("3. file1.txt  (distance=0.3000)")
+        mock_print.assert_any_call("1. file1.txt  (score=0.1000)")
+        mock_print.assert_any_call("2. file2.txt  (score=0.2000)")
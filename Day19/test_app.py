@@ -1,7 +1,18 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch
-from app import app
+from unittest.mock import patch, AsyncMock, MagicMock
+from concurrent.futures import Future
+from types import SimpleNamespace
+import asyncio
+import os
+import threading
+import time
+import torch
+from transformers import DynamicCache
+from engine import GenerationEngine
+from app import app, StopOnFlag, stream_events
+from warmup import WARMUP_LENGTHS, WARMUP_NEW_TOKENS, Readiness
+from inference import InferenceExecutor
 
 client = TestClient(app)
 
@@ -39,3 +50,191 @@ def test_ask_question_missing_question():
 def test_ask_question_invalid_question_type():
     response = client.post("/qa", json={"question": 123})
     assert response.status_code == 422  # Pydantic validation error for int instead of str
+
+def test_ask_question_busy():
+    with patch("app.executor.capacity", 0):
+        response = client.post("/qa", json={"question": "What is AI?"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert response.json() == {"detail": "Server is busy, try again later"}
+
+def test_process_pool_executor_uses_spawned_workers():
+    executor = InferenceExecutor(workers=2, queue_size=0, use_processes=True)
+    try:
+        assert executor.pool._mp_context.get_start_method() == "spawn"
+        executor.start()
+        # One call in every worker, none in this process
+        pids = executor.broadcast(os.getpid)
+        assert len(set(pids)) == 2 and os.getpid() not in pids
+        async def run_calls():
+            return await asyncio.gather(executor.run(os.getpid), executor.run(pow, 2, 10))
+        pid, power = asyncio.run(run_calls())
+        assert pid != os.getpid()
+        assert power == 1024
+        # Calls that can't be pickled run on the executor's own bounded threads, not the default executor
+        thread = asyncio.run(executor.run(lambda: threading.current_thread().name, in_process=True))
+        assert thread.startswith("inference")
+    finally:
+        executor.pool.shutdown()
+        executor.local_pool.shutdown()
+
+def test_broadcast_raises_when_a_worker_never_reaches_the_barrier():
+    executor = InferenceExecutor(workers=2, queue_size=0, use_processes=True)
+    try:
+        executor.start()
+        executor.broadcast_timeout = 0.5
+        # One worker is busy past the timeout, so the other waits at the barrier alone
+        busy = executor.pool.submit(time.sleep, 3)
+        with pytest.raises(RuntimeError, match="did not reach all 2 inference workers"):
+            executor.broadcast(os.getpid)
+        busy.result()
+    finally:
+        executor.pool.shutdown()
+        executor.local_pool.shutdown()
+
+def test_process_pool_executor_rejects_fork():
+    with pytest.raises(ValueError):
+        InferenceExecutor(use_processes=True, start_method="fork")
+
+class FakeStreamer:
+    def __init__(self, *args, **kwargs):
+        self.tokens = iter(["Hello", "", " world"])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.tokens)
+
+    def end(self):
+        pass
+
+def test_ask_question_stream_success():
+    with patch('app.qa_pipeline') as mock_pipeline, patch('app.TextIteratorStreamer', FakeStreamer):
+        mock_pipeline.tokenizer.return_value = {"input_ids": [[1, 2]]}
+        response = client.post("/qa/stream", json={"question": "Hi"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = response.text.strip().split("\n\n")
+    assert events[0] == 'data: {"token": "Hello"}'
+    assert events[1] == 'data: {"token": " world"}'
+    assert events[2] == 'event: done\ndata: {"question": "Hi", "answer": "HiHello world"}'
+    mock_pipeline.model.generate.assert_called_once()
+
+def test_ask_question_stream_generation_error():
+    class EmptyStreamer(FakeStreamer):
+        def __init__(self, *args, **kwargs):
+            self.tokens = iter([])
+
+    with patch('app.qa_pipeline') as mock_pipeline, patch('app.TextIteratorStreamer', EmptyStreamer):
+        mock_pipeline.tokenizer.return_value = {"input_ids": [[1, 2]]}
+        mock_pipeline.model.generate.side_effect = Exception("Generation failed")
+        response = client.post("/qa/stream", json={"question": "Hi"})
+    assert response.status_code == 200
+    assert response.text == 'event: error\ndata: {"detail": "Generation failed"}\n\n'
+
+def test_stream_stops_generation_when_client_disconnects():
+    stop = StopOnFlag()
+    request = SimpleNamespace(is_disconnected=AsyncMock(side_effect=[False, True]))
+
+    async def collect():
+        generation = asyncio.get_running_loop().create_future()
+        return [event async for event in stream_events(request, "Hi", FakeStreamer(), generation, stop)]
+
+    assert asyncio.run(collect()) == ['data: {"token": "Hello"}\n\n']
+    assert stop(torch.tensor([[1, 2], [3, 4]]), None).tolist() == [True, True]
+
+def test_stop_flag_unset_lets_generation_continue():
+    assert StopOnFlag()(torch.tensor([[1, 2]]), None).tolist() == [False]
+
+def test_ask_question_stream_empty_question():
+    response = client.post("/qa/stream", json={"question": "  "})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Question cannot be empty"
+
+class CountingTokenizer:
+    """Prompts are space-separated token ids; token 9 is EOS"""
+    eos_token_id = 9
+    pad_token_id = 0
+
+    def __call__(self, prompt, return_tensors=None):
+        return {"input_ids": torch.tensor([[int(t) for t in prompt.split()]])}
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(f" {t}" for t in ids if not (skip_special_tokens and t == self.eos_token_id))
+
+class CountingModel:
+    """Predicts last input token + 1 and keeps one cache column per processed token"""
+
+    def __call__(self, input_ids, attention_mask, past_key_values=None, use_cache=True):
+        batch, length = input_ids.shape
+        keys = input_ids.float().view(batch, 1, length, 1)
+        if past_key_values is not None:
+            keys = torch.cat([past_key_values.to_legacy_cache()[0][0], keys], dim=-2)
+        assert keys.shape[-2] == attention_mask.shape[1]
+        logits = torch.nn.functional.one_hot(input_ids[:, -1] + 1, num_classes=10).float().unsqueeze(1)
+        return SimpleNamespace(logits=logits, past_key_values=DynamicCache.from_legacy_cache(((keys, keys),)))
+
+def test_generation_engine_batches_and_retires_sequences():
+    engine = GenerationEngine(CountingModel(), CountingTokenizer(), max_batch_size=4)
+    futures = [
+        engine.submit("1", max_new_tokens=3),
+        engine.submit("5 6", max_new_tokens=10),
+        engine.submit("2 3 4", max_new_tokens=1),
+    ]
+    results = [future.result(timeout=10) for future in futures]
+    engine.close()
+    assert results == ["1 2 3 4", "5 6 7 8", "2 3 4 5"]
+    assert engine.active == []
+    with pytest.raises(RuntimeError):
+        engine.submit("1")
+
+def test_ask_question_uses_generation_engine():
+    future = Future()
+    future.set_result("What is AI? An answer.")
+    with patch('app.engine') as mock_engine, patch('app.qa_pipeline') as mock_pipeline:
+        mock_engine.is_full.return_value = False
+        mock_engine.submit.return_value = future
+        response = client.post("/qa", json={"question": "What is AI?"})
+    assert response.status_code == 200
+    assert response.json() == {"question": "What is AI?", "answer": "What is AI? An answer."}
+    mock_engine.submit.assert_called_once_with("What is AI?", max_new_tokens=100)
+    mock_pipeline.assert_not_called()
+
+def test_ask_question_generation_engine_full():
+    with patch('app.engine') as mock_engine:
+        mock_engine.is_full.return_value = True
+        response = client.post("/qa", json={"question": "What is AI?"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+def test_healthz_and_readyz_after_warmup():
+    readiness = Readiness()
+    with patch('app.qa_pipeline') as mock_pipeline, patch('app.readiness', readiness):
+        with TestClient(app) as warm_client:
+            assert readiness.wait(timeout=10)
+            assert warm_client.get("/healthz").json() == {"status": "ok"}
+            response = warm_client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+    prompts = [call.args[0] for call in mock_pipeline.call_args_list]
+    assert [len(prompt.split()) for prompt in prompts] == WARMUP_LENGTHS
+    assert all(call.kwargs == {"max_new_tokens": WARMUP_NEW_TOKENS} for call in mock_pipeline.call_args_list)
+
+def test_readyz_waits_for_process_pool_warmup():
+    import app as app_module
+    readiness = Readiness()
+    executor = MagicMock(use_processes=True)
+    with patch('app.qa_pipeline') as mock_pipeline, patch('app.executor', executor), patch('app.readiness', readiness):
+        with TestClient(app) as warm_client:
+            assert readiness.wait(timeout=10)
+            assert warm_client.get("/readyz").status_code == 200
+    # The streaming path runs here and the rest in the workers, so both are warmed up for every length
+    assert mock_pipeline.call_count == len(WARMUP_LENGTHS)
+    assert [call.args[0] for call in executor.broadcast.call_args_list] == [app_module.warm_pipeline] * len(WARMUP_LENGTHS)
+
+def test_readyz_before_warmup():
+    with patch('app.readiness', Readiness()):
+        response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["status"] == "starting"
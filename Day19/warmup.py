@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_LENGTHS = [int(n) for n in os.getenv("WARMUP_LENGTHS", "8,64,256").split(",")]
+# Generation warm-ups only need a few decode steps; the prompt length is what varies
+WARMUP_NEW_TOKENS = int(os.getenv("WARMUP_NEW_TOKENS", "4"))
+
+WARMUP_PASSAGE = (
+    "The new release improves response times and the support team was friendly and quick to help, "
+    "although the documentation still leaves a few questions open about configuration and deployment. "
+)
+
+
+def warmup_texts(lengths=WARMUP_LENGTHS, passage=WARMUP_PASSAGE):
+    """One representative input per length, in words, so kernels and caches see short and long sequences"""
+    words = passage.split()
+    return [" ".join(words[i % len(words)] for i in range(length)) for length in lengths]
+
+
+class Readiness:
+    """Tracks whether the app's models are loaded and warmed up.
+
+    start() runs every warm-up function over warmup_texts() in a background
+    thread, so the server already answers /healthz (liveness) while /readyz
+    (readiness) keeps returning 503 until the first requests no longer pay for
+    lazy kernel initialization, allocator growth and tokenizer caches.
+    """
+
+    def __init__(self):
+        self.state = "starting"
+        self.error = None
+        self.timings = {}
+        self._done = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def start(self, warmups, enabled=WARMUP_ENABLED, lengths=WARMUP_LENGTHS):
+        if not enabled:
+            self.state = "ready"
+            self._done.set()
+            return
+        self.state = "warming_up"
+        self._thread = threading.Thread(target=self.run, args=(warmups, lengths), name="warmup", daemon=True)
+        self._thread.start()
+
+    def run(self, warmups, lengths=WARMUP_LENGTHS):
+        try:
+            for name, warmup in warmups.items():
+                for length, text in zip(lengths, warmup_texts(lengths)):
+                    start = time.perf_counter()
+                    warmup(text)
+                    self.timings[f"{name}/{length}"] = round((time.perf_counter() - start) * 1000, 2)
+            self.state = "ready"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+        finally:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def describe(self):
+        status = {"status": self.state, "warmup_ms": self.timings}
+        if self.error is not None:
+            status["error"] = self.error
+        return status
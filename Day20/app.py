@@ -2,37 +2,264 @@ from transformers import pipeline
 from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
+import torch
+import os
+import hashlib
+import json
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from pypdf import PdfReader
+from indexes import INDEX_TYPE, create_index, mmap_flags
+from chunking import token_chunks
+from quantization import INFERENCE_PRECISION, quantize_model
 
 # --- Step 1: Extract Text from PDF ---
-def extract_text_from_pdf(pdf_path):
-    text = ""
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "1"))
+PAGES_PER_TASK = 16
+
+def extract_page_range(pdf_path, start, stop):
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def iter_pdf_pages(pdf_path, workers=PDF_WORKERS):
+    """Yields the text of each page in order; with workers > 1 page ranges are extracted in a process pool"""
     reader = PdfReader(pdf_path)
-    for page in reader.pages:
-        text += page.extract_text() or ""
-    return text
+    if workers <= 1:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+    total = len(reader.pages)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(extract_page_range, pdf_path, start, min(start + PAGES_PER_TASK, total))
+            for start in range(0, total, PAGES_PER_TASK)
+        ]
+        for future in futures:
+            yield from future.result()
+
+def extract_text_from_pdf(pdf_path, workers=PDF_WORKERS):
+    # Join once instead of growing a string page by page
+    return "".join(iter_pdf_pages(pdf_path, workers))
 
 
 # --- Step 2: Split into Chunks ---
-def chunk_text(text, chunk_size=400):
-    words = text.split()
-    return [" ".join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "32"))
+
+def chunk_text(text, tokenizer, chunk_size=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    # Cut on token boundaries so no chunk is silently truncated by the embedder
+    return token_chunks(text, tokenizer, chunk_size, overlap)
 
 
 # --- Step 3: Create Embeddings and FAISS Index ---
-def create_faiss_index(chunks):
-    embedder = SentenceTransformer("all-MiniLM-L6-v2")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+_embedder = None
+_embedder_lock = threading.Lock()
+
+def get_embedder():
+    """Loads the sentence embedding model once and reuses it for every document and query"""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = quantize_model(SentenceTransformer(EMBEDDING_MODEL))
+        return _embedder
+
+EMBED_BATCH_SIZE = 32
+INDEX_ADD_BATCH_SIZE = 65536
+
+def iter_token_embeddings(embedder, token_ids, batch_size=EMBED_BATCH_SIZE):
+    """Embeds pre-tokenized chunks by calling the model on their ids directly, skipping encode()'s re-tokenization"""
+    tokenizer = embedder.tokenizer
+    for start in range(0, len(token_ids), batch_size):
+        batch = [tokenizer.build_inputs_with_special_tokens(ids) for ids in token_ids[start:start + batch_size]]
+        features = tokenizer.pad({"input_ids": batch}, return_tensors="pt")
+        features = {name: tensor.to(embedder.device) for name, tensor in features.items()}
+        with torch.no_grad():
+            yield embedder(features)["sentence_embedding"].cpu().numpy().astype("float32")
+
+def embed_token_ids(embedder, token_ids, batch_size=EMBED_BATCH_SIZE):
+    embeddings = list(iter_token_embeddings(embedder, token_ids, batch_size))
+    if not embeddings:
+        return np.zeros((0, embedder.get_sentence_embedding_dimension()), dtype="float32")
+    return np.concatenate(embeddings)
+
+def build_index(embeddings, index_type=INDEX_TYPE, batch_size=INDEX_ADD_BATCH_SIZE):
+    # "flat" is exact search; ivf_flat, ivf_pq and hnsw trade some recall for speed and memory (see indexes.py)
+    index = create_index(index_type, embeddings.shape[1], embeddings)
+    # Add slices straight from the (memory-mapped) array, so it is never copied into RAM as a whole
+    for start in range(0, len(embeddings), batch_size):
+        index.add(np.ascontiguousarray(embeddings[start:start + batch_size], dtype="float32"))
+    return index
+
+def create_faiss_index(chunks, index_type=INDEX_TYPE):
+    embedder = get_embedder()
     embeddings = embedder.encode(chunks)
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(np.array(embeddings))
-    return index, embedder
+    return build_index(embeddings, index_type), embedder
+
+
+# --- Document store: chunks, embeddings and index cached per PDF ---
+STORE_DIR = "doc_store"
+STORE_MAX_DOCUMENTS = int(os.getenv("STORE_MAX_DOCUMENTS", "8"))
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+class ChunkTable:
+    """Read-only sequence of a document's chunk texts, memory-mapped instead of loaded as a list.
+
+    The UTF-8 bytes of all chunks are concatenated in chunks.bin and chunk i
+    spans offsets[i]:offsets[i + 1] of chunk_offsets.npy, so looking up a chunk
+    by its FAISS id reads only that chunk.
+    """
+
+    def __init__(self, directory):
+        self.offsets = np.load(os.path.join(directory, "chunk_offsets.npy"), mmap_mode="r")
+        path = os.path.join(directory, "chunks.bin")
+        # np.memmap can't map an empty file
+        self.data = np.memmap(path, dtype="uint8", mode="r") if os.path.getsize(path) else np.zeros(0, dtype="uint8")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    @staticmethod
+    def write(directory, chunks):
+        offsets = [0]
+        with open(os.path.join(directory, "chunks.bin"), "wb") as f:
+            for chunk in chunks:
+                data = chunk.encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        np.save(os.path.join(directory, "chunk_offsets.npy"), np.array(offsets, dtype="int64"))
+
+class DocumentStore:
+    """Caches each PDF's chunks, embeddings and FAISS index keyed by the PDF's content hash.
+
+    Recently used documents stay open (LRU, max_documents entries); every
+    document is persisted under store_dir/<sha256>-<settings>/ as a ChunkTable,
+    embeddings.npy and index.faiss, so a restart does not re-embed anything.
+    Chunks and index are memory-mapped (HNSW graphs excepted, see mmap_flags), so
+    an open document costs little RAM beyond the pages that searches touch.
+    <settings> is a hash of everything an entry is built with besides the PDF (index
+    type, chunk size and overlap, embedding model and INFERENCE_PRECISION), so a
+    configuration change re-ingests the document instead of reusing a stale entry.
+    """
+
+    def __init__(self, store_dir=STORE_DIR, max_documents=STORE_MAX_DOCUMENTS, index_type=INDEX_TYPE,
+                 chunk_tokens=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP, embedding_model=EMBEDDING_MODEL,
+                 precision=INFERENCE_PRECISION):
+        self.store_dir = store_dir
+        self.max_documents = max_documents
+        self.index_type = index_type
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        self.settings = {
+            "index_type": index_type,
+            "chunk_tokens": chunk_tokens,
+            "chunk_overlap": chunk_overlap,
+            "embedding_model": embedding_model,
+            "precision": precision,
+        }
+        self.settings_key = hashlib.sha256(json.dumps(self.settings, sort_keys=True).encode()).hexdigest()[:16]
+        self.documents = OrderedDict()
+        self.digests = {}
+        self._lock = threading.Lock()
+
+    def digest(self, pdf_path):
+        # Re-hash only when the file's size or mtime changed
+        stat = os.stat(pdf_path)
+        key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+        if key not in self.digests:
+            self.digests[key] = file_digest(pdf_path)
+        return self.digests[key]
+
+    def get(self, pdf_path):
+        """Returns (chunks, index) for a PDF, extracting and embedding it only the first time it is seen"""
+        digest = self.digest(pdf_path)
+        with self._lock:
+            if digest in self.documents:
+                self.documents.move_to_end(digest)
+                return self.documents[digest]
+
+            document = self._load(digest)
+            if document is None:
+                self._build(pdf_path, digest)
+                document = self._load(digest)
+            self.documents[digest] = document
+            while len(self.documents) > self.max_documents:
+                self.documents.popitem(last=False)
+            return document
+
+    def _path(self, digest):
+        return os.path.join(self.store_dir, f"{digest}-{self.settings_key}")
+
+    def _load(self, digest):
+        path = self._path(digest)
+        if not os.path.isdir(path):
+            return None
+        return ChunkTable(path), faiss.read_index(os.path.join(path, "index.faiss"), mmap_flags(self.index_type))
+
+    def _build(self, pdf_path, digest):
+        embedder = get_embedder()
+        # Leave room for the [CLS] and [SEP] tokens added around each chunk
+        chunk_size = min(self.chunk_tokens, embedder.max_seq_length - 2)
+        pieces = chunk_text(extract_text_from_pdf(pdf_path), embedder.tokenizer, chunk_size, self.chunk_overlap)
+
+        # Write into a temp directory and rename it, so a crash never leaves a partial entry
+        path = self._path(digest)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        ChunkTable.write(tmp_path, (chunk for chunk, _ in pieces))
+
+        # Stream each batch of embeddings to disk rather than collecting them in memory
+        embeddings_path = os.path.join(tmp_path, "embeddings.npy")
+        embeddings, row = None, 0
+        for batch in iter_token_embeddings(embedder, [ids for _, ids in pieces]):
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(embeddings_path, mode="w+", dtype="float32", shape=(len(pieces), batch.shape[1]))
+            embeddings[row:row + len(batch)] = batch
+            row += len(batch)
+        if embeddings is None:
+            embeddings = np.zeros((0, embedder.get_sentence_embedding_dimension()), dtype="float32")
+            np.save(embeddings_path, embeddings)
+        else:
+            embeddings.flush()
+        faiss.write_index(build_index(embeddings, self.index_type), os.path.join(tmp_path, "index.faiss"))
+        del embeddings
+
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another process stored the same document first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+document_store = DocumentStore()
 
 
 # --- Step 4: Retrieve Relevant Chunks ---
 def retrieve_relevant_chunks(query, model, index, chunks, top_k=3):
+    return [chunk for chunk, _ in retrieve_scored_chunks(query, model, index, chunks, top_k)]
+
+def retrieve_scored_chunks(query, model, index, chunks, top_k=3):
+    """Returns (chunk, L2 distance) pairs, nearest first"""
     query_emb = model.encode([query])
     distances, indices = index.search(np.array(query_emb), top_k)
-    return [chunks[i] for i in indices[0]]
+    return [(chunks[i], float(d)) for i, d in zip(indices[0], distances[0]) if i != -1]
 
 
 # --- Step 5: Use RAG Model (Roberta-based QA) ---
@@ -41,28 +268,60 @@ qa_pipeline = pipeline(
     model="deepset/roberta-base-squad2",
     tokenizer="deepset/roberta-base-squad2"
 )
+qa_pipeline.model = quantize_model(qa_pipeline.model)
+
+QA_MAX_SEQ_LEN = int(os.getenv("QA_MAX_SEQ_LEN", "384"))
+QA_DOC_STRIDE = int(os.getenv("QA_DOC_STRIDE", "128"))
+RETRIEVAL_WEIGHT = float(os.getenv("RETRIEVAL_WEIGHT", "0.3"))
 
 def answer_question(question, context):
     result = qa_pipeline(question=question, context=context)
     return result["answer"]
 
+def retrieval_weights(distances):
+    # Softmax over negative distances, so retrieval confidence is on the same 0-1 scale as span scores
+    weights = np.exp(-(np.asarray(distances) - min(distances)))
+    return weights / weights.sum()
+
+def answer_from_chunks(question, scored_chunks):
+    """Runs QA over every retrieved chunk as one padded batch and returns the best span with its source chunk.
+
+    Each candidate is ranked by (1 - RETRIEVAL_WEIGHT) * span score + RETRIEVAL_WEIGHT * retrieval weight.
+    """
+    if not scored_chunks:
+        return {"answer": "", "score": 0.0, "source": None}
+    chunks = [chunk for chunk, _ in scored_chunks]
+    results = qa_pipeline(
+        question=[question] * len(chunks),
+        context=chunks,
+        batch_size=len(chunks),
+        max_seq_len=QA_MAX_SEQ_LEN,
+        doc_stride=QA_DOC_STRIDE,
+    )
+    if isinstance(results, dict):
+        results = [results]
+    weights = retrieval_weights([distance for _, distance in scored_chunks])
+    candidates = [
+        ((1 - RETRIEVAL_WEIGHT) * result["score"] + RETRIEVAL_WEIGHT * weight, result["answer"], chunk)
+        for result, weight, chunk in zip(results, weights, chunks)
+    ]
+    score, answer, source = max(candidates, key=lambda candidate: candidate[0])
+    return {"answer": answer, "score": float(score), "source": source}
+
 
 # --- Step 6: Combine into One Function ---
 def rag_qa_from_pdf(pdf_path, question, top_k=3):
-    print("📘 Extracting text...")
-    text = extract_text_from_pdf(pdf_path)
-    chunks = chunk_text(text)
-
-    print("🔍 Creating embeddings...")
-    index, emb_model = create_faiss_index(chunks)
+    print("📘 Loading document (extracted and embedded only on first use)...")
+    chunks, index = document_store.get(pdf_path)
 
     print("🎯 Retrieving relevant context...")
-    relevant_chunks = retrieve_relevant_chunks(question, emb_model, index, chunks, top_k)
-    combined_context = " ".join(relevant_chunks)
+    scored_chunks = retrieve_scored_chunks(question, get_embedder(), index, chunks, top_k)
 
     print("🧠 Generating answer using RAG model...")
-    answer = answer_question(question, combined_context)
-    return answer
+    result = answer_from_chunks(question, scored_chunks)
+    if result["source"] is not None:
+        print(f"📎 Source: {result['source'][:200]}")
+    return result["answer"]
 
 
 def main():
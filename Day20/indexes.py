@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "sq_fp16", "sq8", "ivf_flat", "ivf_pq", "hnsw")
+
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "1024"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("PQ_M", "16"))
+PQ_NBITS = int(os.getenv("PQ_NBITS", "8"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+TRAIN_SAMPLE_SIZE = int(os.getenv("TRAIN_SAMPLE_SIZE", "100000"))
+
+def needs_training(index_type):
+    return index_type in ("sq8", "ivf_flat", "ivf_pq")
+
+def sample_vectors(vectors, size, seed=0):
+    if len(vectors) <= size:
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[rng.choice(len(vectors), size, replace=False)]
+
+def create_index(index_type, dimension, train_vectors=None):
+    """Builds an empty FAISS index of the given type, training IVF variants on a sample of train_vectors"""
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "sq_fp16":
+        # Exhaustive search over vectors stored as float16: half the memory of flat, near-identical results
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    if not needs_training(index_type):
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    if train_vectors is None or len(train_vectors) == 0:
+        raise ValueError(f"Index type '{index_type}' needs training vectors")
+
+    sample = np.ascontiguousarray(sample_vectors(train_vectors, TRAIN_SAMPLE_SIZE), dtype="float32")
+    if index_type == "sq8":
+        # One byte per dimension; training only learns each dimension's value range
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        index.train(sample)
+        return index
+    # k-means wants ~39 points per centroid; small corpora get fewer lists instead of a bad clustering
+    nlist = max(1, min(IVF_NLIST, len(sample) // 39))
+    quantizer = faiss.IndexFlatL2(dimension)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    else:
+        if dimension % PQ_M != 0:
+            raise ValueError(f"PQ_M={PQ_M} must divide the embedding dimension {dimension}")
+        nbits = max(1, min(PQ_NBITS, int(np.log2(len(sample)))))
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, PQ_M, nbits)
+    index.train(sample)
+    index.nprobe = min(IVF_NPROBE, nlist)
+    return index
+
+def mmap_flags(index_type):
+    """read_index flags that leave a saved index of this type on disk, paged in by searches (0 reads it into RAM)"""
+    if index_type in ("flat", "sq_fp16", "sq8"):
+        # IO_FLAG_MMAP only maps IVF lists; the codes of these IndexFlatCodes types need IO_FLAG_MMAP_IFC
+        return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return faiss.IO_FLAG_MMAP
+    # HNSW graphs are always read into RAM
+    return 0
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Tunes the recall/latency trade-off of an IVF (nprobe) or HNSW (efSearch) index, including inside an IndexIDMap"""
+    params = faiss.ParameterSpace()
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if nprobe is not None and isinstance(inner, faiss.IndexIVF):
+        params.set_index_parameter(index, "nprobe", min(nprobe, inner.nlist))
+    if ef_search is not None and isinstance(inner, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", ef_search)
+
+def index_size_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+# --- Recall vs latency benchmark ---
+DEFAULT_SWEEPS = {
+    "flat": [{}],
+    "sq_fp16": [{}],
+    "sq8": [{}],
+    "ivf_flat": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "ivf_pq": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "hnsw": [{"ef_search": ef} for ef in (16, 32, 64, 128)],
+}
+
+def recall_at_k(found, expected):
+    k = expected.shape[1]
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return hits / (len(expected) * k)
+
+def benchmark_indexes(vectors, queries, k=10, sweeps=DEFAULT_SWEEPS):
+    """Builds each index type over `vectors` and reports recall@k against exact search, per-query latency and size"""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    dimension = vectors.shape[1]
+
+    exact = faiss.IndexFlatL2(dimension)
+    exact.add(vectors)
+    _, expected = exact.search(queries, k)
+
+    results = []
+    for index_type, sweep in sweeps.items():
+        start = time.perf_counter()
+        index = create_index(index_type, dimension, vectors)
+        index.add(vectors)
+        build_time = time.perf_counter() - start
+        size = index_size_bytes(index)
+
+        for params in sweep:
+            set_search_params(index, **params)
+            start = time.perf_counter()
+            _, found = index.search(queries, k)
+            elapsed = time.perf_counter() - start
+            results.append({
+                "index_type": index_type,
+                "params": params,
+                "recall_at_k": round(recall_at_k(found, expected), 4),
+                "latency_ms_per_query": round(elapsed * 1000 / len(queries), 4),
+                "build_time_sec": round(build_time, 4),
+                "index_size_mb": round(size / 1e6, 2),
+            })
+    return results
+
+def synthetic_vectors(count, dimension, clusters=100, seed=0):
+    """Clustered random vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype("float32")
+    labels = rng.integers(0, clusters, size=count)
+    return centers[labels] + 0.3 * rng.normal(size=(count, dimension)).astype("float32")
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency benchmark of FAISS index types")
+    parser.add_argument("--embeddings", help=".npy file of float32 vectors; synthetic vectors are used if omitted")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", default="index_benchmark.json")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings, mmap_mode="r")
+    else:
+        vectors = synthetic_vectors(args.count + args.queries, args.dimension)
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+
+    results = benchmark_indexes(vectors, queries, k=args.k)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    for row in results:
+        print(f"{row['index_type']:<9} {json.dumps(row['params']):<20} recall@{args.k}={row['recall_at_k']:.4f} "
+              f"latency={row['latency_ms_per_query']:.4f}ms size={row['index_size_mb']}MB")
+
+if __name__ == '__main__':
+    main()
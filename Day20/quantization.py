@@ -0,0 +1,21 @@
+import os
+
+import torch
+
+PRECISIONS = ("fp32", "int8")
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32")
+
+
+def quantize_model(model, precision=INFERENCE_PRECISION):
+    """Returns `model` unchanged for fp32, or with its Linear layers dynamically quantized to int8.
+
+    Dynamic quantization stores Linear weights as int8 and quantizes activations
+    on the fly, which roughly halves the memory of transformer models and speeds
+    up CPU inference; it has no effect on GPU. Day25/quantization.py reports the
+    accuracy, size and latency delta of a precision against fp32.
+    """
+    if precision == "fp32":
+        return model
+    if precision == "int8":
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
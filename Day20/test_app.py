@@ -2,11 +2,16 @@ import pytest
 from unittest.mock import patch, MagicMock
 import sys
 import os
+import re
+import numpy as np
+import faiss
+import torch
 
 # Add the current directory to sys.path to import app
 sys.path.insert(0, os.path.dirname(__file__))
 
 import app
+from quantization import quantize_model
 
 class TestExtractTextFromPDF:
     @patch('app.PdfReader')
@@ -41,62 +46,122 @@ class TestExtractTextFromPDF:
         result = app.extract_text_from_pdf("no_text.pdf")
         assert result == ""
 
+    def test_extract_text_parallel_matches_serial(self):
+        pdf_path = os.path.join(os.path.dirname(__file__), "sample.pdf")
+        with patch('app.PAGES_PER_TASK', 2):
+            assert app.extract_text_from_pdf(pdf_path, workers=2) == app.extract_text_from_pdf(pdf_path, workers=1)
+
     @patch('app.PdfReader', side_effect=FileNotFoundError)
     def test_extract_text_file_not_found(self, mock_pdf_reader):
         with pytest.raises(FileNotFoundError):
             app.extract_text_from_pdf("nonexistent.pdf")
 
+class FakeTokenizer:
+    """Whitespace tokenizer: a token is a word"""
+
+    def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False):
+        words = list(re.finditer(r"\S+", text))
+        encoding = {'input_ids': [w.group() for w in words]}
+        if return_offsets_mapping:
+            encoding['offset_mapping'] = [w.span() for w in words]
+        return encoding
+
 class TestChunkText:
     def test_chunk_text_normal(self):
         text = "word1 word2 word3 word4 word5"
-        chunks = app.chunk_text(text, chunk_size=2)
-        assert chunks == ["word1 word2", "word3 word4", "word5"]
+        chunks = app.chunk_text(text, FakeTokenizer(), chunk_size=2, overlap=0)
+        assert [chunk for chunk, _ in chunks] == ["word1 word2", "word3 word4", "word5"]
 
     def test_chunk_text_empty(self):
-        chunks = app.chunk_text("", chunk_size=400)
+        chunks = app.chunk_text("", FakeTokenizer(), chunk_size=400)
         assert chunks == []
 
     def test_chunk_text_single_chunk(self):
         text = "word1 word2"
-        chunks = app.chunk_text(text, chunk_size=400)
-        assert chunks == ["word1 word2"]
+        chunks = app.chunk_text(text, FakeTokenizer(), chunk_size=400)
+        assert chunks == [("word1 word2", ["word1", "word2"])]
 
     def test_chunk_text_exact_chunk_size(self):
         text = "a " * 400
-        chunks = app.chunk_text(text, chunk_size=400)
+        chunks = app.chunk_text(text, FakeTokenizer(), chunk_size=400)
         assert len(chunks) == 1
-        assert len(chunks[0].split()) == 400
+        assert len(chunks[0][1]) == 400
 
     def test_chunk_text_chunk_size_one(self):
         text = "a b c"
-        chunks = app.chunk_text(text, chunk_size=1)
-        assert chunks == ["a", "b", "c"]
+        chunks = app.chunk_text(text, FakeTokenizer(), chunk_size=1, overlap=0)
+        assert [chunk for chunk, _ in chunks] == ["a", "b", "c"]
 
-class TestCreateFaissIndex:
-    @patch('app.SentenceTransformer')
-    @patch('app.faiss.IndexFlatL2')
-    @patch('app.np.array')
-    def test_create_faiss_index(self, mock_np_array, mock_index_flat_l2, mock_sentence_transformer):
-        mock_embedder = MagicMock()
-        mock_embeddings = MagicMock()
-        mock_embedder.encode.return_value = mock_embeddings
-        mock_sentence_transformer.return_value = mock_embedder
+    def test_chunk_text_overlap(self):
+        text = "a b c d e f g"
+        chunks = app.chunk_text(text, FakeTokenizer(), chunk_size=3, overlap=1)
+        assert [chunk for chunk, _ in chunks] == ["a b c", "c d e", "e f g"]
 
-        mock_index = MagicMock()
-        mock_index_flat_l2.return_value = mock_index
+    def test_chunk_text_invalid_overlap(self):
+        with pytest.raises(ValueError):
+            app.chunk_text("a b c", FakeTokenizer(), chunk_size=2, overlap=2)
 
-        mock_np_array.return_value = mock_embeddings
+class TestEmbedTokenIds:
+    def test_embeds_ids_without_encode(self):
+        embedder = MagicMock()
+        embedder.device = "cpu"
+        embedder.tokenizer.build_inputs_with_special_tokens.side_effect = lambda ids: [101] + ids + [102]
+        embedder.tokenizer.pad.side_effect = lambda encoded, return_tensors: {'input_ids': torch.tensor(encoded['input_ids'])}
+        embedder.side_effect = lambda features: {'sentence_embedding': features['input_ids'][:, 1:3].float()}
+
+        embeddings = app.embed_token_ids(embedder, [[1, 2], [3, 4], [5, 6]], batch_size=2)
+
+        assert embeddings.dtype == np.float32
+        assert embeddings.tolist() == [[1, 2], [3, 4], [5, 6]]
+        assert embedder.call_count == 2
+        embedder.encode.assert_not_called()
+
+    def test_no_chunks(self):
+        embedder = MagicMock()
+        embedder.get_sentence_embedding_dimension.return_value = 4
+        assert app.embed_token_ids(embedder, []).shape == (0, 4)
+
+class TestCreateFaissIndex:
+    @patch('app._embedder', None)
+    @patch('app.SentenceTransformer')
+    def test_create_faiss_index(self, mock_sentence_transformer):
+        mock_embedder = mock_sentence_transformer.return_value
+        embeddings = np.random.default_rng(0).normal(size=(10, 4)).astype("float32")
+        mock_embedder.encode.return_value = embeddings
 
-        chunks = ["chunk1", "chunk2"]
+        chunks = ["chunk"] * 10
         index, embedder = app.create_faiss_index(chunks)
 
         mock_sentence_transformer.assert_called_once_with("all-MiniLM-L6-v2")
         mock_embedder.encode.assert_called_once_with(chunks)
-        mock_index_flat_l2.assert_called_once()
-        mock_index.add.assert_called_once_with(mock_embeddings)
-        assert index == mock_index
+        assert isinstance(index, faiss.IndexFlatL2)
+        assert index.ntotal == 10
         assert embedder == mock_embedder
 
+    def test_build_index_adds_memmap_in_slices(self, tmp_path):
+        embeddings = np.lib.format.open_memmap(str(tmp_path / "e.npy"), mode="w+", dtype="float32", shape=(10, 4))
+        embeddings[:] = np.random.default_rng(0).normal(size=(10, 4))
+        index = faiss.IndexFlatL2(4)
+        with patch('app.create_index', return_value=index), patch.object(index, 'add', wraps=index.add) as add:
+            app.build_index(embeddings, batch_size=4)
+        assert [len(c.args[0]) for c in add.call_args_list] == [4, 4, 2]
+        assert index.ntotal == 10
+        _, ids = index.search(np.asarray(embeddings[7:8]), 1)
+        assert ids[0][0] == 7
+
+    @patch('app._embedder', None)
+    @patch('app.SentenceTransformer')
+    def test_create_faiss_index_hnsw(self, mock_sentence_transformer):
+        embeddings = np.random.default_rng(0).normal(size=(50, 16)).astype("float32")
+        mock_sentence_transformer.return_value.encode.return_value = embeddings
+
+        index, _ = app.create_faiss_index(["chunk"] * 50, index_type="hnsw")
+
+        assert isinstance(index, faiss.IndexHNSWFlat)
+        assert index.ntotal == 50
+        _, ids = index.search(embeddings[:1], 1)
+        assert ids[0][0] == 0
+
 class TestRetrieveRelevantChunks:
     def test_retrieve_relevant_chunks(self):
         mock_model = MagicMock()
@@ -104,10 +169,7 @@ class TestRetrieveRelevantChunks:
         mock_model.encode.return_value = mock_query_emb
 
         mock_index = MagicMock()
-        mock_distances = MagicMock()
-        mock_indices = MagicMock()
-        mock_indices.__getitem__.return_value = [0, 1, 2]
-        mock_index.search.return_value = (mock_distances, mock_indices)
+        mock_index.search.return_value = (np.array([[0.1, 0.2, 0.3]]), np.array([[0, 1, 2]]))
 
         chunks = ["chunk0", "chunk1", "chunk2", "chunk3"]
         result = app.retrieve_relevant_chunks("query", mock_model, mock_index, chunks, top_k=3)
@@ -116,6 +178,15 @@ class TestRetrieveRelevantChunks:
         mock_index.search.assert_called_once()
         assert result == ["chunk0", "chunk1", "chunk2"]
 
+    def test_retrieve_scored_chunks_skips_missing(self):
+        mock_model = MagicMock()
+        mock_index = MagicMock()
+        # FAISS pads with -1 when the index holds fewer than top_k vectors
+        mock_index.search.return_value = (np.array([[0.5, 3.4e38]]), np.array([[1, -1]]))
+
+        result = app.retrieve_scored_chunks("query", mock_model, mock_index, ["chunk0", "chunk1"], top_k=2)
+        assert result == [("chunk1", 0.5)]
+
 class TestAnswerQuestion:
     @patch('app.qa_pipeline')
     def test_answer_question(self, mock_qa_pipeline):
@@ -126,30 +197,202 @@ class TestAnswerQuestion:
         assert result == "Sample answer"
         mock_qa_pipeline.assert_called_once_with(question="question", context="context")
 
+class TestAnswerFromChunks:
+    @patch('app.qa_pipeline')
+    def test_runs_one_batch_and_returns_source(self, mock_qa_pipeline):
+        mock_qa_pipeline.return_value = [
+            {"answer": "first", "score": 0.2},
+            {"answer": "second", "score": 0.9},
+        ]
+
+        result = app.answer_from_chunks("question", [("chunk A", 0.1), ("chunk B", 0.3)])
+
+        assert result["answer"] == "second"
+        assert result["source"] == "chunk B"
+        mock_qa_pipeline.assert_called_once_with(
+            question=["question", "question"],
+            context=["chunk A", "chunk B"],
+            batch_size=2,
+            max_seq_len=app.QA_MAX_SEQ_LEN,
+            doc_stride=app.QA_DOC_STRIDE,
+        )
+
+    @patch('app.RETRIEVAL_WEIGHT', 0.5)
+    @patch('app.qa_pipeline')
+    def test_retrieval_score_breaks_close_spans(self, mock_qa_pipeline):
+        mock_qa_pipeline.return_value = [
+            {"answer": "near", "score": 0.5},
+            {"answer": "far", "score": 0.55},
+        ]
+        result = app.answer_from_chunks("question", [("near chunk", 0.1), ("far chunk", 2.0)])
+        assert result["answer"] == "near"
+        assert 0 < result["score"] < 1
+
+    @patch('app.qa_pipeline')
+    def test_single_chunk(self, mock_qa_pipeline):
+        mock_qa_pipeline.return_value = {"answer": "only", "score": 0.4}
+        result = app.answer_from_chunks("question", [("chunk", 1.0)])
+        assert result == {"answer": "only", "score": pytest.approx(0.7 * 0.4 + 0.3), "source": "chunk"}
+
+    @patch('app.qa_pipeline')
+    def test_no_chunks(self, mock_qa_pipeline):
+        assert app.answer_from_chunks("question", []) == {"answer": "", "score": 0.0, "source": None}
+        mock_qa_pipeline.assert_not_called()
+
+class TestGetEmbedder:
+    @patch('app._embedder', None)
+    @patch('app.SentenceTransformer')
+    def test_embedder_is_loaded_once(self, mock_sentence_transformer):
+        first = app.get_embedder()
+        second = app.get_embedder()
+        assert first is second
+        mock_sentence_transformer.assert_called_once_with("all-MiniLM-L6-v2")
+
+def fake_embed(embedder, token_ids):
+    yield np.array([[len(ids), ids.count("a")] for ids in token_ids], dtype="float32")
+
+class TestDocumentStore:
+    @pytest.fixture
+    def embed(self):
+        mock_embedder = MagicMock()
+        mock_embedder.tokenizer = FakeTokenizer()
+        mock_embedder.max_seq_length = 256
+        with patch('app.get_embedder', return_value=mock_embedder), \
+                patch('app.iter_token_embeddings', side_effect=fake_embed) as mock_embed:
+            yield mock_embed
+
+    def make_pdf(self, tmp_path, name, content):
+        path = tmp_path / name
+        path.write_bytes(content)
+        return str(path)
+
+    @patch('app.extract_text_from_pdf', return_value="a aa aaa b")
+    def test_second_question_reuses_embeddings(self, mock_extract, tmp_path, embed):
+        store = app.DocumentStore(str(tmp_path / "store"), index_type="flat")
+        pdf = self.make_pdf(tmp_path, "doc.pdf", b"pdf bytes")
+
+        chunks, index = store.get(pdf)
+        again = store.get(pdf)
+
+        assert list(chunks) == ["a aa aaa b"]
+        assert index.ntotal == 1
+        assert again[1] is index
+        assert isinstance(chunks, app.ChunkTable)
+        mock_extract.assert_called_once_with(pdf)
+        embed.assert_called_once()
+
+    @patch('app.extract_text_from_pdf', return_value="a b")
+    def test_store_persists_to_disk(self, mock_extract, tmp_path, embed):
+        store_dir = str(tmp_path / "store")
+        pdf = self.make_pdf(tmp_path, "doc.pdf", b"pdf bytes")
+        store = app.DocumentStore(store_dir)
+        store.get(pdf)
+        entry = store._path(app.file_digest(pdf))
+        for name in ["chunks.bin", "chunk_offsets.npy", "embeddings.npy", "index.faiss"]:
+            assert os.path.exists(os.path.join(entry, name))
+
+        embed.reset_mock()
+        chunks, index = app.DocumentStore(store_dir).get(pdf)
+        assert list(chunks) == ["a b"]
+        assert index.ntotal == 1
+        embed.assert_not_called()
+        assert np.load(os.path.join(entry, "embeddings.npy")).shape == (1, 2)
+
+    @patch('app.extract_text_from_pdf', return_value="a b")
+    def test_stored_flat_index_is_memory_mapped(self, mock_extract, tmp_path, embed):
+        store_dir = str(tmp_path / "store")
+        pdf = self.make_pdf(tmp_path, "doc.pdf", b"pdf bytes")
+        app.DocumentStore(store_dir, index_type="flat").get(pdf)
+        _, index = app.DocumentStore(store_dir, index_type="flat").get(pdf)
+        # The codes are a view of index.faiss, not a copy the index owns
+        assert not index.codes.is_owned
+        assert index.search(np.ones((1, 2), dtype="float32"), 1)[1][0][0] == 0
+
+    @patch('app.extract_text_from_pdf', return_value="a b")
+    def test_other_precision_does_not_reuse_entry(self, mock_extract, tmp_path, embed):
+        store_dir = str(tmp_path / "store")
+        pdf = self.make_pdf(tmp_path, "doc.pdf", b"pdf bytes")
+        app.DocumentStore(store_dir, precision="fp32").get(pdf)
+        app.DocumentStore(store_dir, precision="fp32").get(pdf)
+        assert embed.call_count == 1
+        # int8 embeddings are not searched against an fp32 index; the document is embedded again
+        app.DocumentStore(store_dir, precision="int8").get(pdf)
+        assert embed.call_count == 2
+        assert len(os.listdir(store_dir)) == 2
+
+    @pytest.mark.parametrize("changed", [{"index_type": "hnsw"}, {"chunk_tokens": 128}, {"chunk_overlap": 8}])
+    @patch('app.extract_text_from_pdf', return_value="a b")
+    def test_config_change_reingests(self, mock_extract, tmp_path, embed, changed):
+        store_dir = str(tmp_path / "store")
+        pdf = self.make_pdf(tmp_path, "doc.pdf", b"pdf bytes")
+        app.DocumentStore(store_dir).get(pdf)
+        app.DocumentStore(store_dir, **changed).get(pdf)
+        assert mock_extract.call_count == 2
+        assert embed.call_count == 2
+
+    @patch('app.extract_text_from_pdf', return_value="text")
+    def test_same_content_different_path_shares_entry(self, mock_extract, tmp_path, embed):
+        store = app.DocumentStore(str(tmp_path / "store"))
+        store.get(self.make_pdf(tmp_path, "one.pdf", b"same"))
+        store.get(self.make_pdf(tmp_path, "two.pdf", b"same"))
+        store.get(self.make_pdf(tmp_path, "three.pdf", b"different"))
+        assert mock_extract.call_count == 2
+
+    @patch('app.extract_text_from_pdf', return_value="text")
+    def test_lru_eviction(self, mock_extract, tmp_path, embed):
+        store = app.DocumentStore(str(tmp_path / "store"), max_documents=1)
+        first = self.make_pdf(tmp_path, "one.pdf", b"one")
+        store.get(first)
+        store.get(self.make_pdf(tmp_path, "two.pdf", b"two"))
+        assert len(store.documents) == 1
+        # Evicted from memory but still on disk, so no re-embedding
+        embed.reset_mock()
+        store.get(first)
+        embed.assert_not_called()
+
+class TestChunkTable:
+    def test_round_trip(self, tmp_path):
+        chunks = ["first chunk", "ünïcode chunk", "", "last"]
+        app.ChunkTable.write(str(tmp_path), chunks)
+        table = app.ChunkTable(str(tmp_path))
+        assert len(table) == 4
+        assert table[1] == "ünïcode chunk"
+        assert table[np.int64(3)] == "last"
+        assert table[-1] == "last"
+        assert table[1:3] == ["ünïcode chunk", ""]
+        assert list(table) == chunks
+        with pytest.raises(IndexError):
+            table[4]
+
+    def test_empty(self, tmp_path):
+        app.ChunkTable.write(str(tmp_path), [])
+        assert list(app.ChunkTable(str(tmp_path))) == []
+
 class TestRagQaFromPdf:
-    @patch('app.extract_text_from_pdf')
-    @patch('app.chunk_text')
-    @patch('app.create_faiss_index')
-    @patch('app.retrieve_relevant_chunks')
-    @patch('app.answer_question')
-    def test_rag_qa_from_pdf(self, mock_answer_question, mock_retrieve, mock_create_index, mock_chunk_text, mock_extract_text):
-        mock_extract_text.return_value = "extracted text"
-        mock_chunk_text.return_value = ["chunk1", "chunk2"]
+    @patch('app.document_store')
+    @patch('app.get_embedder')
+    @patch('app.retrieve_scored_chunks')
+    @patch('app.answer_from_chunks')
+    def test_rag_qa_from_pdf(self, mock_answer_from_chunks, mock_retrieve, mock_get_embedder, mock_store):
         mock_index = MagicMock()
         mock_embedder = MagicMock()
-        mock_create_index.return_value = (mock_index, mock_embedder)
-        mock_retrieve.return_value = ["relevant chunk"]
-        mock_answer_question.return_value = "final answer"
+        mock_store.get.return_value = (["chunk1", "chunk2"], mock_index)
+        mock_get_embedder.return_value = mock_embedder
+        mock_retrieve.return_value = [("relevant chunk", 0.2)]
+        mock_answer_from_chunks.return_value = {"answer": "final answer", "score": 0.8, "source": "relevant chunk"}
 
         result = app.rag_qa_from_pdf("pdf_path", "question", top_k=3)
 
-        mock_extract_text.assert_called_once_with("pdf_path")
-        mock_chunk_text.assert_called_once_with("extracted text")
-        mock_create_index.assert_called_once_with(["chunk1", "chunk2"])
+        mock_store.get.assert_called_once_with("pdf_path")
         mock_retrieve.assert_called_once_with("question", mock_embedder, mock_index, ["chunk1", "chunk2"], 3)
-        mock_answer_question.assert_called_once_with("question", "relevant chunk")
+        mock_answer_from_chunks.assert_called_once_with("question", [("relevant chunk", 0.2)])
         assert result == "final answer"
 
+class TestQuantization:
+    def test_quantize_model_fp32_is_unchanged(self):
+        model = torch.nn.Linear(8, 8)
+        assert quantize_model(model, "fp32") is model
+
 class TestMain:
     @patch('app.rag_qa_from_pdf')
     @patch('builtins.print')
@@ -1,23 +1,56 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, File, HTTPException, UploadFile
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from transformers import pipeline
 from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from jobs import JobQueue
+from quantization import quantize_model
+from rerank import RERANK_ENABLED, RERANK_MODEL, RERANK_CANDIDATES, Reranker
+import asyncio
+import numpy as np
 import os
+import queue
+import shutil
+import threading
+import uuid
 
 app = FastAPI(title="PDF QA Bot (LangChain + Hugging Face)")
 
 PDF_PATH = "sample.pdf"
 VECTOR_STORE_PATH = "faiss_store"
 TOP_K = 3
+QA_MAX_SEQ_LEN = int(os.getenv("QA_MAX_SEQ_LEN", "384"))
+QA_DOC_STRIDE = int(os.getenv("QA_DOC_STRIDE", "128"))
+RETRIEVAL_WEIGHT = float(os.getenv("RETRIEVAL_WEIGHT", "0.3"))
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "8"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+UPLOAD_DIR = "uploads"
+JOBS_DB_PATH = "jobs.db"
 
 # --- Initialize global variables ---
 embedding_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
 qa_model = pipeline("question-answering", model="deepset/roberta-base-squad2")
+# INFERENCE_PRECISION=int8 swaps in dynamically quantized Linear layers (see quantization.py)
+embedding_model.client = quantize_model(embedding_model.client)
+qa_model.model = quantize_model(qa_model.model)
+reranker = None
+if RERANK_ENABLED:
+    from sentence_transformers import CrossEncoder
+    reranker = Reranker(CrossEncoder(RERANK_MODEL))
 
 vectorstore = None
+# Chunk counts of the ingest jobs already merged into the store, by job id
+ingested_jobs = {}
+
+# Queries run in a thread pool against whichever store is current; ingest workers embed PDFs
+# in parallel and one merge thread builds the next store off to the side and swaps it in,
+# so readers never wait for an ingest
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+_swap_lock = threading.Lock()
+job_queue = None
 
 class QuestionRequest(BaseModel):
     question: str
@@ -31,51 +64,253 @@ def clean_text(text):
     return text.strip()
 
 # --- Load and Embed PDF ---
+def load_pdf_chunks(pdf_path):
+    loader = PyPDFLoader(pdf_path)
+    docs = loader.load()
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    chunks = splitter.split_documents(docs)
+    for c in chunks:
+        c.page_content = clean_text(c.page_content)
+    return chunks
+
+def recover_vectorstore(path=VECTOR_STORE_PATH):
+    """Finishes a save_vectorstore that crashed between its two renames, by putting the previous store back"""
+    old_path = path + ".old"
+    if not os.path.exists(path) and os.path.exists(old_path):
+        os.replace(old_path, path)
+    shutil.rmtree(path + ".tmp", ignore_errors=True)
+
 def initialize_vectorstore():
     global vectorstore
 
+    recover_vectorstore()
     if os.path.exists(VECTOR_STORE_PATH):
         print("✅ Loading existing FAISS index...")
         vectorstore = FAISS.load_local(VECTOR_STORE_PATH, embedding_model, allow_dangerous_deserialization=True)
+        ingested_jobs.update(ingested_job_chunks(vectorstore))
     else:
-        print("📘 Loading and processing PDF...")
-        loader = PyPDFLoader(PDF_PATH)
-        docs = loader.load()
-
-        print("✂️ Splitting text into chunks...")
-        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        chunks = splitter.split_documents(docs)
-        for c in chunks:
-            c.page_content = clean_text(c.page_content)
+        print("📘 Loading and splitting PDF...")
+        chunks = load_pdf_chunks(PDF_PATH)
 
         print("🔍 Creating embeddings and saving FAISS index...")
         vectorstore = FAISS.from_documents(chunks, embedding_model)
         vectorstore.save_local(VECTOR_STORE_PATH)
         print("✅ FAISS index saved!")
 
+def save_vectorstore(store, path=VECTOR_STORE_PATH):
+    # Save next to the old copy and rename, so a crash never leaves a half-written index;
+    # a crash between the renames is undone by recover_vectorstore on the next start
+    tmp_path, old_path = path + ".tmp", path + ".old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    store.save_local(tmp_path)
+    if os.path.exists(path):
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+def embed_pdf(pdf_path, job_id=None):
+    """Splits and embeds a PDF into a store of its own; returns (store, chunk count)"""
+    chunks = load_pdf_chunks(pdf_path)
+    for chunk in chunks:
+        # Recorded with the vectors, so a job that was merged but not marked done isn't merged twice
+        chunk.metadata["job_id"] = job_id
+    return FAISS.from_documents(chunks, embedding_model), len(chunks)
+
+def ingested_job_chunks(store):
+    """Counts a store's chunks per ingest job id"""
+    counts = {}
+    for doc_id in store.index_to_docstore_id.values():
+        job_id = store.docstore.search(doc_id).metadata.get("job_id")
+        if job_id is not None:
+            counts[job_id] = counts.get(job_id, 0) + 1
+    return counts
+
+def merge_stores(stores):
+    """Merges embedded PDFs into one copy of the current store, saves it and swaps it in"""
+    global vectorstore
+
+    with _swap_lock:
+        merged = vectorstore
+        if merged is not None:
+            # Merge into a copy: the current store keeps serving queries until the swap
+            merged = FAISS.deserialize_from_bytes(
+                merged.serialize_to_bytes(), embedding_model, allow_dangerous_deserialization=True
+            )
+        for store in stores:
+            if merged is None:
+                merged = store
+            else:
+                merged.merge_from(store)
+        save_vectorstore(merged)
+        vectorstore = merged
+
+def ingest_pdf(pdf_path, filename=None):
+    """Queues a PDF for the ingest workers and returns its job id"""
+    return job_queue.enqueue(pdf_path, filename or os.path.basename(pdf_path))
+
+def discard_upload(path):
+    # Only files saved by /ingest are removed; PDFs queued from elsewhere are left alone
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(UPLOAD_DIR):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def finish_job(jobs, job, chunks=None, error=None):
+    if error is None:
+        jobs.complete(job["id"], chunks)
+    else:
+        jobs.fail(job["id"], error)
+    discard_upload(job["path"])
+
+def ingest_worker(jobs, embedded):
+    while True:
+        job = jobs.claim()
+        if job["id"] in ingested_jobs:
+            # Merged before a crash that came before it was marked done
+            finish_job(jobs, job, ingested_jobs[job["id"]])
+            continue
+        try:
+            store, chunks = embed_pdf(job["path"], job["id"])
+        except Exception as e:
+            finish_job(jobs, job, error=str(e))
+            continue
+        embedded.put((job, store, chunks))
+
+def merge_worker(jobs, embedded):
+    # Copying and saving the store costs O(store size), so every PDF embedded while the
+    # previous merge ran is merged in the same pass instead of one copy per PDF
+    while True:
+        batch = [embedded.get()]
+        while True:
+            try:
+                batch.append(embedded.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            merge_stores([store for _, store, _ in batch])
+        except Exception as e:
+            for job, _, _ in batch:
+                finish_job(jobs, job, error=str(e))
+            continue
+        for job, _, chunks in batch:
+            ingested_jobs[job["id"]] = chunks
+            finish_job(jobs, job, chunks)
+
+def start_ingest_workers(workers=INGEST_WORKERS):
+    # Embedding runs in parallel across workers; only the merge into the live store is serialized
+    global job_queue
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    job_queue = JobQueue(JOBS_DB_PATH)
+    embedded = queue.Queue()
+    for i in range(workers):
+        threading.Thread(target=ingest_worker, args=(job_queue, embedded), name=f"ingest-{i}", daemon=True).start()
+    threading.Thread(target=merge_worker, args=(job_queue, embedded), name="ingest-merge", daemon=True).start()
+
+def retrieval_weights(distances):
+    # Softmax over negative distances, so retrieval confidence is on the same 0-1 scale as span scores
+    weights = np.exp(-(np.asarray(distances) - min(distances)))
+    return weights / weights.sum()
+
+def best_answer(question, scored_docs):
+    """Runs QA over every retrieved chunk as one padded batch and picks the best span.
+
+    Each candidate is ranked by (1 - RETRIEVAL_WEIGHT) * span score + RETRIEVAL_WEIGHT * retrieval weight.
+    Returns (answer, combined score, source document).
+    """
+    contexts = [doc.page_content for doc, _ in scored_docs]
+    results = qa_model(
+        question=[question] * len(contexts),
+        context=contexts,
+        batch_size=len(contexts),
+        max_seq_len=QA_MAX_SEQ_LEN,
+        doc_stride=QA_DOC_STRIDE,
+    )
+    if isinstance(results, dict):
+        results = [results]
+    weights = retrieval_weights([distance for _, distance in scored_docs])
+    candidates = [
+        ((1 - RETRIEVAL_WEIGHT) * result["score"] + RETRIEVAL_WEIGHT * weight, result["answer"], doc)
+        for result, weight, (doc, _) in zip(results, weights, scored_docs)
+    ]
+    score, answer, doc = max(candidates, key=lambda candidate: candidate[0])
+    return answer, float(score), doc
+
+def retrieve_reranked(store, question):
+    """Fetches RERANK_CANDIDATES chunks from FAISS and keeps the cross-encoder's TOP_K, or FAISS's TOP_K under load"""
+    candidates = store.similarity_search_with_score(question, k=RERANK_CANDIDATES)
+    ranked = reranker.try_rerank(question, [doc for doc, _ in candidates], TOP_K)
+    if ranked is None:
+        return candidates[:TOP_K]
+    # Higher cross-encoder scores are better; negate them so they rank like distances
+    return [(doc, -score) for doc, score in ranked]
+
+def answer_from_store(store, question):
+    # Retrieve top-k chunks with their distances
+    if reranker is None:
+        scored_docs = store.similarity_search_with_score(question, k=TOP_K)
+    else:
+        scored_docs = retrieve_reranked(store, question)
+    if not scored_docs:
+        return {"question": question, "answer": "", "score": 0.0, "context_snippet": ""}
+
+    # Use Hugging Face QA model on each chunk rather than one long concatenation
+    answer, score, doc = best_answer(question, scored_docs)
+    return {
+        "question": question,
+        "answer": answer,
+        "score": score,
+        "context_snippet": doc.page_content[:400] + "..."
+    }
+
 
 @app.on_event("startup")
 def on_startup():
     initialize_vectorstore()
+    start_ingest_workers()
 
 
 # --- /ask endpoint ---
 @app.post("/ask")
 async def ask_question(request: QuestionRequest):
     try:
-        if not vectorstore:
+        # Take the current store once; an ingest finishing mid-request swaps in a new one for later requests
+        store = vectorstore
+        if not store:
             return {"error": "Vector store not initialized."}
 
-        # Retrieve top-k chunks
-        docs = vectorstore.similarity_search(request.question, k=TOP_K)
-        context = " ".join([d.page_content for d in docs])
-
-        # Use Hugging Face QA model
-        result = qa_model(question=request.question, context=context)
-        return {
-            "question": request.question,
-            "answer": result["answer"],
-            "context_snippet": context[:400] + "..."
-        }
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(search_executor, answer_from_store, store, request.question)
     except Exception as e:
         return {"error": str(e)}
+
+
+# --- /ingest and /jobs endpoints ---
+def save_upload(upload, path):
+    with open(path, "wb") as f:
+        shutil.copyfileobj(upload.file, f)
+
+@app.post("/ingest", status_code=202)
+async def ingest(files: list[UploadFile] = File(...)):
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Ingestion workers not started.")
+    for upload in files:
+        if not (upload.filename or "").lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail=f"'{upload.filename}' is not a PDF.")
+
+    jobs = []
+    for upload in files:
+        path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.pdf")
+        await asyncio.to_thread(save_upload, upload, path)
+        jobs.append({"id": ingest_pdf(path, upload.filename), "filename": upload.filename, "status": "queued"})
+    return {"jobs": jobs}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id) if job_queue is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    job.pop("path")
+    return job
@@ -0,0 +1,76 @@
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class JobQueue:
+    """Persistent ingestion queue in a SQLite table.
+
+    Jobs move from queued to running to done or failed. Jobs left running by a
+    crashed process are put back on the queue when the queue is opened, so an
+    upload is never lost between restarts.
+    """
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, filename TEXT NOT NULL, path TEXT NOT NULL, status TEXT NOT NULL, "
+            "chunks INTEGER, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self.db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        self.db.commit()
+
+    def enqueue(self, path, filename):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self.db.execute(
+                "INSERT INTO jobs (id, filename, path, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, filename, path, now, now),
+            )
+            self.db.commit()
+            self._available.notify()
+        return job_id
+
+    def claim(self, timeout=None):
+        """Marks the oldest queued job as running and returns it, waiting up to `timeout` seconds for one"""
+        with self._lock:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                row = self.db.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._update(row["id"], status="running")
+                    return dict(row, status="running")
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._available.wait(remaining)
+
+    def complete(self, job_id, chunks):
+        with self._lock:
+            self._update(job_id, status="done", chunks=chunks)
+
+    def fail(self, job_id, error):
+        with self._lock:
+            self._update(job_id, status="failed", error=error)
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self.db.execute(
+            f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+            (*fields.values(), time.time(), job_id),
+        )
+        self.db.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
@@ -0,0 +1,129 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+RERANK_MAX_INFLIGHT = int(os.getenv("RERANK_MAX_INFLIGHT", "4"))
+
+
+def text_hash(text):
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    """Re-ranks retrieved chunks with a cross-encoder.
+
+    Scores are cached per (query hash, chunk hash) in an LRU of `cache_size`
+    entries, and only uncached pairs go through the model, `batch_size` pairs per
+    predict call. When `max_inflight` re-rankings are already running,
+    try_rerank returns None so the caller can fall back to the bi-encoder order
+    instead of queueing behind the cross-encoder.
+    """
+
+    def __init__(self, model, batch_size=RERANK_BATCH_SIZE, cache_size=RERANK_CACHE_SIZE, max_inflight=RERANK_MAX_INFLIGHT):
+        self.model = model
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.max_inflight = max_inflight
+        self.cache = OrderedDict()
+        self.inflight = 0
+        self.stats = {"reranked": 0, "skipped": 0, "cache_hits": 0, "scored_pairs": 0}
+        self._lock = threading.Lock()
+
+    def try_rerank(self, query, docs, top_k):
+        with self._lock:
+            if self.inflight >= self.max_inflight:
+                self.stats["skipped"] += 1
+                return None
+            self.inflight += 1
+        try:
+            return self.rerank(query, docs, top_k)
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+    def rerank(self, query, docs, top_k):
+        """Returns the top_k (doc, cross-encoder score) pairs, best first"""
+        query_key = text_hash(query)
+        keys = [(query_key, text_hash(doc.page_content)) for doc in docs]
+        scores = [None] * len(docs)
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    scores[i] = self.cache[key]
+            self.stats["cache_hits"] += sum(score is not None for score in scores)
+
+        misses = [i for i, score in enumerate(scores) if score is None]
+        for start in range(0, len(misses), self.batch_size):
+            batch = misses[start:start + self.batch_size]
+            predicted = self.model.predict([(query, docs[i].page_content) for i in batch], batch_size=len(batch))
+            for i, score in zip(batch, predicted):
+                scores[i] = float(score)
+
+        with self._lock:
+            for i in misses:
+                self.cache[keys[i]] = scores[i]
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            self.stats["reranked"] += 1
+            self.stats["scored_pairs"] += len(misses)
+
+        ranked = sorted(zip(docs, scores), key=lambda pair: pair[1], reverse=True)
+        return ranked[:top_k]
+
+
+# --- Latency overhead benchmark ---
+class Passage:
+    def __init__(self, page_content):
+        self.page_content = page_content
+
+
+def benchmark_rerank(model, counts=(10, 20, 50, 100), repeats=5, batch_size=RERANK_BATCH_SIZE):
+    """Measures cold-cache re-ranking latency for each candidate count"""
+    passage = "The transformer replaces recurrence with self-attention over all positions in the sequence. " * 4
+    results = []
+    for count in counts:
+        timings = []
+        for repeat in range(repeats):
+            reranker = Reranker(model, batch_size=batch_size)
+            docs = [Passage(f"{i} {passage}") for i in range(count)]
+            start = time.perf_counter()
+            reranker.rerank(f"What does the transformer use? {repeat}", docs, top_k=3)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        median = timings[len(timings) // 2]
+        results.append({
+            "candidates": count,
+            "median_ms": round(median * 1000, 2),
+            "ms_per_candidate": round(median * 1000 / count, 3),
+        })
+    return results
+
+
+def main():
+    from sentence_transformers import CrossEncoder
+
+    parser = argparse.ArgumentParser(description="Cross-encoder re-ranking latency per candidate count")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 20, 50, 100])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="rerank_benchmark.json")
+    args = parser.parse_args()
+
+    results = benchmark_rerank(CrossEncoder(RERANK_MODEL), args.counts, args.repeats)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    for row in results:
+        print(f"{row['candidates']:>4} candidates: {row['median_ms']:.2f}ms ({row['ms_per_candidate']:.3f}ms per candidate)")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,14 @@ from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 import sys
 import os
+import threading
+import time
 
 # Add the current directory to sys.path to import app
 sys.path.insert(0, os.path.dirname(__file__))
 
+from jobs import JobQueue
+from rerank import Reranker, benchmark_rerank
 import app
 
 class TestCleanText:
@@ -46,25 +50,28 @@ class TestCleanText:
         assert result == ""
 
 class TestInitializeVectorstore:
+    @patch('app.recover_vectorstore')
     @patch('app.os.path.exists')
     @patch('app.FAISS.load_local')
-    def test_load_existing_vectorstore(self, mock_load_local, mock_exists):
+    def test_load_existing_vectorstore(self, mock_load_local, mock_exists, mock_recover):
         mock_exists.return_value = True
         mock_vectorstore = MagicMock()
         mock_load_local.return_value = mock_vectorstore
 
         app.initialize_vectorstore()
 
+        mock_recover.assert_called_once()
         mock_exists.assert_called_once_with(app.VECTOR_STORE_PATH)
         mock_load_local.assert_called_once_with(app.VECTOR_STORE_PATH, app.embedding_model, allow_dangerous_deserialization=True)
         assert app.vectorstore == mock_vectorstore
 
+    @patch('app.recover_vectorstore')
     @patch('app.os.path.exists')
     @patch('app.PyPDFLoader')
     @patch('app.RecursiveCharacterTextSplitter')
     @patch('app.FAISS.from_documents')
     @patch('app.FAISS.save_local')
-    def test_create_new_vectorstore(self, mock_save_local, mock_from_documents, mock_splitter, mock_loader, mock_exists):
+    def test_create_new_vectorstore(self, mock_save_local, mock_from_documents, mock_splitter, mock_loader, mock_exists, mock_recover):
         mock_exists.return_value = False
 
         # Mock PDF loader
@@ -98,6 +105,279 @@ class TestInitializeVectorstore:
         mock_vectorstore.save_local.assert_called_once_with(app.VECTOR_STORE_PATH)
         assert app.vectorstore == mock_vectorstore
 
+class TestIngest:
+    @patch('app.FAISS.from_documents')
+    @patch('app.load_pdf_chunks')
+    def test_embed_pdf_tags_chunks_with_job(self, mock_load, mock_from_documents):
+        chunks = [MagicMock(metadata={"page": 0}), MagicMock(metadata={"page": 1})]
+        mock_load.return_value = chunks
+        store, count = app.embed_pdf("new.pdf", "job-1")
+        assert store is mock_from_documents.return_value
+        assert count == 2
+        mock_load.assert_called_once_with("new.pdf")
+        mock_from_documents.assert_called_once_with(chunks, app.embedding_model)
+        assert [chunk.metadata for chunk in chunks] == [{"page": 0, "job_id": "job-1"}, {"page": 1, "job_id": "job-1"}]
+
+    def test_ingested_job_chunks(self):
+        docs = {"a": MagicMock(metadata={"job_id": "j1"}), "b": MagicMock(metadata={"job_id": "j1"}),
+                "c": MagicMock(metadata={}), "d": MagicMock(metadata={"job_id": "j2"})}
+        store = MagicMock(index_to_docstore_id={i: doc_id for i, doc_id in enumerate(docs)})
+        store.docstore.search.side_effect = docs.get
+        assert app.ingested_job_chunks(store) == {"j1": 2, "j2": 1}
+
+    @patch('app.save_vectorstore')
+    @patch('app.FAISS.deserialize_from_bytes')
+    def test_merge_stores_swaps_in_one_merged_copy(self, mock_deserialize, mock_save):
+        current = MagicMock()
+        merged = MagicMock()
+        new_stores = [MagicMock(), MagicMock()]
+        mock_deserialize.return_value = merged
+
+        with patch.object(app, 'vectorstore', current):
+            app.merge_stores(new_stores)
+            assert app.vectorstore is merged
+
+        # The serving store is copied once per batch, never modified in place
+        current.serialize_to_bytes.assert_called_once()
+        current.merge_from.assert_not_called()
+        assert [c.args for c in merged.merge_from.call_args_list] == [(new_stores[0],), (new_stores[1],)]
+        mock_save.assert_called_once_with(merged)
+
+    @patch('app.save_vectorstore')
+    def test_merge_stores_without_store(self, mock_save):
+        first, second = MagicMock(), MagicMock()
+        with patch.object(app, 'vectorstore', None):
+            app.merge_stores([first, second])
+            assert app.vectorstore is first
+        first.merge_from.assert_called_once_with(second)
+
+    @patch('app.merge_stores')
+    @patch('app.embed_pdf')
+    def test_ingest_workers_process_queue(self, mock_embed_pdf, mock_merge_stores, tmp_path):
+        store = MagicMock()
+        mock_embed_pdf.side_effect = [(store, 3), Exception("Bad PDF")]
+        uploads = tmp_path / "uploads"
+        with patch.object(app, 'JOBS_DB_PATH', str(tmp_path / "jobs.db")), \
+                patch.object(app, 'UPLOAD_DIR', str(uploads)), \
+                patch.object(app, 'job_queue', None), patch.object(app, 'ingested_jobs', {}):
+            app.start_ingest_workers(workers=1)
+            queue = app.job_queue
+            (uploads / "good.pdf").write_bytes(b"%PDF")
+            good = app.ingest_pdf(str(uploads / "good.pdf"))
+            bad = app.ingest_pdf("bad.pdf")
+            deadline = time.time() + 5
+            while (queue.get(bad)["status"] != "failed" or queue.get(good)["status"] != "done") and time.time() < deadline:
+                time.sleep(0.01)
+            assert app.ingested_jobs == {good: 3}
+
+        assert queue.get(good)["status"] == "done"
+        assert queue.get(good)["chunks"] == 3
+        assert queue.get(bad)["error"] == "Bad PDF"
+        assert [c.args for c in mock_embed_pdf.call_args_list] == [(str(uploads / "good.pdf"), good), ("bad.pdf", bad)]
+        mock_merge_stores.assert_called_once_with([store])
+        # Finished uploads are removed
+        assert os.listdir(uploads) == []
+
+    @patch('app.embed_pdf')
+    def test_ingest_worker_skips_job_already_merged(self, mock_embed_pdf, tmp_path):
+        jobs = JobQueue(str(tmp_path / "jobs.db"))
+        job_id = jobs.enqueue("merged.pdf", "merged.pdf")
+        with patch.object(app, 'ingested_jobs', {job_id: 4}):
+            threading.Thread(target=app.ingest_worker, args=(jobs, app.queue.Queue()), daemon=True).start()
+            deadline = time.time() + 5
+            while jobs.get(job_id)["status"] != "done" and time.time() < deadline:
+                time.sleep(0.01)
+
+        assert jobs.get(job_id)["chunks"] == 4
+        mock_embed_pdf.assert_not_called()
+
+    def test_merge_worker_batches_finished_jobs(self, tmp_path):
+        jobs = JobQueue(str(tmp_path / "jobs.db"))
+        embedded = app.queue.Queue()
+        ids = [jobs.enqueue(f"{i}.pdf", f"{i}.pdf") for i in range(3)]
+        stores = [MagicMock() for _ in ids]
+        for i, (job_id, store) in enumerate(zip(ids, stores)):
+            embedded.put(({"id": job_id, "path": f"{i}.pdf"}, store, 1))
+        merged = threading.Event()
+        with patch('app.merge_stores', side_effect=lambda batch: merged.set()) as mock_merge_stores, \
+                patch.object(app, 'ingested_jobs', {}):
+            threading.Thread(target=app.merge_worker, args=(jobs, embedded), daemon=True).start()
+            assert merged.wait(5)
+            deadline = time.time() + 5
+            while jobs.get(ids[-1])["status"] != "done" and time.time() < deadline:
+                time.sleep(0.01)
+
+        # Three finished PDFs, one copy and save of the store
+        mock_merge_stores.assert_called_once_with(stores)
+        assert all(jobs.get(job_id)["status"] == "done" for job_id in ids)
+
+    def test_save_vectorstore_replaces_directory(self, tmp_path):
+        path = str(tmp_path / "faiss_store")
+        os.makedirs(path)
+        (tmp_path / "faiss_store" / "old.faiss").write_text("old")
+        def save_local(target):
+            os.makedirs(target)
+            open(os.path.join(target, "index.faiss"), "w").close()
+        store = MagicMock()
+        store.save_local.side_effect = save_local
+
+        app.save_vectorstore(store, path)
+
+        assert os.listdir(path) == ["index.faiss"]
+        assert sorted(os.listdir(tmp_path)) == ["faiss_store"]
+
+    def test_recover_after_crash_between_renames(self, tmp_path):
+        path = str(tmp_path / "faiss_store")
+        os.makedirs(path + ".old")
+        (tmp_path / "faiss_store.old" / "index.faiss").write_text("previous")
+        os.makedirs(path + ".tmp")
+
+        app.recover_vectorstore(path)
+
+        assert sorted(os.listdir(tmp_path)) == ["faiss_store"]
+        assert (tmp_path / "faiss_store" / "index.faiss").read_text() == "previous"
+
+class TestJobQueue:
+    def test_claim_in_order(self, tmp_path):
+        queue = JobQueue(str(tmp_path / "jobs.db"))
+        first = queue.enqueue("a.pdf", "a.pdf")
+        second = queue.enqueue("b.pdf", "b.pdf")
+        assert queue.claim()["id"] == first
+        assert queue.claim()["id"] == second
+        assert queue.claim(timeout=0) is None
+        assert queue.get(first)["status"] == "running"
+
+    def test_running_jobs_are_requeued_on_restart(self, tmp_path):
+        db_path = str(tmp_path / "jobs.db")
+        job_id = JobQueue(db_path).enqueue("a.pdf", "a.pdf")
+        queue = JobQueue(db_path)
+        queue.claim()
+        # The process dies mid-job
+        assert JobQueue(db_path).get(job_id)["status"] == "queued"
+
+    def test_get_missing_job(self, tmp_path):
+        assert JobQueue(str(tmp_path / "jobs.db")).get("missing") is None
+
+class TestIngestEndpoints:
+    def setup_method(self):
+        self.client = TestClient(app.app)
+
+    def test_ingest_queues_uploads(self, tmp_path):
+        queue = JobQueue(str(tmp_path / "jobs.db"))
+        with patch.object(app, 'job_queue', queue), patch.object(app, 'UPLOAD_DIR', str(tmp_path)):
+            response = self.client.post("/ingest", files=[
+                ("files", ("one.pdf", b"%PDF-1", "application/pdf")),
+                ("files", ("two.pdf", b"%PDF-2", "application/pdf")),
+            ])
+            assert response.status_code == 202
+            jobs = response.json()["jobs"]
+            assert [job["filename"] for job in jobs] == ["one.pdf", "two.pdf"]
+
+            status = self.client.get(f"/jobs/{jobs[0]['id']}").json()
+            assert status["status"] == "queued"
+            assert "path" not in status
+            with open(queue.claim()["path"], "rb") as f:
+                assert f.read() == b"%PDF-1"
+
+    def test_ingest_rejects_non_pdf(self, tmp_path):
+        queue = JobQueue(str(tmp_path / "jobs.db"))
+        with patch.object(app, 'job_queue', queue):
+            response = self.client.post("/ingest", files=[("files", ("notes.txt", b"text", "text/plain"))])
+        assert response.status_code == 400
+        assert queue.claim(timeout=0) is None
+
+    def test_ingest_before_startup(self):
+        with patch.object(app, 'job_queue', None):
+            response = self.client.post("/ingest", files=[("files", ("one.pdf", b"%PDF", "application/pdf"))])
+        assert response.status_code == 503
+
+    def test_unknown_job(self, tmp_path):
+        with patch.object(app, 'job_queue', JobQueue(str(tmp_path / "jobs.db"))):
+            response = self.client.get("/jobs/missing")
+        assert response.status_code == 404
+
+class FakeCrossEncoder:
+    """Scores a pair by the number of query words found in the passage"""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, pairs, batch_size):
+        self.batches.append(len(pairs))
+        return [sum(word in passage.split() for word in query.split()) for query, passage in pairs]
+
+class TestReranker:
+    def docs(self, *texts):
+        return [MagicMock(page_content=text) for text in texts]
+
+    def test_reranks_in_batches(self):
+        model = FakeCrossEncoder()
+        reranker = Reranker(model, batch_size=2)
+        docs = self.docs("cat", "dog cat", "bird", "dog cat fish", "fish")
+
+        ranked = reranker.rerank("dog cat fish", docs, top_k=2)
+
+        assert [doc.page_content for doc, _ in ranked] == ["dog cat fish", "dog cat"]
+        assert [score for _, score in ranked] == [3.0, 2.0]
+        assert model.batches == [2, 2, 1]
+
+    def test_scores_are_cached_per_query_and_chunk(self):
+        model = FakeCrossEncoder()
+        reranker = Reranker(model)
+        reranker.rerank("dog", self.docs("dog", "cat"), top_k=1)
+        reranker.rerank("dog", self.docs("cat", "bird"), top_k=1)
+        reranker.rerank("cat", self.docs("cat"), top_k=1)
+        # Only pairs not seen before reach the model
+        assert model.batches == [2, 1, 1]
+        assert reranker.stats["cache_hits"] == 1
+
+    def test_cache_evicts_least_recently_used(self):
+        model = FakeCrossEncoder()
+        reranker = Reranker(model, cache_size=2)
+        reranker.rerank("q", self.docs("a", "b"), top_k=1)
+        reranker.rerank("q", self.docs("a"), top_k=1)
+        reranker.rerank("q", self.docs("c"), top_k=1)
+        assert len(reranker.cache) == 2
+        reranker.rerank("q", self.docs("b"), top_k=1)
+        assert model.batches == [2, 1, 1]
+        assert reranker.stats["scored_pairs"] == 4
+
+    def test_skipped_when_busy(self):
+        reranker = Reranker(FakeCrossEncoder(), max_inflight=1)
+        reranker.inflight = 1
+        assert reranker.try_rerank("q", self.docs("a"), top_k=1) is None
+        assert reranker.stats["skipped"] == 1
+        reranker.inflight = 0
+        assert reranker.try_rerank("q", self.docs("a"), top_k=1) is not None
+        assert reranker.inflight == 0
+
+    def test_benchmark_reports_each_count(self):
+        results = benchmark_rerank(FakeCrossEncoder(), counts=(5, 10), repeats=1)
+        assert [row["candidates"] for row in results] == [5, 10]
+        assert all(row["ms_per_candidate"] >= 0 for row in results)
+
+class TestRetrieveReranked:
+    def test_fetches_candidates_and_keeps_top_k(self):
+        store = MagicMock()
+        docs = [MagicMock(page_content=text) for text in ["a", "what is b", "c", "d"]]
+        store.similarity_search_with_score.return_value = [(doc, 0.1 * i) for i, doc in enumerate(docs)]
+
+        with patch.object(app, 'reranker', Reranker(FakeCrossEncoder())), patch.object(app, 'TOP_K', 2):
+            result = app.retrieve_reranked(store, "what is b")
+
+        store.similarity_search_with_score.assert_called_once_with("what is b", k=app.RERANK_CANDIDATES)
+        assert result[0] == (docs[1], -3.0)
+        assert len(result) == 2
+
+    def test_falls_back_to_faiss_order_under_load(self):
+        store = MagicMock()
+        candidates = [(MagicMock(), 0.1), (MagicMock(), 0.2), (MagicMock(), 0.3), (MagicMock(), 0.4)]
+        store.similarity_search_with_score.return_value = candidates
+        busy = Reranker(FakeCrossEncoder(), max_inflight=0)
+
+        with patch.object(app, 'reranker', busy):
+            assert app.retrieve_reranked(store, "q") == candidates[:app.TOP_K]
+
 class TestAskEndpoint:
     def setup_method(self):
         self.client = TestClient(app.app)
@@ -109,9 +389,9 @@ class TestAskEndpoint:
         mock_doc1.page_content = "Context part 1."
         mock_doc2 = MagicMock()
         mock_doc2.page_content = "Context part 2."
-        mock_vectorstore.similarity_search.return_value = [mock_doc1, mock_doc2]
+        mock_vectorstore.similarity_search_with_score.return_value = [(mock_doc1, 0.4), (mock_doc2, 0.5)]
 
-        mock_qa_model.return_value = {"answer": "Sample answer"}
+        mock_qa_model.return_value = [{"answer": "Wrong", "score": 0.1}, {"answer": "Sample answer", "score": 0.9}]
 
         response = self.client.post("/ask", json={"question": "What is this?"})
 
@@ -119,7 +399,14 @@ class TestAskEndpoint:
         data = response.json()
         assert data["question"] == "What is this?"
         assert data["answer"] == "Sample answer"
-        assert data["context_snippet"] == "Context part 1. Context part 2...."  # since len <400
+        assert data["context_snippet"] == "Context part 2...."  # the source chunk, since len <400
+        mock_qa_model.assert_called_once_with(
+            question=["What is this?", "What is this?"],
+            context=["Context part 1.", "Context part 2."],
+            batch_size=2,
+            max_seq_len=app.QA_MAX_SEQ_LEN,
+            doc_stride=app.QA_DOC_STRIDE,
+        )
 
     @patch('app.vectorstore')
     @patch('app.qa_model')
@@ -127,15 +414,53 @@ class TestAskEndpoint:
         long_context = "A" * 500
         mock_doc = MagicMock()
         mock_doc.page_content = long_context
-        mock_vectorstore.similarity_search.return_value = [mock_doc]
+        mock_vectorstore.similarity_search_with_score.return_value = [(mock_doc, 0.2)]
 
-        mock_qa_model.return_value = {"answer": "Answer"}
+        mock_qa_model.return_value = {"answer": "Answer", "score": 0.5}
 
         response = self.client.post("/ask", json={"question": "Q"})
 
         assert response.status_code == 200
         data = response.json()
         assert data["context_snippet"] == ("A" * 400) + "..."
+        assert data["score"] == pytest.approx(0.7 * 0.5 + 0.3)
+
+    @patch('app.RETRIEVAL_WEIGHT', 0.5)
+    @patch('app.vectorstore')
+    @patch('app.qa_model')
+    def test_ask_retrieval_score_breaks_close_spans(self, mock_qa_model, mock_vectorstore):
+        near, far = MagicMock(page_content="near"), MagicMock(page_content="far")
+        mock_vectorstore.similarity_search_with_score.return_value = [(near, 0.1), (far, 2.0)]
+        mock_qa_model.return_value = [{"answer": "A", "score": 0.5}, {"answer": "B", "score": 0.55}]
+
+        response = self.client.post("/ask", json={"question": "Q"})
+
+        assert response.json()["answer"] == "A"
+
+    @patch('app.vectorstore')
+    @patch('app.qa_model')
+    def test_ask_no_chunks(self, mock_qa_model, mock_vectorstore):
+        mock_vectorstore.similarity_search_with_score.return_value = []
+
+        response = self.client.post("/ask", json={"question": "Q"})
+
+        assert response.json()["answer"] == ""
+        mock_qa_model.assert_not_called()
+
+    @patch('app.vectorstore')
+    @patch('app.qa_model')
+    def test_ask_runs_in_search_pool(self, mock_qa_model, mock_vectorstore):
+        threads = []
+        def search(question, k):
+            threads.append(threading.current_thread().name)
+            return [(MagicMock(page_content="Context"), 0.1)]
+        mock_vectorstore.similarity_search_with_score.side_effect = search
+        mock_qa_model.return_value = {"answer": "Answer", "score": 0.5}
+
+        response = self.client.post("/ask", json={"question": "Q"})
+
+        assert response.json()["answer"] == "Answer"
+        assert threads[0].startswith("search")
 
     def test_ask_vectorstore_not_initialized(self):
         with patch.object(app, 'vectorstore', None):
@@ -147,7 +472,7 @@ class TestAskEndpoint:
 
     @patch('app.vectorstore')
     def test_ask_similarity_search_exception(self, mock_vectorstore):
-        mock_vectorstore.similarity_search.side_effect = Exception("Search error")
+        mock_vectorstore.similarity_search_with_score.side_effect = Exception("Search error")
 
         response = self.client.post("/ask", json={"question": "Q"})
 
@@ -158,7 +483,7 @@ class TestAskEndpoint:
     @patch('app.vectorstore')
     @patch('app.qa_model')
     def test_ask_qa_model_exception(self, mock_qa_model, mock_vectorstore):
-        mock_vectorstore.similarity_search.return_value = [MagicMock(page_content="Context")]
+        mock_vectorstore.similarity_search_with_score.return_value = [(MagicMock(page_content="Context"), 0.1)]
         mock_qa_model.side_effect = Exception("QA error")
 
         response = self.client.post("/ask", json={"question": "Q"})
@@ -1,6 +1,14 @@
-from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi import FastAPI, HTTPException, Header, Depends, Request
 from pydantic import BaseModel
-from transformers import pipeline
+from fastapi.responses import StreamingResponse
+from transformers import pipeline, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+import asyncio
+import json
+import os
+import threading
+import torch
+from inference import InferenceExecutor, server_busy
+from engine import GenerationEngine
 
 app = FastAPI(title="LLM Question Answering API")
 
@@ -15,6 +23,70 @@ async def verify_api_key(x_api_key: str = Header(None)):
 
 qa_pipeline = pipeline("text-generation", model="bigscience/bloom-560m")
 
+# --- Inference executor (see inference.py) ---
+STREAM_TIMEOUT_SECONDS = float(os.getenv("STREAM_TIMEOUT_SECONDS", "60"))
+executor = InferenceExecutor()
+
+@app.on_event("startup")
+def start_executor():
+    executor.start()
+
+# --- Continuous batching engine (opt-in) ---
+GENERATION_ENGINE = os.getenv("GENERATION_ENGINE", "0") == "1"
+ENGINE_MAX_BATCH_SIZE = int(os.getenv("ENGINE_MAX_BATCH_SIZE", "8"))
+
+engine = GenerationEngine(qa_pipeline.model, qa_pipeline.tokenizer, max_batch_size=ENGINE_MAX_BATCH_SIZE) if GENERATION_ENGINE else None
+
+@app.on_event("shutdown")
+def on_shutdown():
+    if engine is not None:
+        engine.close()
+
+def generate_answer(question):
+    return qa_pipeline(question, max_new_tokens=100)
+
+class StopOnFlag(StoppingCriteria):
+    """Stops generate() at its next token once set, e.g. after the client has disconnected"""
+
+    def __init__(self):
+        self.flag = threading.Event()
+
+    def set(self):
+        self.flag.set()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.flag.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def generate_stream(question, streamer, stop):
+    inputs = qa_pipeline.tokenizer(question, return_tensors="pt")
+    qa_pipeline.model.generate(**inputs, streamer=streamer, max_new_tokens=100, stopping_criteria=StoppingCriteriaList([stop]))
+
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+async def stream_events(request, question, streamer, generation, stop):
+    """Yields one SSE event per decoded chunk, then a final 'done' event with the full answer"""
+    tokens = []
+    try:
+        while True:
+            if await request.is_disconnected():
+                return
+            # Reading the streamer blocks until the generation thread decodes the next token
+            token = await asyncio.to_thread(next, streamer, None)
+            if token is None:
+                break
+            if token:
+                tokens.append(token)
+                yield sse_event({"token": token})
+        await generation
+        yield sse_event({"question": question, "answer": question + "".join(tokens)}, event="done")
+    except Exception as e:
+        yield sse_event({"detail": getattr(e, "detail", str(e))}, event="error")
+    finally:
+        # Also runs when the response is cancelled on disconnect, so generate() doesn't go on to max_new_tokens
+        stop.set()
+
 @app.post("/qa", dependencies=[Depends(verify_api_key)])
 async def ask_question(request: QuestionRequest):
     question = request.question
@@ -22,8 +94,31 @@ async def ask_question(request: QuestionRequest):
         raise HTTPException(status_code=400, detail="Question cannot be empty")
 
     try:
-        response = qa_pipeline(question, max_new_tokens=100)
-        answer = response[0]["generated_text"]
+        if engine is not None:
+            if engine.is_full():
+                raise server_busy()
+            answer = await asyncio.wrap_future(engine.submit(question, max_new_tokens=100))
+        else:
+            response = await executor.run(generate_answer, question)
+            answer = response[0]["generated_text"]
         return {"question": question, "answer": answer}
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/qa/stream", dependencies=[Depends(verify_api_key)])
+async def ask_question_stream(request: QuestionRequest, http_request: Request):
+    question = request.question
+    if not question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+
+    executor.check_capacity()
+    streamer = TextIteratorStreamer(
+        qa_pipeline.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_TIMEOUT_SECONDS
+    )
+    stop = StopOnFlag()
+    generation = asyncio.ensure_future(executor.run(generate_stream, question, streamer, stop, in_process=True))
+    # Unblock the reader if generation fails before the streamer is closed
+    generation.add_done_callback(lambda f: streamer.end() if f.cancelled() or f.exception() else None)
+    return StreamingResponse(stream_events(http_request, question, streamer, generation, stop), media_type="text/event-stream")
@@ -0,0 +1,177 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+import torch
+from transformers import DynamicCache
+
+
+class GenerationRequest:
+    def __init__(self, prompt, max_new_tokens):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.generated = []
+        self.future = Future()
+
+
+def left_pad(cache, mask, length):
+    """Pads a batch's KV cache and attention mask on the left up to `length` positions"""
+    pad = length - mask.shape[1]
+    if pad == 0:
+        return cache, mask
+    mask = torch.cat([mask.new_zeros((mask.shape[0], pad)), mask], dim=1)
+    cache = tuple((pad_seq(key, pad), pad_seq(value, pad)) for key, value in cache)
+    return cache, mask
+
+
+def pad_seq(tensor, pad):
+    shape = list(tensor.shape)
+    shape[-2] = pad
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=-2)
+
+
+class GenerationEngine:
+    """Continuous batching for a causal LM.
+
+    A background thread keeps one running batch with a left-padded KV cache of
+    shape [batch, heads, seq, head_dim] per layer. New requests are prefilled and
+    merged into the batch between decode steps, and sequences leave the batch as
+    soon as they hit EOS or their max_new_tokens. Decoding is greedy, matching the
+    default generation config of bloom-560m.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, max_queue_size=64):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.eos_token_id = tokenizer.eos_token_id
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.requests = queue.Queue()
+        self.active = []
+        self.cache = None
+        self.attention_mask = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closing = False
+
+    def is_full(self):
+        return self.requests.qsize() >= self.max_queue_size
+
+    def submit(self, prompt, max_new_tokens=100):
+        """Queues a prompt and returns a Future resolving to prompt + generated text"""
+        request = GenerationRequest(prompt, max_new_tokens)
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("Generation engine is closed")
+            self.requests.put(request)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="generation-engine", daemon=True)
+                self._thread.start()
+        return request.future
+
+    def close(self):
+        """Stops the background thread once the running batch has drained"""
+        with self._lock:
+            self._closing = True
+            self.requests.put(None)
+        if self._thread is not None:
+            self._thread.join()
+
+    def _loop(self):
+        while True:
+            if self._closing and not self.active and self.requests.empty():
+                return
+            new = self._take_requests(block=not self.active)
+            try:
+                if new:
+                    self._prefill(new)
+                if self.active:
+                    self._step()
+            except Exception as e:
+                for request in self.active + new:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                self.active, self.cache, self.attention_mask = [], None, None
+
+    def _take_requests(self, block):
+        new = []
+        try:
+            if block:
+                new.append(self.requests.get())
+            while len(self.active) + len(new) < self.max_batch_size:
+                new.append(self.requests.get_nowait())
+        except queue.Empty:
+            pass
+        new = [request for request in new if request is not None]
+        # Once running, a request can no longer be cancelled out from under the batch
+        return [request for request in new if request.future.set_running_or_notify_cancel()]
+
+    def _prefill(self, new):
+        encoded = [self.tokenizer(request.prompt, return_tensors="pt")["input_ids"][0] for request in new]
+        length = max(len(ids) for ids in encoded)
+        input_ids = torch.full((len(new), length), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(new), length), dtype=torch.long)
+        for i, ids in enumerate(encoded):
+            input_ids[i, length - len(ids):] = ids
+            mask[i, length - len(ids):] = 1
+
+        with torch.no_grad():
+            outputs = self.model(input_ids=input_ids, attention_mask=mask, use_cache=True)
+        cache = outputs.past_key_values.to_legacy_cache()
+        for request, token in zip(new, outputs.logits[:, -1, :].argmax(dim=-1).tolist()):
+            request.generated.append(token)
+
+        if self.cache is None:
+            self.cache, self.attention_mask = cache, mask
+        else:
+            length = max(self.attention_mask.shape[1], mask.shape[1])
+            running_cache, running_mask = left_pad(self.cache, self.attention_mask, length)
+            cache, mask = left_pad(cache, mask, length)
+            self.cache = tuple(
+                (torch.cat([running_key, key]), torch.cat([running_value, value]))
+                for (running_key, running_value), (key, value) in zip(running_cache, cache)
+            )
+            self.attention_mask = torch.cat([running_mask, mask])
+        self.active.extend(new)
+        self._retire()
+
+    def _step(self):
+        # The last generated token of each sequence is not in the cache yet
+        input_ids = torch.tensor([[request.generated[-1]] for request in self.active])
+        self.attention_mask = torch.cat(
+            [self.attention_mask, self.attention_mask.new_ones((len(self.active), 1))], dim=1
+        )
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=self.attention_mask,
+                past_key_values=DynamicCache.from_legacy_cache(self.cache),
+                use_cache=True,
+            )
+        self.cache = outputs.past_key_values.to_legacy_cache()
+        for request, token in zip(self.active, outputs.logits[:, -1, :].argmax(dim=-1).tolist()):
+            request.generated.append(token)
+        self._retire()
+
+    def _retire(self):
+        keep = []
+        for i, request in enumerate(self.active):
+            if request.generated[-1] == self.eos_token_id or len(request.generated) >= request.max_new_tokens:
+                text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+                request.future.set_result(request.prompt + text)
+            else:
+                keep.append(i)
+        if len(keep) == len(self.active):
+            return
+        self.active = [self.active[i] for i in keep]
+        if not keep:
+            self.cache, self.attention_mask = None, None
+            return
+
+        index = torch.tensor(keep)
+        mask = self.attention_mask[index]
+        # Drop the left-padding columns that no remaining sequence needs
+        start = int(mask.any(dim=0).int().argmax())
+        self.attention_mask = mask[:, start:]
+        self.cache = tuple((key[index][..., start:, :], value[index][..., start:, :]) for key, value in self.cache)
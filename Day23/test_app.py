@@ -2,6 +2,7 @@ import pytest
 from fastapi.testclient import TestClient
 from fastapi import HTTPException
 from unittest.mock import patch, MagicMock
+from concurrent.futures import Future
 
 from app import app, verify_api_key, API_KEY, qa_pipeline
 
@@ -74,3 +75,71 @@ def test_ask_question_pipeline_exception(mock_pipeline):
     )
     assert response.status_code == 500
     assert "Mock pipeline error" in response.json()["detail"]
+
+def test_ask_question_busy():
+    with patch("app.executor.capacity", 0):
+        response = client.post("/qa", json={"question": "What is AI?"}, headers={"X-API-Key": API_KEY})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert response.json() == {"detail": "Server is busy, try again later"}
+
+class FakeStreamer:
+    def __init__(self, *args, **kwargs):
+        self.tokens = iter(["Hello", "", " world"])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.tokens)
+
+    def end(self):
+        pass
+
+def test_ask_question_stream_success():
+    with patch('app.qa_pipeline') as mock_pipeline, patch('app.TextIteratorStreamer', FakeStreamer):
+        mock_pipeline.tokenizer.return_value = {"input_ids": [[1, 2]]}
+        response = client.post("/qa/stream", json={"question": "Hi"}, headers={"X-API-Key": API_KEY})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = response.text.strip().split("\n\n")
+    assert events[0] == 'data: {"token": "Hello"}'
+    assert events[1] == 'data: {"token": " world"}'
+    assert events[2] == 'event: done\ndata: {"question": "Hi", "answer": "HiHello world"}'
+    mock_pipeline.model.generate.assert_called_once()
+
+def test_ask_question_stream_generation_error():
+    class EmptyStreamer(FakeStreamer):
+        def __init__(self, *args, **kwargs):
+            self.tokens = iter([])
+
+    with patch('app.qa_pipeline') as mock_pipeline, patch('app.TextIteratorStreamer', EmptyStreamer):
+        mock_pipeline.tokenizer.return_value = {"input_ids": [[1, 2]]}
+        mock_pipeline.model.generate.side_effect = Exception("Generation failed")
+        response = client.post("/qa/stream", json={"question": "Hi"}, headers={"X-API-Key": API_KEY})
+    assert response.status_code == 200
+    assert response.text == 'event: error\ndata: {"detail": "Generation failed"}\n\n'
+
+def test_ask_question_stream_empty_question():
+    response = client.post("/qa/stream", json={"question": "  "}, headers={"X-API-Key": API_KEY})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Question cannot be empty"
+
+def test_ask_question_uses_generation_engine():
+    future = Future()
+    future.set_result("What is AI? An answer.")
+    with patch('app.engine') as mock_engine, patch('app.qa_pipeline') as mock_pipeline:
+        mock_engine.is_full.return_value = False
+        mock_engine.submit.return_value = future
+        response = client.post("/qa", json={"question": "What is AI?"}, headers={"X-API-Key": API_KEY})
+    assert response.status_code == 200
+    assert response.json() == {"question": "What is AI?", "answer": "What is AI? An answer."}
+    mock_engine.submit.assert_called_once_with("What is AI?", max_new_tokens=100)
+    mock_pipeline.assert_not_called()
+
+def test_ask_question_generation_engine_full():
+    with patch('app.engine') as mock_engine:
+        mock_engine.is_full.return_value = True
+        response = client.post("/qa", json={"question": "What is AI?"}, headers={"X-API-Key": API_KEY})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
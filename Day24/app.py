@@ -1,9 +1,14 @@
 from fastapi import FastAPI, Request, HTTPException
 from transformers import pipeline
+from onnx_backend import sentiment_backend
+from ndjson_batch import batch_response
+import asyncio
+import os
 
 app = FastAPI()
 
-sentiment_pipeline = pipeline("sentiment-analysis")
+# SENTIMENT_BACKEND=onnx runs the same model on ONNX Runtime (see onnx_backend.py)
+sentiment_pipeline = sentiment_backend(pipeline("sentiment-analysis"))
 
 @app.post("/analyze")
 async def analyze_api(request: Request):
@@ -21,3 +26,12 @@ async def analyze_api(request: Request):
     except Exception:
         raise HTTPException(status_code=500, detail="Error processing sentence")
     return result[0]
+
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "64"))
+
+async def run_batch(batch):
+    return await asyncio.to_thread(sentiment_pipeline, batch, batch_size=len(batch))
+
+@app.post("/analyze/batch")
+async def analyze_batch_api(request: Request):
+    return await batch_response(request, run_batch, BATCH_SIZE)
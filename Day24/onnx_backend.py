@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "torch")
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "onnx_cache")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+ONNX_OPSET = 14
+
+
+def export_path(model, cache_dir=ONNX_CACHE_DIR):
+    """Cache location of a model's ONNX export, keyed by model name and hub revision"""
+    name = re.sub(r"[^\w.-]+", "__", model.config.name_or_path or "model")
+    revision = getattr(model.config, "_commit_hash", None) or "local"
+    return os.path.join(cache_dir, name, revision, "model.onnx")
+
+
+def export_onnx(model, tokenizer, cache_dir=ONNX_CACHE_DIR):
+    """Exports a sequence classifier to ONNX once and returns the cached file's path.
+
+    The export is written to a unique temporary file next to the cache entry and
+    renamed into place, so workers exporting the same model at once never write
+    into each other's file and readers only ever see a complete export.
+    """
+    path = export_path(model, cache_dir)
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dummy = tokenizer(["export"], return_tensors="pt")
+    input_names = [name for name in tokenizer.model_input_names if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+    was_training = model.training
+    model.eval()
+    fd, tmp_path = tempfile.mkstemp(suffix=".onnx.tmp", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        with torch.no_grad():
+            # A trailing dict is passed as keyword arguments, so input order doesn't depend on the forward signature
+            torch.onnx.export(
+                model,
+                ({name: dummy[name] for name in input_names},),
+                tmp_path,
+                input_names=input_names,
+                output_names=["logits"],
+                dynamic_axes=dynamic_axes,
+                opset_version=ONNX_OPSET,
+            )
+        os.replace(tmp_path, path)
+    finally:
+        model.train(was_training)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+class OnnxSentimentPipeline:
+    """Drop-in replacement for a transformers sentiment-analysis pipeline, running on ONNX Runtime.
+
+    The model is exported once per revision (see export_onnx) and run by the CPU
+    execution provider with all graph optimizations (operator fusion, constant
+    folding), which removes PyTorch's per-layer Python dispatch. Calls take a
+    string or a list of strings plus an optional batch_size and return
+    [{"label", "score"}] like the pipeline.
+    """
+
+    def __init__(self, model, tokenizer, cache_dir=ONNX_CACHE_DIR, threads=ONNX_THREADS):
+        import onnxruntime as ort
+
+        self.tokenizer = tokenizer
+        self.id2label = model.config.id2label
+        path = export_onnx(model, tokenizer, cache_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    @classmethod
+    def from_pipeline(cls, pipe, **kwargs):
+        return cls(pipe.model, pipe.tokenizer, **kwargs)
+
+    def __call__(self, inputs, batch_size=1, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        results = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True, return_tensors="np")
+            feed = {name: encoded[name].astype("int64") for name in self.input_names}
+            logits = self.session.run(["logits"], feed)[0]
+            probabilities = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            probabilities /= probabilities.sum(axis=-1, keepdims=True)
+            for row in probabilities:
+                best = int(row.argmax())
+                results.append({"label": self.id2label[best], "score": float(row[best])})
+        return results
+
+
+def sentiment_backend(pipe, backend=SENTIMENT_BACKEND):
+    """Returns the PyTorch pipeline, or an ONNX Runtime one when SENTIMENT_BACKEND=onnx"""
+    if backend == "torch":
+        return pipe
+    if backend == "onnx":
+        return OnnxSentimentPipeline.from_pipeline(pipe)
+    raise ValueError(f"Unknown sentiment backend '{backend}', expected 'torch' or 'onnx'")
+
+
+# --- Parity and latency against PyTorch ---
+SAMPLE_SENTENCES = [
+    "The movie was absolutely fantastic, I loved every moment of it!",
+    "I am really disappointed with the service, it was terrible.",
+    "The product is okay, not great but not too bad either.",
+    "Fast delivery.",
+    "The staff ignored us for the whole evening and the food was cold when it finally came.",
+    "Best purchase this year.",
+    "I would not recommend this to anyone.",
+    "It works, but the setup instructions could be a lot clearer than they are right now.",
+]
+
+
+def compare_outputs(reference, candidate, sentences=SAMPLE_SENTENCES):
+    """Label agreement and largest score difference between two sentiment pipelines"""
+    expected = reference(sentences, batch_size=len(sentences))
+    found = candidate(sentences, batch_size=len(sentences))
+    return {
+        "label_agreement": float(np.mean([e["label"] == f["label"] for e, f in zip(expected, found)])),
+        "max_score_delta": float(max(abs(e["score"] - f["score"]) for e, f in zip(expected, found))),
+    }
+
+
+def benchmark_backends(backends, batch_sizes=(1, 8, 32), repeats=10, sentences=SAMPLE_SENTENCES):
+    """Median latency per batch and per sentence of each backend at each batch size"""
+    results = []
+    for batch_size in batch_sizes:
+        batch = [sentences[i % len(sentences)] for i in range(batch_size)]
+        for name, pipe in backends.items():
+            pipe(batch, batch_size=batch_size)  # warm-up
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                pipe(batch, batch_size=batch_size)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            median = timings[len(timings) // 2]
+            results.append({
+                "backend": name,
+                "batch_size": batch_size,
+                "median_ms": round(median * 1000, 2),
+                "ms_per_sentence": round(median * 1000 / batch_size, 3),
+            })
+    return results
+
+
+def main():
+    from transformers import pipeline
+
+    parser = argparse.ArgumentParser(description="ONNX Runtime vs PyTorch sentiment pipeline: parity and latency")
+    parser.add_argument("--model", default="distilbert-base-uncased-finetuned-sst-2-english")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--output", default="onnx_benchmark.json")
+    args = parser.parse_args()
+
+    torch_pipeline = pipeline("sentiment-analysis", model=args.model, device=-1)
+    onnx_pipeline = OnnxSentimentPipeline.from_pipeline(torch_pipeline)
+    report = {
+        "parity": compare_outputs(torch_pipeline, onnx_pipeline),
+        "latency": benchmark_backends({"torch": torch_pipeline, "onnx": onnx_pipeline}, args.batch_sizes, args.repeats),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"label agreement={report['parity']['label_agreement']:.2f} max score delta={report['parity']['max_score_delta']:.2e}")
+    for row in report["latency"]:
+        print(f"{row['backend']:<6} batch={row['batch_size']:<3} {row['median_ms']:.2f}ms ({row['ms_per_sentence']:.3f}ms per sentence)")
+
+
+if __name__ == '__main__':
+    main()
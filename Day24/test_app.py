@@ -1,4 +1,6 @@
 import pytest
+import os
+import json
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 from app import app, sentiment_pipeline
@@ -52,3 +54,68 @@ def test_analyze_negative_sentiment():
         response = client.post("/analyze", json={"sentence": "I hate this."})
         assert response.status_code == 200
         assert response.json() == {'label': 'NEGATIVE', 'score': 0.8}
+
+
+def fake_batch_pipeline(sentences, batch_size):
+    return [{"label": "POSITIVE", "score": 0.9} for _ in sentences]
+
+def test_analyze_batch_json_list():
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline) as mock_pipeline, \
+         patch("app.BATCH_SIZE", 2):
+        response = client.post("/analyze/batch", json={"sentences": ["a", "b", "c"]})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert lines[0]["label"] == "POSITIVE"
+    assert mock_pipeline.call_count == 2
+
+def test_analyze_batch_ndjson_upload():
+    body = '{"sentence": "good"}\n"bad"\n\n{"sentence": "ok"}'
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline):
+        response = client.post("/analyze/batch", content=body, headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert len(response.text.splitlines()) == 3
+
+def test_analyze_batch_ndjson_invalid_line():
+    body = '"good"\n123\n'
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline):
+        response = client.post("/analyze/batch", content=body, headers={"content-type": "application/x-ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["index"] == 0
+    assert lines[-1] == {"index": 1, "error": "'sentence' must be a string"}
+
+def test_analyze_batch_missing_sentences():
+    response = client.post("/analyze/batch", json={"sentence": "a"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Missing 'sentences' key"}
+
+def test_analyze_batch_sentences_not_strings():
+    response = client.post("/analyze/batch", json={"sentences": ["a", 1]})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "'sentences' must be a list of strings"}
+
+def test_prefork_worker_exits_nonzero_on_error():
+    from prefork import PreforkServer
+    server = PreforkServer("app:app")
+    server.app = MagicMock()
+    server.sock = MagicMock()
+    cores = sorted(os.sched_getaffinity(0))[:1]
+    with patch("prefork.uvicorn.Server", side_effect=RuntimeError("bad config")), patch("traceback.print_exc"):
+        server.spawn(0, cores)
+    (pid, (worker, _, _)), = server.children.items()
+    _, status = os.waitpid(pid, 0)
+    assert worker == 0
+    assert os.waitstatus_to_exitcode(status) == 1
+
+def test_prefork_restart_backoff_doubles_until_worker_is_stable():
+    from prefork import PreforkServer, RESTART_BACKOFF_SECONDS, MAX_RESTART_BACKOFF_SECONDS, STABLE_UPTIME_SECONDS
+    server = PreforkServer("app:app")
+    delays = [server.restart_delay(0, uptime=0.5) for _ in range(3)]
+    assert delays == [RESTART_BACKOFF_SECONDS, 2 * RESTART_BACKOFF_SECONDS, 4 * RESTART_BACKOFF_SECONDS]
+    assert server.restart_delay(1, uptime=0.5) == RESTART_BACKOFF_SECONDS
+    for _ in range(20):
+        assert server.restart_delay(0, uptime=0.5) <= MAX_RESTART_BACKOFF_SECONDS
+    # A worker that ran long enough restarts immediately and starts a fresh backoff
+    assert server.restart_delay(0, uptime=STABLE_UPTIME_SECONDS) == 0
+    assert server.restart_delay(0, uptime=0.5) == RESTART_BACKOFF_SECONDS
@@ -1,9 +1,19 @@
 from fastapi import FastAPI, Request, HTTPException
 from transformers import pipeline
+from quantization import quantize_model
+from onnx_backend import SENTIMENT_BACKEND, sentiment_backend
+from ndjson_batch import batch_response
+import asyncio
+import os
 
 app = FastAPI()
 
 sentiment_pipeline = pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english")
+if SENTIMENT_BACKEND == "torch":
+    # INFERENCE_PRECISION=int8 swaps in dynamically quantized Linear layers (see quantization.py)
+    sentiment_pipeline.model = quantize_model(sentiment_pipeline.model)
+# SENTIMENT_BACKEND=onnx runs the fp32 model on ONNX Runtime instead (see onnx_backend.py)
+sentiment_pipeline = sentiment_backend(sentiment_pipeline)
 
 @app.post("/sentiment")
 async def analyze_api(request: Request):
@@ -20,4 +30,13 @@ async def analyze_api(request: Request):
         result = sentiment_pipeline(sentence)
     except Exception:
         raise HTTPException(status_code=500, detail="Error processing sentence")
-    return result[0]
\ No newline at end of file
+    return result[0]
+
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "64"))
+
+async def run_batch(batch):
+    return await asyncio.to_thread(sentiment_pipeline, batch, batch_size=len(batch))
+
+@app.post("/sentiment/batch")
+async def analyze_batch_api(request: Request):
+    return await batch_response(request, run_batch, BATCH_SIZE)
@@ -0,0 +1,191 @@
+import argparse
+import gc
+import importlib
+import itertools
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import torch
+import uvicorn
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1)))
+THREADS_PER_WORKER = int(os.getenv("THREADS_PER_WORKER", "0"))
+RESTART_BACKOFF_SECONDS = float(os.getenv("RESTART_BACKOFF_SECONDS", "1"))
+MAX_RESTART_BACKOFF_SECONDS = float(os.getenv("MAX_RESTART_BACKOFF_SECONDS", "60"))
+# A worker that stayed up this long is considered healthy again, and its next restart is immediate
+STABLE_UPTIME_SECONDS = 30
+RESTART_POLL_SECONDS = 0.1
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+
+def share_weights(module):
+    """Moves the torch weights of every pipeline in `module` into shared memory; returns the bytes shared"""
+    shared = 0
+    for value in list(vars(module).values()):
+        model = getattr(value, "model", None)
+        if not isinstance(model, torch.nn.Module):
+            continue
+        model.share_memory()
+        shared += sum(t.numel() * t.element_size() for t in itertools.chain(model.parameters(), model.buffers()))
+    return shared
+
+
+def core_slices(workers, threads=THREADS_PER_WORKER, cores=None):
+    """Splits the usable cores into one contiguous slice per worker (threads=0 splits them evenly)"""
+    cores = sorted(os.sched_getaffinity(0)) if cores is None else list(cores)
+    threads = threads or max(1, len(cores) // workers)
+    return [[cores[(i * threads + j) % len(cores)] for j in range(threads)] for i in range(workers)]
+
+
+def pin_worker(cores):
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    """Loads the app (and its model) once, then forks uvicorn workers that share it.
+
+    uvicorn --workers spawns fresh interpreters that each import the app and load
+    their own copy of the weights. Here the parent imports the app, moves the
+    torch weights into shared memory and freezes the GC so collections in the
+    workers don't write to (and copy) the parent's object pages. Each forked
+    worker is pinned to its own slice of cores with a matching torch thread
+    count and serves the shared listening socket. Workers that die are
+    restarted, with an exponential backoff while they keep dying within
+    STABLE_UPTIME_SECONDS so a crashing app doesn't fork in a tight loop;
+    SIGTERM/SIGINT stop them all.
+    """
+
+    def __init__(self, app_path, host="0.0.0.0", port=8000, workers=SERVE_WORKERS, threads=THREADS_PER_WORKER):
+        self.app_path = app_path
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.children = {}
+        self.failures = {}
+        self.restarts = {}
+        self.stopping = False
+
+    def load(self):
+        module_name, attr = self.app_path.split(":")
+        module = importlib.import_module(module_name)
+        self.app = getattr(module, attr)
+        self.shared_bytes = share_weights(module)
+
+    def run(self):
+        self.load()
+        self.sock = bind_socket(self.host, self.port)
+        gc.collect()
+        gc.freeze()
+        # Installed before the first fork, so a stop signal that arrives while workers start still stops them
+        for signum in STOP_SIGNALS:
+            signal.signal(signum, self.stop)
+        for worker, cores in enumerate(core_slices(self.workers, self.threads)):
+            self.spawn(worker, cores)
+        print(f"Serving {self.app_path} on {self.host}:{self.port} with {self.workers} workers "
+              f"({self.shared_bytes / 1e6:.0f}MB of shared weights)")
+        while self.children or (self.restarts and not self.stopping):
+            # Poll instead of blocking while a restart is waiting out its backoff
+            self.reap(block=not self.restarts)
+            self.restart_due()
+        self.sock.close()
+
+    def reap(self, block=True):
+        try:
+            pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            self.children.clear()
+            return
+        except InterruptedError:
+            return
+        if pid == 0:
+            time.sleep(RESTART_POLL_SECONDS)
+            return
+        worker, cores, started = self.children.pop(pid, (None, None, None))
+        if worker is None or self.stopping:
+            return
+        delay = self.restart_delay(worker, time.monotonic() - started)
+        print(f"Worker {worker} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, "
+              f"restarting in {delay:.1f}s")
+        self.restarts[worker] = (cores, time.monotonic() + delay)
+
+    def restart_delay(self, worker, uptime):
+        """Seconds to wait before restarting `worker`: none after a stable run, then doubling per quick failure"""
+        if uptime >= STABLE_UPTIME_SECONDS:
+            self.failures[worker] = 0
+            return 0
+        failures = self.failures.get(worker, 0)
+        self.failures[worker] = failures + 1
+        return min(MAX_RESTART_BACKOFF_SECONDS, RESTART_BACKOFF_SECONDS * 2 ** failures)
+
+    def restart_due(self):
+        now = time.monotonic()
+        for worker, (cores, due) in list(self.restarts.items()):
+            if due <= now and not self.stopping:
+                del self.restarts[worker]
+                self.spawn(worker, cores)
+
+    def spawn(self, worker, cores):
+        # Stop signals are held until the child is recorded, so stop() always sees every worker and the
+        # child can't run the parent's handler before restoring the default one
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        try:
+            if self.stopping:
+                return
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 1
+                try:
+                    for signum in STOP_SIGNALS:
+                        signal.signal(signum, signal.SIG_DFL)
+                    signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+                    pin_worker(cores)
+                    server = uvicorn.Server(uvicorn.Config(self.app))
+                    server.run(sockets=[self.sock])
+                    # uvicorn returns without raising when the app's startup fails
+                    exit_code = 0 if server.started else 1
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(exit_code)
+            self.children[pid] = (worker, cores, time.monotonic())
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an app from pre-forked workers sharing one copy of the model")
+    parser.add_argument("app", nargs="?", default="app:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--threads", type=int, default=THREADS_PER_WORKER, help="torch threads per worker, 0 splits the cores evenly")
+    args = parser.parse_args()
+    PreforkServer(args.app, args.host, args.port, args.workers, args.threads).run()
+
+
+if __name__ == '__main__':
+    main()
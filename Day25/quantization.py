@@ -0,0 +1,195 @@
+import argparse
+import io
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+PRECISIONS = ("fp32", "int8")
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32")
+
+
+def quantize_model(model, precision=INFERENCE_PRECISION):
+    """Returns `model` unchanged for fp32, or with its Linear layers dynamically quantized to int8.
+
+    Dynamic quantization stores Linear weights as int8 and quantizes activations
+    on the fly, which roughly halves the memory of transformer models and speeds
+    up CPU inference; it has no effect on GPU.
+    """
+    if precision == "fp32":
+        return model
+    if precision == "int8":
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+
+
+def model_size_bytes(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+# --- Fixed evaluation sets ---
+SENTIMENT_EVAL = [
+    ("I absolutely loved this movie, the acting was superb.", "POSITIVE"),
+    ("The service was slow and the food arrived cold.", "NEGATIVE"),
+    ("What a fantastic experience, I would come back any time.", "POSITIVE"),
+    ("This is the worst purchase I have ever made.", "NEGATIVE"),
+    ("The update made the app faster and easier to use.", "POSITIVE"),
+    ("I waited two hours and nobody answered my call.", "NEGATIVE"),
+    ("Beautiful scenery and very friendly staff.", "POSITIVE"),
+    ("The battery died after a single day, very disappointing.", "NEGATIVE"),
+    ("Clear explanations, I finally understand the topic.", "POSITIVE"),
+    ("The plot was predictable and the dialogue was dull.", "NEGATIVE"),
+    ("Great value for the price, highly recommended.", "POSITIVE"),
+    ("It broke the first time I used it.", "NEGATIVE"),
+    ("The concert was even better than I had hoped.", "POSITIVE"),
+    ("Rude staff and a dirty room ruined our stay.", "NEGATIVE"),
+    ("Delivery was quick and the packaging was perfect.", "POSITIVE"),
+    ("I regret wasting my evening on this show.", "NEGATIVE"),
+]
+
+EMBEDDING_EVAL = [
+    "Artificial intelligence enables machines to learn from data.",
+    "Neural networks are trained with gradient descent.",
+    "The transformer architecture relies on self-attention.",
+    "Large language models generate text one token at a time.",
+    "Vector databases store embeddings for similarity search.",
+    "The recipe calls for two cups of flour and one egg.",
+    "Bake the bread at 220 degrees for thirty minutes.",
+    "Fresh basil and tomatoes make a simple pasta sauce.",
+    "The football match ended in a draw after extra time.",
+    "The marathon runner finished in under three hours.",
+    "Stock markets fell sharply after the interest rate decision.",
+    "The central bank kept inflation targets unchanged.",
+    "The museum opened a new exhibition of modern art.",
+    "The orchestra performed a symphony by Beethoven.",
+    "Heavy rain is expected across the region tomorrow.",
+    "The hiking trail climbs steeply through the forest.",
+]
+
+QA_EVAL = [
+    ("What does the transformer rely on?",
+     "The transformer is a model architecture that relies entirely on self-attention, dispensing with recurrence."),
+    ("When was the company founded?",
+     "The company was founded in 1998 in a small garage in California and now employs 5,000 people."),
+    ("How many people does the company employ?",
+     "The company was founded in 1998 in a small garage in California and now employs 5,000 people."),
+    ("What is the capital of France?",
+     "Paris is the capital and most populous city of France, situated on the Seine."),
+    ("What temperature should the bread be baked at?",
+     "Bake the bread at 220 degrees for thirty minutes, until the crust is golden."),
+    ("Who composed the symphony?",
+     "Last night the orchestra performed the fifth symphony, composed by Ludwig van Beethoven in 1808."),
+]
+
+
+# --- Accuracy deltas against fp32 ---
+def sentiment_delta(reference, candidate, examples=SENTIMENT_EVAL):
+    """Compares two sentiment pipelines on labeled sentences"""
+    texts = [text for text, _ in examples]
+    labels = [label for _, label in examples]
+    ref, ref_time = timed(reference, texts, batch_size=len(texts))
+    cand, cand_time = timed(candidate, texts, batch_size=len(texts))
+    return {
+        "fp32_accuracy": float(np.mean([r["label"] == label for r, label in zip(ref, labels)])),
+        "candidate_accuracy": float(np.mean([c["label"] == label for c, label in zip(cand, labels)])),
+        "label_agreement": float(np.mean([r["label"] == c["label"] for r, c in zip(ref, cand)])),
+        "max_score_delta": float(max(abs(r["score"] - c["score"]) for r, c in zip(ref, cand))),
+        "fp32_seconds": ref_time,
+        "candidate_seconds": cand_time,
+    }
+
+
+def embedding_delta(reference, candidate, texts=EMBEDDING_EVAL, k=3):
+    """Compares two sentence embedding models by cosine similarity and top-k neighbour overlap"""
+    ref, ref_time = timed(reference.encode, texts, normalize_embeddings=True)
+    cand, cand_time = timed(candidate.encode, texts, normalize_embeddings=True)
+    cosine = np.sum(ref * cand, axis=1)
+
+    def neighbours(embeddings):
+        similarities = embeddings @ embeddings.T
+        np.fill_diagonal(similarities, -np.inf)
+        return np.argsort(-similarities, axis=1)[:, :k]
+
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(neighbours(ref), neighbours(cand))]
+    return {
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+        f"neighbour_recall_at_{k}": float(np.mean(overlap)),
+        "fp32_seconds": ref_time,
+        "candidate_seconds": cand_time,
+    }
+
+
+def qa_delta(reference, candidate, examples=QA_EVAL):
+    """Compares two question-answering pipelines by exact-match agreement of their answers"""
+    questions = [question for question, _ in examples]
+    contexts = [context for _, context in examples]
+    ref, ref_time = timed(reference, question=questions, context=contexts, batch_size=len(examples))
+    cand, cand_time = timed(candidate, question=questions, context=contexts, batch_size=len(examples))
+    return {
+        "answer_agreement": float(np.mean([r["answer"].strip() == c["answer"].strip() for r, c in zip(ref, cand)])),
+        "max_score_delta": float(max(abs(r["score"] - c["score"]) for r, c in zip(ref, cand))),
+        "fp32_seconds": ref_time,
+        "candidate_seconds": cand_time,
+    }
+
+
+def precision_report(task, model_name, precision="int8"):
+    """Loads `model_name` in fp32 and in `precision` and reports the accuracy, size and latency delta"""
+    if task == "embedding":
+        from sentence_transformers import SentenceTransformer
+        reference = SentenceTransformer(model_name, device="cpu")
+        candidate = quantize_model(SentenceTransformer(model_name, device="cpu"), precision)
+        report = embedding_delta(reference, candidate)
+        reference_model, candidate_model = reference, candidate
+    else:
+        from transformers import pipeline
+        pipeline_task = "sentiment-analysis" if task == "sentiment" else "question-answering"
+        reference = pipeline(pipeline_task, model=model_name, device=-1)
+        candidate = pipeline(pipeline_task, model=model_name, device=-1)
+        candidate.model = quantize_model(candidate.model, precision)
+        report = sentiment_delta(reference, candidate) if task == "sentiment" else qa_delta(reference, candidate)
+        reference_model, candidate_model = reference.model, candidate.model
+    report.update({
+        "task": task,
+        "model": model_name,
+        "precision": precision,
+        "fp32_size_mb": round(model_size_bytes(reference_model) / 1e6, 1),
+        "candidate_size_mb": round(model_size_bytes(candidate_model) / 1e6, 1),
+    })
+    return report
+
+
+DEFAULT_MODELS = {
+    "sentiment": "distilbert-base-uncased-finetuned-sst-2-english",
+    "embedding": "all-MiniLM-L6-v2",
+    "qa": "deepset/roberta-base-squad2",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy, size and latency of a quantized model against fp32")
+    parser.add_argument("--task", choices=sorted(DEFAULT_MODELS), nargs="+", default=sorted(DEFAULT_MODELS))
+    parser.add_argument("--precision", choices=PRECISIONS, default="int8")
+    parser.add_argument("--output", default="precision_report.json")
+    args = parser.parse_args()
+
+    reports = [precision_report(task, DEFAULT_MODELS[task], args.precision) for task in args.task]
+    with open(args.output, "w") as f:
+        json.dump(reports, f, indent=4)
+    for report in reports:
+        print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
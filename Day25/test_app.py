@@ -1,4 +1,6 @@
 import pytest
+import json
+import os
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 from app import app, sentiment_pipeline
@@ -59,3 +61,129 @@ def test_analyze_pipeline_error(mock_pipeline):
     response = client.post("/sentiment", json={"sentence": "Test sentence"})
     assert response.status_code == 500
     assert response.json() == {"detail": "Error processing sentence"}
+
+
+def fake_batch_pipeline(sentences, batch_size):
+    return [{"label": "POSITIVE", "score": 0.9} for _ in sentences]
+
+def test_sentiment_batch_json_list():
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline) as mock_pipeline, \
+         patch("app.BATCH_SIZE", 2):
+        response = client.post("/sentiment/batch", json={"sentences": ["a", "b", "c"]})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert lines[0]["label"] == "POSITIVE"
+    assert mock_pipeline.call_count == 2
+
+def test_sentiment_batch_ndjson_upload():
+    body = '{"sentence": "good"}\n"bad"\n\n{"sentence": "ok"}'
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline):
+        response = client.post("/sentiment/batch", content=body, headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert len(response.text.splitlines()) == 3
+
+def test_sentiment_batch_ndjson_invalid_line():
+    body = '"good"\n123\n'
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline):
+        response = client.post("/sentiment/batch", content=body, headers={"content-type": "application/x-ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["index"] == 0
+    assert lines[-1] == {"index": 1, "error": "'sentence' must be a string"}
+
+def test_sentiment_batch_missing_sentences():
+    response = client.post("/sentiment/batch", json={"sentence": "a"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Missing 'sentences' key"}
+
+def test_sentiment_batch_sentences_not_strings():
+    response = client.post("/sentiment/batch", json={"sentences": ["a", 1]})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "'sentences' must be a list of strings"}
+
+def test_quantize_model_int8_replaces_linear_layers():
+    import torch
+    from quantization import quantize_model, model_size_bytes
+    model = torch.nn.Sequential(torch.nn.Linear(64, 64), torch.nn.ReLU(), torch.nn.Linear(64, 2))
+    assert quantize_model(model, "fp32") is model
+    quantized = quantize_model(model, "int8")
+    assert isinstance(quantized[0], torch.ao.nn.quantized.dynamic.Linear)
+    assert model_size_bytes(quantized) < model_size_bytes(model)
+    inputs = torch.randn(4, 64)
+    assert torch.allclose(quantized(inputs), model(inputs), atol=0.1)
+    with pytest.raises(ValueError):
+        quantize_model(model, "fp8")
+
+def test_sentiment_delta_reports_agreement():
+    from quantization import sentiment_delta
+    examples = [("good", "POSITIVE"), ("bad", "NEGATIVE")]
+    reference = lambda texts, batch_size: [{"label": label, "score": 0.9} for _, label in examples]
+    candidate = lambda texts, batch_size: [{"label": "POSITIVE", "score": 0.7}, {"label": "POSITIVE", "score": 0.6}]
+    report = sentiment_delta(reference, candidate, examples)
+    assert report["fp32_accuracy"] == 1.0
+    assert report["candidate_accuracy"] == 0.5
+    assert report["label_agreement"] == 0.5
+    assert report["max_score_delta"] == pytest.approx(0.3)
+
+def test_embedding_delta_identical_models():
+    import numpy as np
+    from quantization import embedding_delta
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(6, 8)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    encoder = MagicMock()
+    encoder.encode.return_value = vectors
+    report = embedding_delta(encoder, encoder, texts=[f"t{i}" for i in range(6)], k=2)
+    assert report["mean_cosine"] == pytest.approx(1.0)
+    assert report["neighbour_recall_at_2"] == 1.0
+
+def test_core_slices_split_cores_evenly():
+    from prefork import core_slices
+    assert core_slices(2, cores=[0, 1, 2, 3]) == [[0, 1], [2, 3]]
+    assert core_slices(3, threads=1, cores=[4, 5, 6, 7]) == [[4], [5], [6]]
+    # More workers than cores: slices wrap around instead of leaving workers without a core
+    assert core_slices(3, cores=[0, 1]) == [[0], [1], [0]]
+
+def test_share_weights_are_visible_to_forked_workers():
+    import types
+    import torch
+    from prefork import share_weights
+    pipe = types.SimpleNamespace(model=torch.nn.Linear(4, 4, bias=False))
+    module = types.SimpleNamespace(sentiment_pipeline=pipe, other="not a pipeline")
+    assert share_weights(module) == 16 * 4
+    assert pipe.model.weight.is_shared()
+
+    pid = os.fork()
+    if pid == 0:
+        # A copy-on-write page would be copied here; shared memory is written in place
+        with torch.no_grad():
+            pipe.model.weight.fill_(7.0)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert torch.all(pipe.model.weight == 7.0)
+
+def test_prefork_worker_exits_nonzero_on_error():
+    from prefork import PreforkServer
+    server = PreforkServer("app:app")
+    server.app = MagicMock()
+    server.sock = MagicMock()
+    cores = sorted(os.sched_getaffinity(0))[:1]
+    with patch("prefork.uvicorn.Server", side_effect=RuntimeError("bad config")), patch("traceback.print_exc"):
+        server.spawn(0, cores)
+    (pid, (worker, _, _)), = server.children.items()
+    _, status = os.waitpid(pid, 0)
+    assert worker == 0
+    assert os.waitstatus_to_exitcode(status) == 1
+
+def test_prefork_restart_backoff_doubles_until_worker_is_stable():
+    from prefork import PreforkServer, RESTART_BACKOFF_SECONDS, MAX_RESTART_BACKOFF_SECONDS, STABLE_UPTIME_SECONDS
+    server = PreforkServer("app:app")
+    delays = [server.restart_delay(0, uptime=0.5) for _ in range(3)]
+    assert delays == [RESTART_BACKOFF_SECONDS, 2 * RESTART_BACKOFF_SECONDS, 4 * RESTART_BACKOFF_SECONDS]
+    assert server.restart_delay(1, uptime=0.5) == RESTART_BACKOFF_SECONDS
+    for _ in range(20):
+        assert server.restart_delay(0, uptime=0.5) <= MAX_RESTART_BACKOFF_SECONDS
+    # A worker that ran long enough restarts immediately and starts a fresh backoff
+    assert server.restart_delay(0, uptime=STABLE_UPTIME_SECONDS) == 0
+    assert server.restart_delay(0, uptime=0.5) == RESTART_BACKOFF_SECONDS
@@ -1,6 +1,13 @@
 from fastapi import FastAPI, Request, HTTPException, Depends, Header
 from transformers import pipeline
+import asyncio
+import os
 from pydantic import BaseModel
+from inference import InferenceExecutor, server_busy
+from engine import GenerationEngine
+from onnx_backend import sentiment_backend
+from ndjson_batch import batch_response
+from registry import ModelRegistry
 
 app = FastAPI(title="LLM Question Answering API")
 
@@ -13,8 +20,49 @@ async def verify_api_key(x_api_key: str = Header(None)):
     if x_api_key != API_KEY:
         raise HTTPException(status_code=401, detail="Invalid or missing API Key")
 
-qa_pipeline = pipeline("text-generation", model="bigscience/bloom-560m")
-sentiment_pipeline = pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english")
+# Models load on first use and are evicted LRU-first beyond MODEL_MEMORY_BUDGET_MB (see registry.py)
+registry = ModelRegistry()
+registry.register("qa", lambda: pipeline("text-generation", model="bigscience/bloom-560m"))
+# SENTIMENT_BACKEND=onnx runs the same model on ONNX Runtime (see onnx_backend.py)
+registry.register("sentiment", lambda: sentiment_backend(pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english")))
+qa_pipeline = registry.lazy("qa")
+sentiment_pipeline = registry.lazy("sentiment")
+
+# --- Inference executor (see inference.py) ---
+executor = InferenceExecutor()
+
+@app.on_event("startup")
+def start_executor():
+    executor.start()
+
+# --- Continuous batching engine (opt-in) ---
+GENERATION_ENGINE = os.getenv("GENERATION_ENGINE", "0") == "1"
+ENGINE_MAX_BATCH_SIZE = int(os.getenv("ENGINE_MAX_BATCH_SIZE", "8"))
+
+# The engine holds the model itself, so with GENERATION_ENGINE=1 bloom is loaded at startup and pinned: evicting it
+# would only drop the registry's reference, and its memory would stop counting against the budget while still in use
+engine = None
+if GENERATION_ENGINE:
+    qa_generator = registry.pin("qa")
+    engine = GenerationEngine(qa_generator.model, qa_generator.tokenizer, max_batch_size=ENGINE_MAX_BATCH_SIZE)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    if engine is not None:
+        engine.close()
+
+@app.get("/models")
+def list_models():
+    return registry.describe()
+
+def analyze_sentence(sentence):
+    return sentiment_pipeline(sentence)
+
+def analyze_batch(batch):
+    return sentiment_pipeline(batch, batch_size=len(batch))
+
+def generate_answer(question):
+    return qa_pipeline(question, max_new_tokens=100)
 
 @app.post("/sentiment")
 async def analyze_api(request: Request):
@@ -28,11 +76,22 @@ async def analyze_api(request: Request):
     if not isinstance(sentence, str):
         raise HTTPException(status_code=400, detail="'sentence' must be a string")
     try:
-        result = sentiment_pipeline(sentence)
+        result = await executor.run(analyze_sentence, sentence)
+    except HTTPException:
+        raise
     except Exception:
         raise HTTPException(status_code=500, detail="Error processing sentence")
     return result[0]
 
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "64"))
+
+async def run_batch(batch):
+    return await executor.run(analyze_batch, batch)
+
+@app.post("/sentiment/batch")
+async def analyze_batch_api(request: Request):
+    return await batch_response(request, run_batch, BATCH_SIZE)
+
 @app.post("/qa", dependencies=[Depends(verify_api_key)])
 async def ask_question(request: QuestionRequest):
     question = request.question
@@ -40,8 +99,15 @@ async def ask_question(request: QuestionRequest):
         raise HTTPException(status_code=400, detail="Question cannot be empty")
 
     try:
-        response = qa_pipeline(question, max_new_tokens=100)
-        answer = response[0]["generated_text"]
+        if engine is not None:
+            if engine.is_full():
+                raise server_busy()
+            answer = await asyncio.wrap_future(engine.submit(question, max_new_tokens=100))
+        else:
+            response = await executor.run(generate_answer, question)
+            answer = response[0]["generated_text"]
         return {"question": question, "answer": answer}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,116 @@
+import json
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+
+NDJSON = "application/x-ndjson"
+# A line that grows past this without a newline is rejected instead of buffered
+MAX_LINE_BYTES = 1 << 20
+
+
+def parse_ndjson_line(line):
+    item = json.loads(line)
+    if isinstance(item, dict):
+        item = item.get("sentence")
+    if not isinstance(item, str):
+        raise ValueError("'sentence' must be a string")
+    return item
+
+
+async def iter_lines(request: Request, max_line_bytes=MAX_LINE_BYTES):
+    """Yields the body's non-empty lines as they arrive, so an upload is never held in memory as a whole"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+        if len(pending) > max_line_bytes:
+            raise ValueError(f"Line longer than {max_line_bytes} bytes")
+    if pending.strip():
+        yield pending
+
+
+async def ndjson_batches(request: Request, batch_size, max_line_bytes=MAX_LINE_BYTES):
+    """Parses an NDJSON upload into (sentences, error) batches of up to batch_size while it is still arriving"""
+    batch, index = [], 0
+    try:
+        async for line in iter_lines(request, max_line_bytes):
+            batch.append(parse_ndjson_line(line))
+            if len(batch) == batch_size:
+                yield batch, None
+                index += len(batch)
+                batch = []
+    except ValueError as e:
+        # Rows before the bad line are still processed; the stream stops there
+        yield batch, {"index": index + len(batch), "error": str(e)}
+        return
+    if batch:
+        yield batch, None
+
+
+async def read_sentences(request: Request):
+    """Reads and validates a JSON batch body, which can only be parsed once it is complete"""
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(body, dict) or 'sentences' not in body:
+        raise HTTPException(status_code=400, detail="Missing 'sentences' key")
+    sentences = body['sentences']
+    if not isinstance(sentences, list) or not all(isinstance(s, str) for s in sentences):
+        raise HTTPException(status_code=400, detail="'sentences' must be a list of strings")
+    return sentences
+
+
+async def json_batches(sentences, batch_size):
+    for start in range(0, len(sentences), batch_size):
+        yield sentences[start:start + batch_size], None
+
+
+async def stream_results(batches, run_batch):
+    """Runs each batch through `run_batch` and yields its NDJSON lines, stopping at the first error"""
+    start = 0
+    async for sentences, error in batches:
+        if sentences:
+            try:
+                results = await run_batch(sentences)
+            except Exception:
+                yield json.dumps({"index": start, "error": "Error processing sentences"}) + "\n"
+                return
+            yield "".join(json.dumps({"index": start + i, **result}) + "\n" for i, result in enumerate(results))
+            start += len(sentences)
+        if error is not None:
+            yield json.dumps(error) + "\n"
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """StreamingResponse that reads the request body while it streams.
+
+    Starlette's StreamingResponse starts a task that reads `receive` to watch for
+    the client disconnecting. That task would consume the body messages that
+    ndjson_batches is still parsing, so this response doesn't start it. A
+    disconnect still ends the stream: reading the body raises ClientDisconnect,
+    and sending to a closed connection raises OSError.
+    """
+
+    media_type = NDJSON
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+async def batch_response(request: Request, run_batch, batch_size):
+    """Streams results as each batch finishes; NDJSON is parsed as it is uploaded, JSON is validated up front"""
+    if request.headers.get("content-type", "").startswith(NDJSON):
+        batches = ndjson_batches(request, batch_size)
+    else:
+        batches = json_batches(await read_sentences(request), batch_size)
+    return NDJSONStreamingResponse(stream_results(batches, run_batch))
@@ -0,0 +1,144 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+
+
+def rss_bytes():
+    """Resident set size of this process, from /proc on Linux (0 elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def model_memory_bytes(model):
+    """Bytes held by a pipeline's torch parameters and buffers, or None if it has none"""
+    module = getattr(model, "model", model)
+    if not hasattr(module, "parameters"):
+        return None
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class ModelRegistry:
+    """Loads named models on first use and keeps the resident set within a memory budget.
+
+    Each model is registered with a zero-argument loader. get(name) loads it
+    under a per-model lock, so concurrent first requests wait for one load
+    instead of loading twice, and other models stay available meanwhile. The
+    size of each loaded model is its torch parameter and buffer bytes, falling
+    back to the RSS growth during load. Once the loaded models exceed
+    `memory_budget_mb` (0 disables the limit), the least recently used ones are
+    dropped; callers still holding a reference keep theirs until they finish.
+    pin(name) loads a model and exempts it from eviction, for models that
+    something else (e.g. a generation engine) holds for the process lifetime.
+    """
+
+    def __init__(self, memory_budget_mb=MODEL_MEMORY_BUDGET_MB):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.loaders = {}
+        self.models = OrderedDict()
+        self.sizes = {}
+        self.stats = {"loads": 0, "evictions": 0, "hits": 0}
+        self.pinned = set()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name, loader):
+        with self._lock:
+            self.loaders[name] = loader
+            self._load_locks[name] = threading.Lock()
+
+    def lazy(self, name):
+        return LazyModel(self, name)
+
+    def pin(self, name):
+        """Loads `name` if needed and never evicts it; pinned models still count against the budget"""
+        with self._lock:
+            self.pinned.add(name)
+        return self.get(name)
+
+    def get(self, name):
+        with self._lock:
+            if name in self.models:
+                self.models.move_to_end(name)
+                self.stats["hits"] += 1
+                return self.models[name]
+            load_lock = self._load_locks[name]
+        with load_lock:
+            with self._lock:
+                if name in self.models:
+                    # Loaded by a concurrent first request while this one waited
+                    self.models.move_to_end(name)
+                    self.stats["hits"] += 1
+                    return self.models[name]
+            before = rss_bytes()
+            start = time.perf_counter()
+            model = self.loaders[name]()
+            load_seconds = time.perf_counter() - start
+            size = model_memory_bytes(model)
+            if size is None:
+                size = max(0, rss_bytes() - before)
+            with self._lock:
+                self.models[name] = model
+                self.sizes[name] = {"bytes": size, "load_seconds": round(load_seconds, 3)}
+                self.stats["loads"] += 1
+                self._evict(keep=name)
+            return model
+
+    def _evict(self, keep):
+        evicted = False
+        while self.memory_budget and self.resident_bytes() > self.memory_budget:
+            candidates = [name for name in self.models if name != keep and name not in self.pinned]
+            if not candidates:
+                # A model larger than the whole budget (or what pinned models leave of it) still gets loaded
+                break
+            oldest = candidates[0]
+            del self.models[oldest]
+            self.sizes.pop(oldest)
+            self.stats["evictions"] += 1
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def unload(self, name):
+        with self._lock:
+            if self.models.pop(name, None) is not None:
+                self.sizes.pop(name)
+        gc.collect()
+
+    def resident_bytes(self):
+        return sum(entry["bytes"] for entry in self.sizes.values())
+
+    def describe(self):
+        with self._lock:
+            return {
+                "registered": sorted(self.loaders),
+                "loaded": {name: dict(self.sizes[name]) for name in self.models},
+                "pinned": sorted(self.pinned),
+                "resident_mb": round(self.resident_bytes() / 1024 / 1024, 1),
+                "budget_mb": round(self.memory_budget / 1024 / 1024, 1),
+                **self.stats,
+            }
+
+
+class LazyModel:
+    """Stands in for a model at module scope; calls and attribute reads go to registry.get(name)"""
+
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        return self._registry.get(self._name)(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            # Introspection (mock.patch, asyncio, pickle) must not trigger a load
+            raise AttributeError(attr)
+        return getattr(self._registry.get(self._name), attr)
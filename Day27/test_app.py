@@ -1,6 +1,12 @@
 import pytest
+import json
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
+from concurrent.futures import Future
+import threading
+import time
+import torch
+from registry import ModelRegistry
 from app import app, API_KEY
 
 client = TestClient(app)
@@ -61,3 +67,148 @@ def test_qa_invalid_api_key():
     response = client.post("/qa", json={"question": "Test question"}, headers=headers)
     assert response.status_code == 401
     assert response.json() == {"detail": "Invalid or missing API Key"}
+
+
+def fake_batch_pipeline(sentences, batch_size):
+    return [{"label": "POSITIVE", "score": 0.9} for _ in sentences]
+
+def test_sentiment_batch_json_list():
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline) as mock_pipeline, \
+         patch("app.BATCH_SIZE", 2):
+        response = client.post("/sentiment/batch", json={"sentences": ["a", "b", "c"]})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert lines[0]["label"] == "POSITIVE"
+    assert mock_pipeline.call_count == 2
+
+def test_sentiment_batch_ndjson_upload():
+    body = '{"sentence": "good"}\n"bad"\n\n{"sentence": "ok"}'
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline):
+        response = client.post("/sentiment/batch", content=body, headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert len(response.text.splitlines()) == 3
+
+def test_sentiment_batch_ndjson_invalid_line():
+    body = '"good"\n123\n'
+    with patch("app.sentiment_pipeline", side_effect=fake_batch_pipeline):
+        response = client.post("/sentiment/batch", content=body, headers={"content-type": "application/x-ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["index"] == 0
+    assert lines[-1] == {"index": 1, "error": "'sentence' must be a string"}
+
+def test_sentiment_batch_missing_sentences():
+    response = client.post("/sentiment/batch", json={"sentence": "a"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Missing 'sentences' key"}
+
+def test_sentiment_batch_sentences_not_strings():
+    response = client.post("/sentiment/batch", json={"sentences": ["a", 1]})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "'sentences' must be a list of strings"}
+
+def test_qa_busy():
+    with patch("app.executor.capacity", 0):
+        response = client.post("/qa", json={"question": "What is AI?"}, headers={"x-api-key": API_KEY})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert response.json() == {"detail": "Server is busy, try again later"}
+
+def test_sentiment_busy():
+    with patch("app.executor.capacity", 0):
+        response = client.post("/sentiment", json={"sentence": "I love this!"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert response.json() == {"detail": "Server is busy, try again later"}
+
+def test_ask_question_uses_generation_engine():
+    future = Future()
+    future.set_result("What is AI? An answer.")
+    with patch('app.engine') as mock_engine, patch('app.qa_pipeline') as mock_pipeline:
+        mock_engine.is_full.return_value = False
+        mock_engine.submit.return_value = future
+        response = client.post("/qa", json={"question": "What is AI?"}, headers={"x-api-key": API_KEY})
+    assert response.status_code == 200
+    assert response.json() == {"question": "What is AI?", "answer": "What is AI? An answer."}
+    mock_engine.submit.assert_called_once_with("What is AI?", max_new_tokens=100)
+    mock_pipeline.assert_not_called()
+
+def test_ask_question_generation_engine_full():
+    with patch('app.engine') as mock_engine:
+        mock_engine.is_full.return_value = True
+        response = client.post("/qa", json={"question": "What is AI?"}, headers={"x-api-key": API_KEY})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+# Tests for the model registry
+
+class FakePipeline:
+    def __init__(self, size):
+        self.model = torch.nn.Linear(size, 256, bias=False)
+
+    def __call__(self, text):
+        return [{"label": "POSITIVE", "score": 0.9}]
+
+def test_registry_loads_on_first_use():
+    registry = ModelRegistry()
+    loader = MagicMock(return_value=FakePipeline(256))
+    registry.register("sentiment", loader)
+    lazy = registry.lazy("sentiment")
+    loader.assert_not_called()
+    assert lazy("hi") == [{"label": "POSITIVE", "score": 0.9}]
+    assert isinstance(lazy.model, torch.nn.Linear)
+    loader.assert_called_once()
+    assert registry.describe()["loaded"]["sentiment"]["bytes"] == 256 * 256 * 4
+
+def test_registry_concurrent_first_requests_load_once():
+    registry = ModelRegistry()
+    calls = []
+
+    def slow_loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return FakePipeline(8)
+    registry.register("sentiment", slow_loader)
+    threads = [threading.Thread(target=registry.get, args=("sentiment",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert registry.stats["hits"] == 7
+
+def test_registry_evicts_least_recently_used():
+    # Each fake model is 256 KiB; the budget holds two
+    registry = ModelRegistry(memory_budget_mb=0.6)
+    for name in ("a", "b", "c"):
+        registry.register(name, lambda: FakePipeline(256))
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")
+    registry.get("c")
+    assert list(registry.describe()["loaded"]) == ["a", "c"]
+    assert registry.stats["evictions"] == 1
+
+def test_registry_never_evicts_pinned_models():
+    # Each fake model is 256 KiB; the budget holds two
+    registry = ModelRegistry(memory_budget_mb=0.6)
+    for name in ("qa", "b", "c"):
+        registry.register(name, lambda: FakePipeline(256))
+    registry.pin("qa")
+    registry.get("b")
+    registry.get("c")
+    assert list(registry.describe()["loaded"]) == ["qa", "c"]
+    assert registry.describe()["pinned"] == ["qa"]
+    assert registry.stats["evictions"] == 1
+
+def test_registry_keeps_model_larger_than_budget():
+    registry = ModelRegistry(memory_budget_mb=0.1)
+    registry.register("big", lambda: FakePipeline(256))
+    registry.get("big")
+    assert list(registry.describe()["loaded"]) == ["big"]
+
+def test_models_endpoint():
+    response = client.get("/models")
+    assert response.status_code == 200
+    assert response.json()["registered"] == ["qa", "sentiment"]
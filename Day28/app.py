@@ -1,9 +1,14 @@
 from fastapi import FastAPI, HTTPException, Header, Depends, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import logging
 import asyncio
 from datetime import datetime
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+import os
+from inference import InferenceExecutor
+from cache import ResultCache, make_key, normalize_text
+from warmup import WARMUP_NEW_TOKENS, Readiness
 
 API_KEY = "my-secret-key"
     
@@ -16,6 +21,42 @@ model_name = "google/flan-t5-base"
 tokenizer = AutoTokenizer.from_pretrained(model_name)
 model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
 
+# Sampling makes every call return a different summary; deterministic mode decodes greedily
+DETERMINISTIC_GENERATION = os.getenv("DETERMINISTIC_GENERATION", "0") == "1"
+if DETERMINISTIC_GENERATION:
+    GENERATION_PARAMS = {"max_new_tokens": 150, "do_sample": False}
+else:
+    GENERATION_PARAMS = {"max_new_tokens": 150, "temperature": 0.7, "do_sample": True}
+
+SUMMARY_PROMPT = "Summarize the following text in 3 concise sentences:\n\n{text}"
+KEYWORDS_PROMPT = "Extract 5 important keywords from this summary:\n\n{summary}\n\nKeywords:"
+GENERATION_BATCH_SIZE = int(os.getenv("GENERATION_BATCH_SIZE", "8"))
+MAX_BATCH_TEXTS = int(os.getenv("MAX_BATCH_TEXTS", "64"))
+
+# --- Result cache ---
+# Sampled results are only cached when explicitly allowed, since repeats would otherwise differ
+CACHE_ENABLED = DETERMINISTIC_GENERATION or os.getenv("CACHE_SAMPLED_RESULTS", "0") == "1"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS")) if os.getenv("CACHE_TTL_SECONDS") else None
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH")
+CACHE_MAX_DB_ENTRIES = int(os.getenv("CACHE_MAX_DB_ENTRIES", "100000"))
+
+result_cache = ResultCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    db_path=CACHE_DB_PATH,
+    max_db_entries=CACHE_MAX_DB_ENTRIES,
+)
+
+async def cache_call(method, *args):
+    # SQLite reads and commits block, so with a disk tier the cache is used from a worker thread
+    if result_cache.db is None:
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+# --- Inference executor (see inference.py) ---
+executor = InferenceExecutor()
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
@@ -33,6 +74,9 @@ app = FastAPI(title="Text Summarization & Keyword Extraction API")
 # Request body schema
 class TextRequest(BaseModel):
     text: str
+
+class BatchTextRequest(BaseModel):
+    texts: list[str]
     
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -53,34 +97,135 @@ async def log_requests(request: Request, call_next):
 
 def run_model(prompt: str) -> str:
     inputs = tokenizer(prompt, return_tensors="pt", truncation=True)
-    outputs = model.generate(
-        **inputs,
-        max_new_tokens=150,
-        temperature=0.7,
-        do_sample=True
-    )
+    outputs = model.generate(**inputs, **GENERATION_PARAMS)
     return tokenizer.decode(outputs[0], skip_special_tokens=True)
 
+def run_model_batch(prompts: list[str], batch_size: int = GENERATION_BATCH_SIZE) -> list[str]:
+    """Generates for each prompt in padded batches, running every distinct prompt only once.
+
+    Within a generate call the encoder runs once per batch and its output is reused for
+    every decoding step. The keyword pass can't reuse the summary pass's encoder output:
+    its input is the generated summary, a different sequence, so it has to be encoded anew.
+    """
+    # The same document twice in a batch is encoded and generated once
+    unique = list(dict.fromkeys(prompts))
+    # Longest prompts first so each padded batch wastes as little compute as possible
+    order = sorted(range(len(unique)), key=lambda i: len(unique[i]), reverse=True)
+    generated = {}
+    for start in range(0, len(order), batch_size):
+        batch = [unique[i] for i in order[start:start + batch_size]]
+        inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True)
+        outputs = model.generate(**inputs, **GENERATION_PARAMS)
+        for prompt, text in zip(batch, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+            generated[prompt] = text
+    return [generated[prompt] for prompt in prompts]
+
 def summarize_text(text: str) -> str:
-    prompt = f"Summarize the following text in 3 concise sentences:\n\n{text}"
+    prompt = SUMMARY_PROMPT.format(text=text)
     return run_model(prompt)
 
 def extract_keywords(summary: str) -> str:
-    prompt = f"Extract 5 important keywords from this summary:\n\n{summary}\n\nKeywords:"
+    prompt = KEYWORDS_PROMPT.format(summary=summary)
     return run_model(prompt)
 
+def summarize_and_extract_many(texts: list[str]) -> list[dict]:
+    """Runs every summary prompt as batched generate calls, then every keyword prompt the same way"""
+    summaries = run_model_batch([SUMMARY_PROMPT.format(text=text) for text in texts])
+    keywords = run_model_batch([KEYWORDS_PROMPT.format(summary=summary) for summary in summaries])
+    return [{"summary": summary, "keywords": kw} for summary, kw in zip(summaries, keywords)]
+
 @app.post("/summarize", dependencies=[Depends(verify_api_key)])
 async def summarize_and_extract(req: TextRequest):
-    text = req.text.strip()
+    # The model sees the same whitespace-normalized text the cache key is built from
+    text = normalize_text(req.text)
     if not text:
         raise HTTPException(status_code=400, detail="Input text cannot be empty.")
 
+    key = make_key(text, model_name, GENERATION_PARAMS) if CACHE_ENABLED else None
+    if key is not None:
+        cached = await cache_call(result_cache.get, key)
+        if cached is not None:
+            return cached
+
     try:
-        summary = summarize_text(text)
-        keywords = extract_keywords(summary)
-        return {
+        summary = await executor.run(summarize_text, text)
+        keywords = await executor.run(extract_keywords, summary)
+        result = {
             "summary": summary,
             "keywords": keywords
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+    if key is not None:
+        await cache_call(result_cache.set, key, result)
+    return result
+
+@app.post("/summarize/batch", dependencies=[Depends(verify_api_key)])
+async def summarize_and_extract_batch(req: BatchTextRequest):
+    texts = [normalize_text(text) for text in req.texts]
+    if not texts or not all(texts):
+        raise HTTPException(status_code=400, detail="Input texts cannot be empty.")
+    if len(texts) > MAX_BATCH_TEXTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_TEXTS} texts per batch.")
+
+    results = [None] * len(texts)
+    keys = [make_key(text, model_name, GENERATION_PARAMS) if CACHE_ENABLED else None for text in texts]
+    for i, key in enumerate(keys):
+        if key is not None:
+            results[i] = await cache_call(result_cache.get, key)
+    # Longest texts first, so each chunk pads similar lengths together
+    missing = sorted((i for i, result in enumerate(results) if result is None), key=lambda i: len(texts[i]), reverse=True)
+
+    # Each chunk of GENERATION_BATCH_SIZE texts takes its own executor slot, so a batch queues like the requests it replaces
+    for start in range(0, len(missing), GENERATION_BATCH_SIZE):
+        chunk = missing[start:start + GENERATION_BATCH_SIZE]
+        try:
+            computed = await executor.run(summarize_and_extract_many, [texts[i] for i in chunk])
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        for i, result in zip(chunk, computed):
+            results[i] = result
+            if keys[i] is not None:
+                await cache_call(result_cache.set, keys[i], result)
+    return {"results": results}
+
+@app.get("/cache/stats", dependencies=[Depends(verify_api_key)])
+async def cache_stats():
+    return {"enabled": CACHE_ENABLED, **await cache_call(result_cache.get_stats)}
+
+# --- Warm-up and probes ---
+readiness = Readiness()
+
+def warm_generate(text):
+    # Straight through generate, so warm-up outputs never reach the result cache
+    for batch in ([text], [text] * GENERATION_BATCH_SIZE):
+        inputs = tokenizer([SUMMARY_PROMPT.format(text=t) for t in batch], return_tensors="pt", padding=True, truncation=True)
+        model.generate(**inputs, max_new_tokens=WARMUP_NEW_TOKENS)
+
+def warm_model(text):
+    if executor.use_processes:
+        # Every call runs in a pool worker with its own copy of the model, so each worker is warmed up instead
+        executor.broadcast(warm_generate, text)
+    else:
+        warm_generate(text)
+
+@app.on_event("startup")
+def start_executor():
+    executor.start()
+
+@app.on_event("startup")
+def start_warmup():
+    readiness.start({"flan-t5": warm_model})
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.describe())
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace so reformatted copies of a document share a cache entry"""
+    return " ".join(text.split())
+
+
+def make_key(text: str, model_name: str, params: dict) -> str:
+    payload = json.dumps(
+        {"text": normalize_text(text), "model": model_name, "params": params},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed result cache: an in-memory LRU in front of an optional SQLite table.
+
+    Entries expire after `ttl_seconds` (if set); each tier evicts its least recently
+    used entries once it holds more than its size limit.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=None, db_path=None, max_db_entries=100_000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_db_entries = max_db_entries
+        self.memory = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+            self.db.commit()
+            # Counted once here and kept up to date, so inserts know when eviction is due without a scan
+            self.db_entries = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at, now):
+                    self.memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    self.db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                    self.db.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.stats["disk_hits"] += 1
+                    return value
+                if row is not None:
+                    self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self.db.commit()
+                    self.db_entries -= 1
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self.db is not None:
+                exists = self.db.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is not None
+                self.db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now),
+                )
+                if not exists:
+                    self.db_entries += 1
+                if self.db_entries > self.max_db_entries:
+                    # Walks the accessed_at index from the oldest end, touching only the rows it removes
+                    self.db.execute(
+                        "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)",
+                        (self.db_entries - self.max_db_entries,),
+                    )
+                    self.db_entries = self.max_db_entries
+                self.db.commit()
+
+    def _remember(self, key, value, created_at):
+        self.memory[key] = (value, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self.memory)
+            if self.db is not None:
+                stats["disk_entries"] = self.db_entries
+            return stats
@@ -3,7 +3,11 @@ from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock, AsyncMock
 import asyncio
 import os
+import time
 from app import app, API_KEY, log_to_file, run_model, summarize_text, extract_keywords
+from cache import ResultCache, make_key
+from inference import InferenceExecutor
+from warmup import WARMUP_LENGTHS, Readiness
 
 client = TestClient(app)
 
@@ -119,3 +123,209 @@ def test_middleware_logging(mock_log_to_file):
     log_message = args[0]
     assert "POST /summarize" in log_message
     assert "status=200" in log_message
+
+def test_summarize_busy():
+    with patch("app.executor.capacity", 0):
+        response = client.post("/summarize", json={"text": "Test text"}, headers={"x-api-key": API_KEY})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert response.json() == {"detail": "Server is busy, try again later"}
+
+def test_process_pool_executor_uses_spawned_workers():
+    executor = InferenceExecutor(workers=2, queue_size=0, use_processes=True)
+    try:
+        assert executor.pool._mp_context.get_start_method() == "spawn"
+        executor.start()
+        # One call in every worker, none in this process
+        pids = executor.broadcast(os.getpid)
+        assert len(set(pids)) == 2 and os.getpid() not in pids
+        async def run_calls():
+            return await asyncio.gather(executor.run(os.getpid), executor.run(pow, 2, 10))
+        pid, power = asyncio.run(run_calls())
+        assert pid != os.getpid()
+        assert power == 1024
+    finally:
+        executor.pool.shutdown()
+
+def test_broadcast_raises_when_a_worker_never_reaches_the_barrier():
+    executor = InferenceExecutor(workers=2, queue_size=0, use_processes=True)
+    try:
+        executor.start()
+        executor.broadcast_timeout = 0.5
+        # One worker is busy past the timeout, so the other waits at the barrier alone
+        busy = executor.pool.submit(time.sleep, 3)
+        with pytest.raises(RuntimeError, match="did not reach all 2 inference workers"):
+            executor.broadcast(os.getpid)
+        busy.result()
+    finally:
+        executor.pool.shutdown()
+        executor.local_pool.shutdown()
+
+def test_process_pool_executor_rejects_fork():
+    with pytest.raises(ValueError):
+        InferenceExecutor(use_processes=True, start_method="fork")
+
+# Tests for the result cache
+
+def test_make_key_normalizes_whitespace():
+    params = {"do_sample": False}
+    assert make_key("Some  text\n here", "m", params) == make_key("Some text here", "m", params)
+    assert make_key("Some text here", "m", params) != make_key("Some text here", "m", {"do_sample": True})
+    assert make_key("Some text here", "m", params) != make_key("Some text here", "other", params)
+
+def test_result_cache_lru_eviction():
+    cache = ResultCache(max_entries=2)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+    cache.set("c", {"v": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    assert cache.get_stats()["memory_hits"] == 2
+    assert cache.get_stats()["misses"] == 1
+
+def test_result_cache_ttl_expiry():
+    cache = ResultCache(ttl_seconds=10)
+    with patch('cache.time.time', return_value=100.0):
+        cache.set("a", {"v": 1})
+    with patch('cache.time.time', return_value=105.0):
+        assert cache.get("a") == {"v": 1}
+    with patch('cache.time.time', return_value=111.0):
+        assert cache.get("a") is None
+
+def test_result_cache_disk_tier_survives_restart(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    ResultCache(db_path=db_path).set("a", {"summary": "s", "keywords": "k"})
+    cache = ResultCache(db_path=db_path)
+    assert cache.get("a") == {"summary": "s", "keywords": "k"}
+    assert cache.get_stats()["disk_hits"] == 1
+    assert cache.get("a") == {"summary": "s", "keywords": "k"}
+    assert cache.get_stats()["memory_hits"] == 1
+
+def test_result_cache_disk_size_limit(tmp_path):
+    cache = ResultCache(max_entries=1, db_path=str(tmp_path / "cache.db"), max_db_entries=2)
+    for key in ["a", "b", "c"]:
+        cache.set(key, {"v": key})
+    assert cache.get_stats()["disk_entries"] == 2
+    assert cache.get("a") is None
+
+def test_result_cache_evicts_only_over_capacity(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = ResultCache(max_entries=1, db_path=db_path, max_db_entries=2)
+    statements = []
+    cache.db.set_trace_callback(statements.append)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    cache.set("a", {"v": 3})
+    assert not any(s.startswith("DELETE") for s in statements)
+    cache.set("c", {"v": 4})
+    assert sum(s.startswith("DELETE") for s in statements) == 1
+    assert cache.get("b") is None
+    # The row count is picked up again from the table on reopen
+    assert ResultCache(db_path=db_path, max_db_entries=2).get_stats()["disk_entries"] == 2
+
+@patch('app.extract_keywords')
+@patch('app.summarize_text')
+def test_summarize_uses_cache(mock_summarize, mock_extract):
+    mock_summarize.return_value = "This is a summary."
+    mock_extract.return_value = "keyword1, keyword2"
+    headers = {"x-api-key": API_KEY}
+    with patch('app.CACHE_ENABLED', True), patch('app.result_cache', ResultCache()):
+        first = client.post("/summarize", json={"text": "  Cache   me please. "}, headers=headers)
+        second = client.post("/summarize", json={"text": "Cache me please."}, headers=headers)
+        stats = client.get("/cache/stats", headers=headers).json()
+    assert first.json() == second.json() == {"summary": "This is a summary.", "keywords": "keyword1, keyword2"}
+    # The model gets the same normalized text the cache key is built from
+    mock_summarize.assert_called_once_with("Cache me please.")
+    assert stats["enabled"] is True
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+
+@patch('app.extract_keywords', return_value="keyword1")
+@patch('app.summarize_text', return_value="A summary.")
+def test_summarize_uses_disk_cache(mock_summarize, mock_extract, tmp_path):
+    headers = {"x-api-key": API_KEY}
+    cache = ResultCache(db_path=str(tmp_path / "cache.db"))
+    with patch('app.CACHE_ENABLED', True), patch('app.result_cache', cache):
+        client.post("/summarize", json={"text": "Cache me on disk."}, headers=headers)
+        cache.memory.clear()
+        response = client.post("/summarize", json={"text": "Cache me on disk."}, headers=headers)
+        stats = client.get("/cache/stats", headers=headers).json()
+    assert response.json() == {"summary": "A summary.", "keywords": "keyword1"}
+    mock_summarize.assert_called_once()
+    assert stats["disk_hits"] == 1
+    assert stats["disk_entries"] == 1
+
+# Tests for /summarize/batch endpoint
+
+@patch('app.summarize_and_extract_many')
+def test_summarize_batch_success(mock_many):
+    mock_many.return_value = [{"summary": "S1", "keywords": "K1"}, {"summary": "S2", "keywords": "K2"}]
+    headers = {"x-api-key": API_KEY}
+    response = client.post("/summarize/batch", json={"texts": ["Text one.", "Text two."]}, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"results": [{"summary": "S1", "keywords": "K1"}, {"summary": "S2", "keywords": "K2"}]}
+    mock_many.assert_called_once_with(["Text one.", "Text two."])
+
+@patch('app.summarize_and_extract_many')
+def test_summarize_batch_runs_in_chunks(mock_many):
+    mock_many.side_effect = lambda texts: [{"summary": text, "keywords": "K"} for text in texts]
+    texts = ["a", "bbb", "cc", "dddd", "e"]
+    with patch('app.GENERATION_BATCH_SIZE', 2):
+        response = client.post("/summarize/batch", json={"texts": texts}, headers={"x-api-key": API_KEY})
+    assert response.status_code == 200
+    assert [r["summary"] for r in response.json()["results"]] == texts
+    assert [c.args[0] for c in mock_many.call_args_list] == [["dddd", "bbb"], ["cc", "a"], ["e"]]
+
+def test_summarize_batch_too_large():
+    with patch('app.MAX_BATCH_TEXTS', 2):
+        response = client.post("/summarize/batch", json={"texts": ["a", "b", "c"]}, headers={"x-api-key": API_KEY})
+    assert response.status_code == 413
+    assert response.json() == {"detail": "At most 2 texts per batch."}
+
+@patch('app.summarize_and_extract_many')
+def test_summarize_batch_only_computes_cache_misses(mock_many):
+    mock_many.return_value = [{"summary": "S2", "keywords": "K2"}]
+    cache = ResultCache()
+    cache.set(make_key("Text one.", "google/flan-t5-base", {"p": 1}), {"summary": "S1", "keywords": "K1"})
+    headers = {"x-api-key": API_KEY}
+    with patch('app.CACHE_ENABLED', True), patch('app.result_cache', cache), patch('app.GENERATION_PARAMS', {"p": 1}):
+        response = client.post("/summarize/batch", json={"texts": ["Text one.", "Text two."]}, headers=headers)
+    assert response.json()["results"] == [{"summary": "S1", "keywords": "K1"}, {"summary": "S2", "keywords": "K2"}]
+    mock_many.assert_called_once_with(["Text two."])
+
+def test_summarize_batch_empty_text():
+    headers = {"x-api-key": API_KEY}
+    response = client.post("/summarize/batch", json={"texts": ["ok", "  "]}, headers=headers)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Input texts cannot be empty."}
+
+def test_readyz_after_warmup_skips_result_cache():
+    readiness = Readiness()
+    with patch("app.model") as mock_model, patch("app.tokenizer") as mock_tokenizer, \
+         patch("app.readiness", readiness), patch("app.result_cache") as mock_cache:
+        with TestClient(app) as warm_client:
+            assert readiness.wait(timeout=10)
+            response = warm_client.get("/readyz")
+    assert response.status_code == 200
+    assert set(response.json()["warmup_ms"]) == {f"flan-t5/{length}" for length in WARMUP_LENGTHS}
+    # One single and one batched generate call per warm-up length
+    assert mock_model.generate.call_count == 2 * len(WARMUP_LENGTHS)
+    mock_cache.set.assert_not_called()
+
+def test_readyz_waits_for_process_pool_warmup():
+    import app as app_module
+    readiness = Readiness()
+    executor = MagicMock(use_processes=True)
+    with patch("app.model") as mock_model, patch("app.executor", executor), patch("app.readiness", readiness):
+        with TestClient(app) as warm_client:
+            assert readiness.wait(timeout=10)
+            assert warm_client.get("/readyz").status_code == 200
+    # Calls run in the pool workers, so they are the ones warmed up, each of them once per length
+    assert [call.args[0] for call in executor.broadcast.call_args_list] == [app_module.warm_generate] * len(WARMUP_LENGTHS)
+    mock_model.generate.assert_not_called()
+
+def test_healthz_needs_no_api_key():
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
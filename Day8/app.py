@@ -1,7 +1,9 @@
 from transformers import pipeline
+from onnx_backend import sentiment_backend
 
 # Load pre-trained sentiment analysis pipeline
-sentiment_pipeline = pipeline("sentiment-analysis")
+# SENTIMENT_BACKEND=onnx runs the same model on ONNX Runtime (see onnx_backend.py)
+sentiment_pipeline = sentiment_backend(pipeline("sentiment-analysis"))
 
 def main():
     # Analyze text
@@ -1,4 +1,5 @@
 import pytest
+import os
 from unittest.mock import patch, MagicMock
 
 def test_sentiment_pipeline_loading():
@@ -59,3 +60,60 @@ def test_sentiment_analysis_edge_cases():
         special_text = "Wow! @#$%^&*()"
         result = app.sentiment_pipeline(special_text)
         assert result == [{'label': 'POSITIVE', 'score': 0.5}]
+
+# onnx_backend.py is copied unchanged into Day10, Day24, Day25 and Day27; its tests live only here
+def tiny_sentiment_model(tmp_path):
+    import torch
+    from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizerFast
+    words = "the movie was fantastic i loved it service terrible really disappointed okay".split()
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+    config = DistilBertConfig(vocab_size=len(words) + 5, dim=32, hidden_dim=64, n_layers=2, n_heads=2,
+                              id2label={0: "NEGATIVE", 1: "POSITIVE"}, label2id={"NEGATIVE": 0, "POSITIVE": 1})
+    torch.manual_seed(0)
+    return DistilBertForSequenceClassification(config).eval(), DistilBertTokenizerFast(str(vocab))
+
+def test_onnx_pipeline_matches_pytorch(tmp_path):
+    from transformers import pipeline
+    from onnx_backend import OnnxSentimentPipeline, compare_outputs, export_path
+    model, tokenizer = tiny_sentiment_model(tmp_path)
+    reference = pipeline("sentiment-analysis", model=model, tokenizer=tokenizer, device=-1)
+    onnx_pipeline = OnnxSentimentPipeline(model, tokenizer, cache_dir=str(tmp_path / "cache"))
+
+    assert os.path.exists(export_path(model, str(tmp_path / "cache")))
+    assert onnx_pipeline("the movie was fantastic")[0].keys() == {"label", "score"}
+    parity = compare_outputs(reference, onnx_pipeline)
+    assert parity["label_agreement"] == 1.0
+    assert parity["max_score_delta"] < 1e-4
+    assert len(onnx_pipeline(["okay"] * 5, batch_size=2)) == 5
+
+def test_export_onnx_writes_unique_temp_files(tmp_path):
+    from onnx_backend import export_onnx
+    model, tokenizer = tiny_sentiment_model(tmp_path)
+    targets = []
+
+    def fake_export(model, args, target, **kwargs):
+        targets.append(target)
+        with open(target, "wb") as f:
+            f.write(b"onnx")
+
+    with patch("onnx_backend.torch.onnx.export", side_effect=fake_export):
+        path = export_onnx(model, tokenizer, cache_dir=str(tmp_path / "cache"))
+        os.remove(path)
+        assert export_onnx(model, tokenizer, cache_dir=str(tmp_path / "cache")) == path
+    # Each export gets its own file next to the cache entry, and only the finished export is left
+    assert len(set(targets)) == 2
+    assert {os.path.dirname(target) for target in targets} == {os.path.dirname(path)}
+    assert os.listdir(os.path.dirname(path)) == ["model.onnx"]
+
+def test_benchmark_backends_reports_each_batch_size():
+    from onnx_backend import benchmark_backends
+    fake = lambda batch, batch_size: [{"label": "POSITIVE", "score": 0.9}] * len(batch)
+    results = benchmark_backends({"torch": fake, "onnx": fake}, batch_sizes=(1, 8, 32), repeats=2)
+    assert [(row["backend"], row["batch_size"]) for row in results] == [
+        ("torch", 1), ("onnx", 1), ("torch", 8), ("onnx", 8), ("torch", 32), ("onnx", 32)]
+
+def test_sentiment_backend_unknown():
+    from onnx_backend import sentiment_backend
+    with pytest.raises(ValueError):
+        sentiment_backend(MagicMock(), "tensorrt")